@@ -1,33 +1,43 @@
-import nltk
 import os
 import logging
-from flask import Flask, request, jsonify, send_file, session # Added session
+from flask import Flask, Blueprint, current_app, request, jsonify, send_file, session, stream_with_context # Added session
 from flask_cors import CORS
-from google.cloud import texttospeech, speech, vision
-from google.api_core import exceptions
 import io
 from dotenv import load_dotenv
-from nltk.corpus import stopwords, wordnet
-from nltk.tokenize import sent_tokenize, word_tokenize
-from nltk.probability import FreqDist
-from nltk.chunk import RegexpParser
-from heapq import nlargest
-import string
-import re
-from collections import Counter
 import traceback
-import google.generativeai as genai
 import json
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from werkzeug.utils import secure_filename
-import language_tool_python  # Added for grammar check
-import uuid  # Added for generating unique IDs
 import base64
-from googletrans import Translator
+import hashlib
 from werkzeug.security import generate_password_hash, check_password_hash # Added for password hashing
 import datetime # Added for timestamps
 from functools import wraps # Added for decorators
+import sqlite3
+import gc
+from itertools import chain
+import threading
+import time
+from user_store import UserStore, normalize_timestamp, utc_timestamp
+from history_writer import HistoryWriter
+from services import ServiceRegistry, UNINITIALIZED, INITIALIZING
+from provision import NLTK_DATA_DIR, configure_nltk_path, validate_nltk_data
+from health import HealthProber, AVAILABLE
+from language_segmentation import segment_sentences
+from tts_synthesis import (LANGUAGE_CODES, RENDER_MODES, SSML_VOICES, iter_clips, iter_multilingual,
+                           split_sentences, synthesize_multilingual, synthesize_sentences)
+from tts_cache import EXTENSIONS, TTSCache
+from singleflight import SingleFlight
+from cache_warmer import CacheWarmer, TEXTTOSPEECH, load_warm_set
+import audio_formats
+from voice_catalog import VoiceCatalog, fetch_voices
+import tts_batch
+from jobs import JobLimitError, JobQueue, FINISHED
+
+# Heavy client libraries (google.cloud.*, google.generativeai, language_tool_python,
+# nltk) are imported inside the code paths that use them, not here, so that
+# importing this module stays fast for autoscaling and rolling restarts.
 
 # --- Configuration and Initialization (Same as previous, with additions) ---
 
@@ -41,58 +51,121 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Initialize Flask app
-app = Flask(__name__, static_folder='static')
-app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'your_very_secret_key_here_change_me') # Added SECRET_KEY for sessions
-CORS(app, resources={r"/api/*": {"origins": "http://localhost:8080"}}, supports_credentials=True) # Ensure frontend origin is allowed and credentials supported
+def load_config():
+    # Settings come from the environment; values passed to create_app() override them
+    here = os.path.dirname(__file__)
+    return {
+        'SECRET_KEY': os.environ.get('FLASK_SECRET_KEY', 'your_very_secret_key_here_change_me'), # Added SECRET_KEY for sessions
+        'CORS_ORIGINS': os.environ.get('CORS_ORIGINS', 'http://localhost:8080'),
+        'USERS_FILE': os.path.join(here, 'users.json'),  # Legacy store, migrated once
+        'USERS_DB': os.environ.get('USERS_DB', os.path.join(here, 'users.db')),
+        'HISTORY_FLUSH_INTERVAL_MS': int(os.environ.get('HISTORY_FLUSH_INTERVAL_MS', '50')),
+        'HISTORY_FLUSH_BATCH': int(os.environ.get('HISTORY_FLUSH_BATCH', '200')),
+        # Raw entries older than this are dropped; usage aggregates keep exact totals
+        'HISTORY_RETENTION_DAYS': int(os.environ.get('HISTORY_RETENTION_DAYS', '0')),
+        # memory:// is per process, so N workers would each allow the full limit;
+        # point this at shared storage (e.g. redis://) when running more than one
+        'RATELIMIT_STORAGE_URI': os.environ.get('RATELIMIT_STORAGE_URI', 'memory://'),
+        'NLTK_DATA_DIR': NLTK_DATA_DIR,
+        'SERVICES_WARMUP': os.environ.get('SERVICES_WARMUP', '1') == '1',
+        # Upstream health is probed in the background; health endpoints read the cached results
+        'HEALTH_PROBE_INTERVAL': float(os.environ.get('HEALTH_PROBE_INTERVAL', '30')),
+        'HEALTH_PROBE_TIMEOUT': float(os.environ.get('HEALTH_PROBE_TIMEOUT', '5')),
+        # Segment /api/texttospeech text with the trigram model (langid.py) instead of the lexicons.
+        # Off until it beats them on more held-out text than the bench's 25 sentences, which
+        # LANGID_SWITCH_PENALTY was tuned on (python bench_language_segmentation.py)
+        'LANGID_MODEL_ENABLED': os.environ.get('LANGID_MODEL_ENABLED', '0') == '1',
+        # Log-likelihood (nats per trigram) a word must gain to switch TTS language mid-text;
+        # 0 disables smoothing
+        'LANGID_SWITCH_PENALTY': float(os.environ.get('LANGID_SWITCH_PENALTY', '1.5')),
+        # Upstream TTS calls one request may have in flight (the shared pool is TTS_POOL_SIZE)
+        'TTS_SEGMENT_CONCURRENCY': int(os.environ.get('TTS_SEGMENT_CONCURRENCY', '4')),
+        # 'segments' (one call per language run) or 'ssml' (one call per mixed-language sentence);
+        # requests may override
+        'TTS_RENDER_MODE': os.environ.get('TTS_RENDER_MODE', 'segments'),
+        # Synthesized audio is cached on disk, shared by all workers; requests can pass "no_cache": true
+        'TTS_CACHE_ENABLED': os.environ.get('TTS_CACHE_ENABLED', '1') == '1',
+        'TTS_CACHE_DIR': os.environ.get('TTS_CACHE_DIR', os.path.join(here, 'tts_cache')),
+        'TTS_CACHE_MAX_BYTES': int(os.environ.get('TTS_CACHE_MAX_BYTES', str(512 * 1024 * 1024))),
+        # Phrases x voices x speeds pre-synthesized into the cache at startup and every
+        # TTS_WARM_INTERVAL seconds, spending at most TTS_WARM_BUDGET upstream calls a run
+        'TTS_WARM_SET': os.environ.get('TTS_WARM_SET', os.path.join(here, 'warm_set.json')),
+        'TTS_WARM_INTERVAL': float(os.environ.get('TTS_WARM_INTERVAL', str(6 * 3600))),
+        'TTS_WARM_BUDGET': int(os.environ.get('TTS_WARM_BUDGET', '50')),
+        # Items one /api/tts/batch request may carry; they share TTS_SEGMENT_CONCURRENCY calls
+        'TTS_BATCH_MAX_ITEMS': int(os.environ.get('TTS_BATCH_MAX_ITEMS', '100')),
+        # Long operations submitted to /api/jobs run on JOBS_WORKERS threads per process,
+        # queued in a SQLite table every worker shares; a user may have JOBS_USER_CONCURRENCY
+        # jobs running and JOBS_USER_MAX_PENDING queued or running
+        'JOBS_DB': os.environ.get('JOBS_DB', os.path.join(here, 'jobs.db')),
+        'JOBS_WORKERS': int(os.environ.get('JOBS_WORKERS', '2')),
+        'JOBS_USER_CONCURRENCY': int(os.environ.get('JOBS_USER_CONCURRENCY', '1')),
+        'JOBS_USER_MAX_PENDING': int(os.environ.get('JOBS_USER_MAX_PENDING', '10')),
+        'JOBS_LEASE_SECONDS': float(os.environ.get('JOBS_LEASE_SECONDS', '60')),
+        'JOBS_RETENTION_HOURS': float(os.environ.get('JOBS_RETENTION_HOURS', '24')),
+        # list_voices() is fetched once per VOICE_CATALOG_TTL seconds (refreshed in the
+        # background) and snapshotted to disk for cold starts; '' disables the snapshot
+        'VOICE_CATALOG_TTL': float(os.environ.get('VOICE_CATALOG_TTL', str(24 * 3600))),
+        'VOICE_CATALOG_SNAPSHOT': os.environ.get('VOICE_CATALOG_SNAPSHOT', os.path.join(here, 'voice_catalog.json')),
+        # How long browsers may reuse an /api/voices response before revalidating it
+        'VOICE_CATALOG_MAX_AGE': int(os.environ.get('VOICE_CATALOG_MAX_AGE', '3600')),
+    }
 
-# User data store
-USERS_FILE = os.path.join(os.path.dirname(__file__), 'users.json')
+# Routes are registered on a blueprint so create_app() can build the app from
+# an explicit config (tests, or a preloaded gunicorn master; see gunicorn.conf.py).
+api = Blueprint('api', __name__)
 
-def load_users():
-    if not os.path.exists(USERS_FILE):
-        with open(USERS_FILE, 'w') as f:
-            json.dump({}, f)
-        return {}
-    try:
-        with open(USERS_FILE, 'r') as f:
-            users = json.load(f)
-            # Ensure history is a list for each user
-            for username, data in users.items():
-                if 'history' not in data or not isinstance(data['history'], list):
-                    data['history'] = []
-            return users
-    except (json.JSONDecodeError, IOError) as e:
-        logger.error(f"Error loading users file: {e}")
-        # If file is corrupted or unreadable, start with an empty user set for this session
-        # and try to create/overwrite with an empty JSON object to fix it for next time.
-        try:
-            with open(USERS_FILE, 'w') as f:
-                json.dump({}, f)
-        except IOError as save_e:
-            logger.error(f"Could not even create/overwrite users.json: {save_e}")
-        return {}
-
-def save_users(users_data):
-    try:
-        with open(USERS_FILE, 'w') as f:
-            json.dump(users_data, f, indent=4)
-    except IOError as e:
-        logger.error(f"Error saving users file: {e}")
-
-# Initialize rate limiter
+# Initialize rate limiter (bound to the app, and its storage, in create_app())
 limiter = Limiter(
     get_remote_address,
-    app=app,
     default_limits=["200 per day", "50 per hour"],  # Example limits
-    storage_uri="memory://",  # Use in-memory storage; consider Redis for production
 )
 
+# Each app's stores and background components, built by create_app() and kept in
+# app.extensions, so apps built from different configs (tests) do not share them
+class AppState:
+    def __init__(self, user_store, history_writer, health_prober, voice_catalog, job_queue,
+                 tts_cache=None, cache_warmer=None, nltk_data_dir=NLTK_DATA_DIR, nltk_missing=()):
+        self.user_store = user_store
+        self.history_writer = history_writer
+        self.health_prober = health_prober
+        self.voice_catalog = voice_catalog
+        self.job_queue = job_queue
+        self.tts_cache = tts_cache
+        self.cache_warmer = cache_warmer
+        self.nltk_data_dir = nltk_data_dir
+        self.nltk_missing = list(nltk_missing)
+
+    def start(self):
+        # Background threads are per process: started by create_app() or post_fork()
+        self.health_prober.start()
+        self.job_queue.start()
+        if self.cache_warmer:
+            self.cache_warmer.start()
+
+def app_state(app=None):
+    return (app or current_app).extensions['edu_speak']
+
+# Identical upstream calls already in flight are made once and their result shared
+# (e.g. a whole class pressing play on the projected phrase at the same moment)
+tts_flights = SingleFlight('tts')
+gemini_flights = SingleFlight('gemini')
+
+def load_users():
+    # Legacy bulk view of every user and their history; request paths use the user store directly
+    return app_state().user_store.load_all()
+
+def save_users(users_data):
+    try:
+        app_state().user_store.save_all(users_data)
+    except sqlite3.Error as e:
+        logger.error(f"Error saving users: {e}")
+
 # Add a test route that serves a static HTML page
-@app.route('/test')
+@api.route('/test')
 def test_page():
     logger.info("Test page requested")
-    return app.send_static_file('test.html')
+    return current_app.send_static_file('test.html')
 
 # --- Authentication Decorator ---
 def login_required(f):
@@ -104,7 +177,7 @@ def login_required(f):
     return decorated_function
 
 # --- User Authentication Endpoints ---
-@app.route('/api/register', methods=['POST'])
+@api.route('/api/register', methods=['POST'])
 def register():
     data = request.get_json()
     username = data.get('username')
@@ -113,21 +186,15 @@ def register():
     if not username or not password:
         return jsonify({'error': 'Username and password are required'}), 400
 
-    users = load_users()
-    if username in users:
+    if not app_state().user_store.create_user(username, generate_password_hash(password)):
         return jsonify({'error': 'Username already exists'}), 409 # 409 Conflict
 
-    users[username] = {
-        'password_hash': generate_password_hash(password),
-        'history': []
-    }
-    save_users(users)
     session['user_id'] = username  # Log in the user upon registration
     logger.info(f"User {username} registered successfully and logged in.")
     # Return user object for consistency and immediate use by frontend
     return jsonify({'message': 'User registered successfully', 'user': {'username': username}}), 201
 
-@app.route('/api/login', methods=['POST'])
+@api.route('/api/login', methods=['POST'])
 def login():
     data = request.get_json()
     username = data.get('username')
@@ -136,8 +203,7 @@ def login():
     if not username or not password:
         return jsonify({'error': 'Username and password are required'}), 400
 
-    users = load_users()
-    user = users.get(username)
+    user = app_state().user_store.get_user(username)
 
     if not user or not check_password_hash(user['password_hash'], password):
         return jsonify({'error': 'Invalid username or password'}), 401
@@ -146,7 +212,7 @@ def login():
     logger.info(f"User {username} logged in successfully.")
     return jsonify({'message': 'Login successful', 'user': {'username': username}}), 200
 
-@app.route('/api/logout', methods=['POST'])
+@api.route('/api/logout', methods=['POST'])
 @login_required
 def logout():
     user_id = session.pop('user_id', None)
@@ -154,179 +220,211 @@ def logout():
         logger.info(f"User {user_id} logged out.")
     return jsonify({'message': 'Logout successful'}), 200
 
-@app.route('/api/me', methods=['GET'])
+@api.route('/api/me', methods=['GET'])
 @login_required
 def me():
     user_id = session.get('user_id')
-    users = load_users()
-    user_data = users.get(user_id)
+    app_state().history_writer.flush()  # Include entries still waiting in the write-behind queue
+    user_data = app_state().user_store.get_user(user_id)
     if not user_data: # Should not happen if @login_required works
         return jsonify({'error': 'User not found'}), 404
-    return jsonify({'username': user_id, 'history_count': len(user_data.get('history', []))}), 200
+    # usage_total is maintained incrementally, so this is a single primary-key lookup
+    return jsonify({'username': user_id, 'history_count': user_data['usage_total']}), 200
+
+@api.route('/api/usage', methods=['GET'])
+@login_required
+def get_usage():
+    user_id = session.get('user_id')
+    try:
+        days = int(request.args.get('days', 30))
+        if days < 1 or days > 366:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'days must be an integer between 1 and 366'}), 400
+
+    app_state().history_writer.flush()  # Include entries still waiting in the write-behind queue
+    since_day = (datetime.datetime.utcnow() - datetime.timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    usage = app_state().user_store.get_usage(user_id, since_day=since_day)
+    if usage is None:
+        return jsonify({'error': 'User not found'}), 404
+    return jsonify({'username': user_id, **usage}), 200
 
 # --- History Management ---
 def add_user_history(username, feature, details):
-    users = load_users()
-    if username in users:
-        # Ensure history list exists
-        if 'history' not in users[username] or not isinstance(users[username]['history'], list):
-            users[username]['history'] = []
-        
-        history_entry = {
-            'timestamp': datetime.datetime.utcnow().isoformat() + 'Z', # ISO 8601 format
-            'feature': feature,
-            'details': details
-        }
-        users[username]['history'].append(history_entry)
-        # Optional: Limit history size
-        # max_history = 50 
-        # users[username]['history'] = users[username]['history'][-max_history:]
-        save_users(users)
-        logger.info(f"History added for user {username}, feature {feature}.")
-    else:
-        logger.warning(f"Attempted to add history for non-existent user {username}.")
+    # Costs a queue put on the request thread; the history writer commits it shortly after
+    app_state().history_writer.enqueue(username, feature, details)
+
+HISTORY_PAGE_DEFAULT = 50
+HISTORY_PAGE_MAX = 500
+
+def encode_history_cursor(position):
+    # Opaque to clients: base64 of the (timestamp, id) the next page starts after
+    return base64.urlsafe_b64encode(json.dumps(list(position)).encode('utf-8')).decode('ascii')
+
+def decode_history_cursor(cursor):
+    timestamp, entry_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    if not isinstance(timestamp, str) or not isinstance(entry_id, int):
+        raise ValueError("Malformed cursor")
+    return timestamp, entry_id
 
-@app.route('/api/history', methods=['GET'])
+@api.route('/api/history', methods=['GET'])
 @login_required
 def get_history():
     user_id = session.get('user_id')
-    users = load_users()
-    user_data = users.get(user_id)
-    if not user_data:
-        return jsonify({'error': 'User not found'}), 404 # Should be caught by @login_required
-    
-    # Sort history by timestamp descending (newest first)
-    user_history = sorted(user_data.get('history', []), key=lambda x: x['timestamp'], reverse=True)
-    return jsonify({'history': user_history}), 200
-
-# Initialize Gemini API (Prioritize)
-gemini_available = False
-gemini_model = None
-if "GEMINI_API_KEY" in os.environ:
-    try:
-        genai.configure(api_key=os.environ["GEMINI_API_KEY"])  # Configure once
-        gemini_model = genai.GenerativeModel('gemini-2.0-flash')  # Updated model initialization
-        gemini_available = True
-        logger.info("Gemini API initialized successfully with gemini-2.0-flash model.")
-    except Exception as e:
-        logger.error(f"Failed to initialize Gemini API: {str(e)}")
-else:
-    logger.warning("GEMINI_API_KEY environment variable not set!")
-
-# Initialize Google Cloud TTS
-try:
-    tts_client = texttospeech.TextToSpeechClient()
-    logger.info("Google Cloud TTS client initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize Google Cloud TTS client: {str(e)}")
-    tts_client = None  # Ensure client is None if initialization fails
-
-# Initialize Google Cloud Speech-to-Text
-try:
-    speech_client = speech.SpeechClient()
-    logger.info("Google Cloud Speech client initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize Google Cloud Speech client: {str(e)}")
-    speech_client = None
-
-# Initialize Google Cloud Vision
-try:
-    vision_client = vision.ImageAnnotatorClient()
-    logger.info("Google Cloud Vision client initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize Google Cloud Vision client: {str(e)}")
-    vision_client = None
-
-# Initialize LanguageTool
-try:
-    lang_tool = language_tool_python.LanguageTool('en-US')
-    logger.info("LanguageTool initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize LanguageTool: {str(e)}")
-    lang_tool = None
-
-
-def download_nltk_resources():
-    try:
-        nltk.data.find('tokenizers/punkt')
-        logger.info("NLTK punkt tokenizer already downloaded")
-    except LookupError:
-        logger.info("Downloading NLTK punkt tokenizer")
-        nltk.download('punkt', quiet=True)
+    args = request.args
 
     try:
-        nltk.data.find('corpora/stopwords')
-        logger.info("NLTK stopwords already downloaded")
-    except LookupError:
-        logger.info("Downloading NLTK stopwords")
-        nltk.download('stopwords', quiet=True)
-    try:  # Download POS tagger
-        nltk.data.find('taggers/averaged_perceptron_tagger')
-        logger.info("NLTK averaged_perceptron_tagger already downloaded")
-    except LookupError:
-        logger.info("Downloading NLTK averaged_perceptron_tagger")
-        nltk.download('averaged_perceptron_tagger', quiet=True)
-    try:  # Download WordNet
-        nltk.data.find('corpora/wordnet')
-        logger.info("NLTK wordnet already downloaded")
-    except LookupError:
-        logger.info("Downloading NLTK wordnet")
-        nltk.download('wordnet', quiet=True)
-    # Googletrans resource check if necessary, though they usually don't require explicit download like nltk
-    logger.info("Googletrans is assumed to be installed via pip.")
-
-
-download_nltk_resources()
-
-# Function to detect the language of the given text
-def detect_language_for_word(text):
-    # Using a simpler approach with the new version of googletrans
-    # googletrans 4.0.0+ is async, but we're running in a sync environment
-    # Let's use a simpler language detection method
-    
-    # Map of common words to their languages
-    french_words = {'bonjour', 'merci', 'oui', 'non', 'le', 'la', 'les', 'et', 'je', 'tu', 'il', 'elle', 'nous', 'vous', 'ils', 'elles', 'un', 'une', 'des', 'du', 'de', 'à', 'au', 'aux', 'avec', 'pour', 'dans', 'sur', 'sous', 'sans', 'qui', 'que', 'quoi', 'comment', 'pourquoi', 'où'}
-    spanish_words = {'hola', 'gracias', 'sí', 'no', 'el', 'la', 'los', 'las', 'y', 'yo', 'tú', 'él', 'ella', 'nosotros', 'vosotros', 'ellos', 'ellas', 'un', 'una', 'unos', 'unas', 'del', 'al', 'a', 'con', 'para', 'en', 'sobre', 'bajo', 'sin', 'quien', 'que', 'como', 'porque', 'donde'}
-    german_words = {'hallo', 'danke', 'ja', 'nein', 'der', 'die', 'das', 'und', 'ich', 'du', 'er', 'sie', 'es', 'wir', 'ihr', 'sie', 'ein', 'eine', 'einen', 'einem', 'einer', 'eines', 'mit', 'für', 'in', 'auf', 'unter', 'ohne', 'wer', 'was', 'wie', 'warum', 'wo'}
-    
+        limit = int(args.get('limit', HISTORY_PAGE_DEFAULT))
+        if limit < 1 or limit > HISTORY_PAGE_MAX:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': f'limit must be an integer between 1 and {HISTORY_PAGE_MAX}'}), 400
     try:
-        # Clean the text
-        cleaned_text = text.lower().strip().rstrip('.,:;!?')
-        
-        # Check if the word is in any of our language sets
-        if cleaned_text in french_words:
-            logger.info(f"Detected '{text}' as French")
-            return 'fr'
-        elif cleaned_text in spanish_words:
-            logger.info(f"Detected '{text}' as Spanish")
-            return 'es'
-        elif cleaned_text in german_words:
-            logger.info(f"Detected '{text}' as German")
-            return 'de'
-        
-        # Check for language-specific patterns - this is a simple approximation
-        if any(char in 'éèêëàâäæçîïôœùûüÿ' for char in cleaned_text):
-            logger.info(f"Detected '{text}' as likely French (character patterns)")
-            return 'fr'
-        elif any(char in 'áéíóúüñ¿¡' for char in cleaned_text):
-            logger.info(f"Detected '{text}' as likely Spanish (character patterns)")
-            return 'es'
-        elif any(char in 'äöüß' for char in cleaned_text):
-            logger.info(f"Detected '{text}' as likely German (character patterns)")
-            return 'de'
-        
-        # Default to English for unknown words
-        logger.info(f"Defaulting '{text}' to English")
-        return 'en'
-    except Exception as e:
-        logger.error(f"Error detecting language for '{text}': {e}")
-        # Fallback to English to be safe
-        return 'en'
+        before = decode_history_cursor(args['cursor']) if args.get('cursor') else None
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid cursor'}), 400
+    try:
+        since = normalize_timestamp(args['since']) if args.get('since') else None
+        until = normalize_timestamp(args['until']) if args.get('until') else None
+    except ValueError:
+        return jsonify({'error': 'since/until must be ISO 8601 timestamps'}), 400
+    feature = args.get('feature') or None
+
+    app_state().history_writer.flush()  # Include entries still waiting in the write-behind queue
+    history_rev = app_state().user_store.history_rev(user_id)
+    if history_rev is None:
+        return jsonify({'error': 'User not found'}), 404 # Should be caught by @login_required
+
+    # The ETag only depends on the user's history revision and the query, so a
+    # client that is already in sync gets its 304 without any rows being read.
+    etag = hashlib.sha1(json.dumps(
+        [user_id, history_rev, limit, args.get('cursor'), feature, since, until]
+    ).encode('utf-8')).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        # Newest first, read straight off the (username, timestamp, id) index
+        entries, next_before = app_state().user_store.history_page(
+            user_id, limit, before=before, feature=feature, since=since, until=until
+        )
+        response = jsonify({
+            'history': entries,
+            'next_cursor': encode_history_cursor(next_before) if next_before else None
+        })
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+# --- Upstream Clients ---
+# Clients are built on first use (or by the warmup thread) instead of at import
+# time: LanguageTool alone starts a JVM, and not every worker serves every feature.
+
+def build_gemini_model():
+    if "GEMINI_API_KEY" not in os.environ:
+        raise RuntimeError("GEMINI_API_KEY environment variable not set")
+    import google.generativeai as genai
+    genai.configure(api_key=os.environ["GEMINI_API_KEY"])  # Configure once
+    return genai.GenerativeModel('gemini-2.0-flash')
+
+# A client that failed to build is built again on the first use this many seconds later
+services = ServiceRegistry(retry_after=float(os.environ.get('SERVICES_RETRY_SECONDS', '30')))
+services.register('gemini', build_gemini_model)
+
+def generate_content(gemini_model, prompt):
+    key = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    return gemini_flights.do(key, lambda: gemini_model.generate_content(prompt))
+
+def build_tts_client():
+    from google.cloud import texttospeech
+    return texttospeech.TextToSpeechClient()
+
+def build_speech_client():
+    from google.cloud import speech
+    return speech.SpeechClient()
+
+def build_vision_client():
+    from google.cloud import vision
+    return vision.ImageAnnotatorClient()
+
+def build_language_tool():
+    import language_tool_python
+    return language_tool_python.LanguageTool('en-US')
+
+services.register('tts', build_tts_client)
+services.register('speech', build_speech_client)
+services.register('vision', build_vision_client)
+services.register('language_tool', build_language_tool)
+
+# NLTK data is vendored into NLTK_DATA_DIR at build time (`python provision.py nltk`).
+# create_app() only checks that it is on disk; nothing ever downloads it at runtime.
+def load_nltk():
+    import nltk
+    return nltk
+
+
+# NLTK only holds read-only data, so a copy loaded before a fork can be shared
+services.register('nltk', load_nltk, fork_safe=True)
+
+def app_nltk():
+    # The nltk module is per process but the data directory is per app; None (split
+    # on punctuation instead) if this app's directory is missing the tokenizer data
+    state = app_state()
+    if state.nltk_missing:
+        return None
+    nltk = services.get('nltk')
+    if nltk is not None:
+        configure_nltk_path(state.nltk_data_dir)
+    return nltk
+
+def load_langid_model():
+    # Memory-mapped and read-only: workers forked after preload share its pages
+    from langid import LanguageModel
+    return LanguageModel.load()
+
+services.register('langid', load_langid_model, fork_safe=True)
+
+def langid_model(config):
+    # None selects segment_sentences()'s lexicon path
+    return services.get('langid') if config['LANGID_MODEL_ENABLED'] else None
+
+WARMUP_SERVICES = ['tts', 'gemini', 'nltk', 'langid', 'speech', 'vision', 'language_tool']
+
+# Services that must be up for the app to be ready to serve traffic
+CORE_SERVICES = ['gemini', 'tts']
+
+def build_health_probes(timeout, nltk_data_dir=NLTK_DATA_DIR):
+    # The cheapest real call each client offers; None = no cheap call, being built is enough
+    # (Speech and Vision only expose billable recognition calls)
+    def probe_tts(client):
+        client.list_voices(language_code='en-US', timeout=timeout)
+
+    def probe_gemini(model):
+        model.count_tokens('ping', request_options={'timeout': timeout})
+
+    def probe_language_tool(lang_tool):
+        lang_tool.check('ping')
+
+    def probe_nltk(nltk):
+        configure_nltk_path(nltk_data_dir)
+        nltk.sent_tokenize('Ping. Pong.')
+
+    def probe_langid(model):
+        model.classify(['ping'])
+
+    return {
+        'tts': probe_tts,
+        'gemini': probe_gemini,
+        'nltk': probe_nltk,
+        'langid': probe_langid,
+        'speech': None,
+        'vision': None,
+        'language_tool': probe_language_tool
+    }
 
 
 # --- Error Handling ---
 
-@app.errorhandler(Exception)
+@api.app_errorhandler(Exception)
 def handle_exception(e):
     logger.error(f"Unhandled exception: {str(e)}")
     logger.error(traceback.format_exc())
@@ -337,41 +435,125 @@ def handle_exception(e):
 
 
 # --- API Health Check ---
-@app.route('/api/health', methods=['GET'])
+# All three endpoints read the health prober's cache: constant time, nothing upstream
+# is called, built or waited on. They are exempt from rate limiting because the
+# frontend and load balancers poll them.
+
+def ensure_health_prober():
+    # Started by create_app()/post_fork(); this only restarts a prober that died
+    health_prober = app_state().health_prober
+    if not health_prober.running():
+        health_prober.start()
+
+def readiness(results):
+    core = [results[name]['state'] for name in CORE_SERVICES]
+    if any(state in (UNINITIALIZED, INITIALIZING) for state in core):
+        return "initializing"
+    if all(state == AVAILABLE for state in core):
+        return "ok"
+    if AVAILABLE in core:
+        return "degraded"
+    return "error"
+
+@api.route('/api/health/live', methods=['GET'])
+@limiter.exempt
+def health_live():
+    # The process is up and serving requests; says nothing about upstreams
+    return jsonify({
+        "status": "alive",
+        "timestamp": utc_timestamp()
+    }), 200
+
+@api.route('/api/health/ready', methods=['GET'])
+@limiter.exempt
+def health_ready():
+    ensure_health_prober()
+    results = app_state().health_prober.results()
+    overall_status = readiness(results)
+    stale = app_state().health_prober.stale()
+    ready = overall_status == "ok" and not stale
+    return jsonify({
+        "status": overall_status,
+        "ready": ready,
+        "stale": stale,
+        "timestamp": utc_timestamp(),
+        "checks": {name: results[name] for name in CORE_SERVICES}
+    }), 200 if ready else 503
+
+@api.route('/api/health', methods=['GET'])
+@limiter.exempt
 def health_check():
-    logger.info("Health check endpoint hit")
-    # Check status of critical services (TTS, Speech-to-Text, Gemini, etc.)
+    state = app_state()
+    ensure_health_prober()
+    results = state.health_prober.results()
+
     services_status = {
-        "tts_google": "available" if tts_client else "unavailable",
-        "speech_to_text_google": "available" if speech_client else "unavailable",
-        "vision_google": "available" if vision_client else "unavailable",
-        "gemini_ai": "available" if gemini_available and gemini_model else "unavailable",
-        "language_tool": "available" if lang_tool else "unavailable"
+        "tts_google": results['tts']['state'],
+        "speech_to_text_google": results['speech']['state'],
+        "vision_google": results['vision']['state'],
+        "gemini_ai": results['gemini']['state'],
+        "language_tool": results['language_tool']['state'],
+        "nltk_data": "missing" if state.nltk_missing else "available"
     }
-    # Overall status can be 'ok' if core services are up, or 'degraded'/'error'
-    # For simplicity, let's say 'ok' if at least Gemini and TTS are up.
-    # You can define more complex logic here.
-    if gemini_available and tts_client:
-        overall_status = "ok"
-    elif gemini_available or tts_client:
-        overall_status = "degraded"
-    else:
-        overall_status = "error"
-        
+    # 'ok' once Gemini and TTS both answered their last probe, 'degraded' if one did,
+    # 'initializing' until both have been built (by warmup or a first request)
+    overall_status = readiness(results)
+
     return jsonify({
         "status": overall_status,
-        "timestamp": datetime.datetime.utcnow().isoformat() + 'Z',
-        "services": services_status
+        "ready": overall_status == "ok" and not state.health_prober.stale(),
+        "timestamp": utc_timestamp(),
+        "services": services_status,
+        "checks": results,
+        "cache_warming": state.cache_warmer.stats() if state.cache_warmer else None
+    }), 200
+
+# --- Metrics ---
+@api.route('/api/metrics', methods=['GET'])
+def metrics():
+    state = app_state()
+    return jsonify({
+        "timestamp": utc_timestamp(),
+        "history_writer": state.history_writer.stats(),
+        "services": services.status(),
+        "health_prober": state.health_prober.stats(),
+        "language_segmentation": dict(segmentation_totals),
+        "tts_cache": state.tts_cache.stats() if state.tts_cache else None,
+        "voice_catalog": state.voice_catalog.stats(),
+        "jobs": state.job_queue.stats(),
+        "singleflight": {'tts': tts_flights.stats(), 'gemini': gemini_flights.stats()}
     }), 200
 
 # --- API Endpoints ---
 
-@app.route('/api/tts_google', methods=['POST'])
+def cache_status(data, synthesis):
+    if data.get('no_cache'):
+        return 'BYPASS'
+    if synthesis['calls'] == 0:
+        return 'HIT'
+    return 'PARTIAL' if synthesis['cache_hits'] else 'MISS'
+
+def tts_audio_response(audio_content, data, synthesis, encoding=audio_formats.MP3):
+    response = send_file(
+        io.BytesIO(audio_content),
+        mimetype=audio_formats.MIMETYPES[encoding],
+        as_attachment=True,
+        download_name=f"speech.{EXTENSIONS[encoding]}"
+    )
+    response.vary.add('Accept')
+    response.headers['X-Cache'] = cache_status(data, synthesis)
+    response.headers['X-TTS-Sentences'] = str(synthesis['sentences'])
+    response.headers['X-TTS-Sentence-Cache-Hits'] = str(synthesis['sentence_cache_hits'])
+    return response
+
+@api.route('/api/tts_google', methods=['POST'])
 @limiter.limit("10 per minute")  # Apply rate limiting
 @login_required # Protect this endpoint
 def text_to_speech_google(): # Renamed to avoid conflict
+    from google.api_core import exceptions
     user_id = session.get('user_id') # Get current user
     logger.info(f"User {user_id} requesting /api/tts (Google TTS)")
+    tts_client = services.get('tts')
     if tts_client is None:
         logger.error("Google Cloud TTS client not initialized")
         return jsonify({'error': 'Text-to-speech service unavailable'}), 503
@@ -406,6 +588,13 @@ def text_to_speech_google(): # Renamed to avoid conflict
             logger.warning(f"Invalid speed value: {data.get('speed')}. Error: {e}")
             return jsonify({'error': 'Speed must be a valid number'}), 400
 
+        try:
+            encoding, sample_rate = audio_formats.negotiate(data.get('format'), data.get('sampleRate'),
+                                                            request.accept_mimetypes)
+        except ValueError as e:
+            logger.warning(f"Invalid audio format request: {str(e)}")
+            return jsonify({'error': str(e)}), 400
+
         try:
             language_code = '-'.join(voice_id.split('-')[:2])
             if not language_code or len(language_code.split('-')) != 2:
@@ -414,42 +603,35 @@ def text_to_speech_google(): # Renamed to avoid conflict
             logger.warning(f"Invalid voice ID format: {voice_id}. Error extracting language code: {e}")
             return jsonify({'error': 'Invalid voice ID format'}), 400
 
-        logger.info(f"Processing TTS request: language={language_code}, voice={voice_id}, speed={speed}")
-        synthesis_input = texttospeech.SynthesisInput(text=text)
-
-        voice = texttospeech.VoiceSelectionParams(
-            language_code=language_code,
-            name=voice_id
-        )
-
-        audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.MP3,
-            speaking_rate=speed
-        )
-
+        logger.info(f"Processing TTS request: language={language_code}, voice={voice_id}, speed={speed}, "
+                    f"encoding={encoding}, sample_rate={sample_rate}")
+        # Each sentence is synthesized and cached on its own and the files are stitched together,
+        # so replaying a passage with one sentence edited synthesizes just that sentence.
+        # Sentences over Google's 5000-byte input limit are cut at clause breaks, and
+        # long passages are synthesized TTS_SEGMENT_CONCURRENCY sentences at a time
+        sentences = split_sentences(text, app_nltk(), language_code.split('-')[0])
         try:
-            logger.info(f"Calling Google TTS API with: Input='{text[:50]}...', Voice={voice}, Config={audio_config}") # Log API call details
-            response = tts_client.synthesize_speech(
-                input=synthesis_input,
-                voice=voice,
-                audio_config=audio_config
-            )
-            logger.info("Successfully received TTS response from Google API")
-
-            if not response.audio_content:
+            results, synthesis = synthesize_sentences(tts_client, sentences, voice_id, speed,
+                                                      current_app.config['TTS_SEGMENT_CONCURRENCY'],
+                                                      cache=app_state().tts_cache,
+                                                      bypass_cache=bool(data.get('no_cache')),
+                                                      flights=tts_flights, encoding=encoding,
+                                                      sample_rate=sample_rate)
+            logger.info(f"Synthesized {synthesis['sentences']} sentences with {synthesis['calls']} upstream calls "
+                        f"and {synthesis['sentence_cache_hits']} cache hits")
+
+            # All or nothing: a passage with a sentence missing is not worth playing
+            for _, error in results:
+                if error is not None:
+                    raise error
+
+            if not any(audio for audio, _ in results):
                 logger.error("No audio content in Google TTS response")
                 return jsonify({'error': 'No audio generated'}), 500
-
-            audio_buffer = io.BytesIO(response.audio_content)
-            audio_buffer.seek(0)
+            audio_content = audio_formats.join([audio for audio, _ in results if audio], encoding)
 
             logger.info("Sending audio file response")
-            return send_file(
-                audio_buffer,
-                mimetype="audio/mpeg",
-                as_attachment=True,
-                download_name="speech.mp3"
-            )
+            return tts_audio_response(audio_content, data, synthesis, encoding)
 
         except exceptions.GoogleAPICallError as e:
             # Log the specific Google API error
@@ -465,13 +647,95 @@ def text_to_speech_google(): # Renamed to avoid conflict
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
 
-@app.route('/api/speech-error-analysis', methods=['POST'])
+@api.route('/api/tts/batch', methods=['POST'])
+@limiter.limit("5 per minute")
+@login_required # Protect this endpoint
+def text_to_speech_batch():
+    from google.api_core import exceptions
+    user_id = session.get('user_id') # Get current user
+    logger.info(f"User {user_id} requesting /api/tts/batch")
+    tts_client = services.get('tts')
+    if tts_client is None:
+        logger.error("Google Cloud TTS client not initialized")
+        return jsonify({'error': 'Text-to-speech service unavailable'}), 503
+
+    data = request.get_json(silent=True)
+    if not data:
+        logger.warning("No JSON data received in batch TTS request")
+        return jsonify({'error': 'Invalid request: No JSON data'}), 400
+
+    items = data.get('items')
+    max_items = current_app.config['TTS_BATCH_MAX_ITEMS']
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'items must be a non-empty list'}), 400
+    if len(items) > max_items:
+        return jsonify({'error': f'At most {max_items} items per batch'}), 400
+
+    try:
+        encoding, sample_rate = audio_formats.negotiate(data.get('format'), data.get('sampleRate'))
+    except ValueError as e:
+        logger.warning(f"Invalid audio format request: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+
+    # Items with the same text, voice and speed are synthesized once; an invalid
+    # item is reported in the manifest instead of failing the batch
+    clips, entries = tts_batch.plan(items, 'en-US-Standard-D', 2.0)
+    # One history entry for the whole batch
+    add_user_history(user_id, 'tts_batch', {
+        'items': len(items),
+        'clips': len(clips),
+        'text_length': sum(len(text) for text, _, _ in clips)
+    })
+    logger.info(f"Batch of {len(items)} items: {len(clips)} distinct clips, "
+                f"{sum(entry['error'] is not None for entry in entries)} rejected")
+
+    nltk = app_nltk()
+    sentences = [(split_sentences(text, nltk, voice.split('-')[0]), voice, speed) for text, voice, speed in clips]
+
+    def results():
+        # Every clip's sentences go through the TTS cache and one pool of
+        # TTS_SEGMENT_CONCURRENCY calls; each clip is sent as soon as it is done
+        calls = 0
+        outcomes = iter_clips(tts_client, sentences, current_app.config['TTS_SEGMENT_CONCURRENCY'],
+                              cache=app_state().tts_cache, bypass_cache=bool(data.get('no_cache')),
+                              flights=tts_flights, encoding=encoding, sample_rate=sample_rate)
+        for (text, _, _), (audios, error, clip_calls) in zip(clips, outcomes):
+            calls += clip_calls
+            if error is not None:
+                logger.error(f"Batch clip '{text[:50]}' failed: {str(error)}")
+                message = (f'Text-to-speech API error: {str(error)}'
+                           if isinstance(error, exceptions.GoogleAPICallError) else str(error))
+                yield None, message, False
+            else:
+                yield audio_formats.join(audios, encoding), None, clip_calls == 0
+        logger.info(f"Batch synthesized {len(clips)} clips with {calls} upstream calls")
+
+    extension = EXTENSIONS[encoding]
+    if request.accept_mimetypes.best_match(tts_batch.PACKAGINGS) == tts_batch.MULTIPART:
+        boundary = tts_batch.multipart_boundary()
+        body = tts_batch.iter_multipart(results(), entries, extension, audio_formats.MIMETYPES[encoding], boundary)
+        mimetype = f'{tts_batch.MULTIPART}; boundary={boundary}'
+    else:
+        body = tts_batch.iter_zip(results(), entries, extension)
+        mimetype = tts_batch.ZIP
+    response = current_app.response_class(stream_with_context(body), mimetype=mimetype)
+    if mimetype == tts_batch.ZIP:
+        response.headers['Content-Disposition'] = 'attachment; filename="speech.zip"'
+    response.vary.add('Accept')
+    response.headers['X-TTS-Clips'] = str(len(clips))
+    return response
+
+
+@api.route('/api/speech-error-analysis', methods=['POST'])
 @limiter.limit("5 per minute")  # Lower limit due to potential processing intensity
 @login_required # Protect this endpoint
 def speech_error_analysis():
+    from google.cloud import speech
+    from google.api_core import exceptions
     user_id = session.get('user_id') # Get current user
     logger.info(f"User {user_id} requesting /api/speech-error-analysis")
-    if not gemini_available or gemini_model is None:
+    gemini_model = services.get('gemini')
+    if gemini_model is None:
         logger.error("Gemini API not available for speech error analysis")
         return jsonify({'error': 'Advanced speech analysis service is currently unavailable due to Gemini API issues.'}), 503
 
@@ -494,6 +758,7 @@ def speech_error_analysis():
             return jsonify({'error': 'Audio file is empty or could not be read from the request.'}), 400
 
         transcript = None
+        speech_client = services.get('speech')
         if speech_client:
             audio = speech.RecognitionAudio(content=audio_bytes)
             config = speech.RecognitionConfig(
@@ -555,7 +820,7 @@ Transcript:
 {transcript}
 """
         logger.info("Sending transcript to Gemini for error analysis.")
-        gemini_response = gemini_model.generate_content(prompt) # Renamed to gemini_response to avoid conflict
+        gemini_response = generate_content(gemini_model, prompt) # Renamed to gemini_response to avoid conflict
 
         logger.info(f"Raw Gemini response: {gemini_response.text}")
 
@@ -597,16 +862,64 @@ Transcript:
         return jsonify({'error': f'An unexpected internal server error occurred during analysis.'}), 500
 
 
-@app.route('/api/texttospeech', methods=['POST'])
+# Segments per /api/texttospeech request before and after smoothing, summed (per process)
+segmentation_lock = threading.Lock()
+segmentation_totals = {'requests': 0, 'segments_unsmoothed': 0, 'segments': 0}
+
+def record_segmentation(stats):
+    with segmentation_lock:
+        segmentation_totals['requests'] += 1
+        segmentation_totals['segments_unsmoothed'] += stats['segments_unsmoothed']
+        segmentation_totals['segments'] += stats['segments']
+
+def multilingual_voices():
+    # SSML voices checked against the voice catalog once it is loaded, so a voice
+    # upstream has dropped is replaced rather than failing the call; never fetches
+    catalog = app_state().voice_catalog.peek()
+    return catalog.ssml_voices(LANGUAGE_CODES.values(), SSML_VOICES) if catalog else SSML_VOICES
+
+def warm_tts_entry(entry, config):
+    # Synthesizes a warm-set entry exactly as its endpoint would, so the cache keys match
+    tts_client = services.get('tts')
+    if tts_client is None:
+        raise RuntimeError('Text-to-speech service unavailable')
+    if entry['endpoint'] == TEXTTOSPEECH:
+        sentences = split_sentences(entry['text'], app_nltk())
+        sentence_groups = segment_sentences(sentences, langid_model(config), config['LANGID_SWITCH_PENALTY'])
+        parts, synthesis = synthesize_multilingual(tts_client, sentence_groups, config['TTS_RENDER_MODE'], 1,
+                                                   voices=multilingual_voices(), cache=app_state().tts_cache,
+                                                   flights=tts_flights)
+        errors = [error for _, _, _, error in parts if error is not None]
+    else:
+        sentences = split_sentences(entry['text'], app_nltk(), entry['voice'].split('-')[0])
+        results, synthesis = synthesize_sentences(tts_client, sentences, entry['voice'], entry['speed'], 1,
+                                                  cache=app_state().tts_cache, flights=tts_flights)
+        errors = [error for _, error in results if error is not None]
+    if errors:
+        raise errors[0]
+    return synthesis['calls']
+
+def log_segment_error(lang, text_segment, error):
+    from google.api_core import exceptions
+    if isinstance(error, exceptions.GoogleAPICallError):
+        logger.error(f"Google API call error for segment '{text_segment[:50]}...': {str(error)}")
+    else:
+        logger.error(f"Error generating TTS for segment in lang '{lang}': {error}",
+                     exc_info=(type(error), error, error.__traceback__))
+    logger.warning(f"Skipping segment and continuing with the rest of the text")
+
+@api.route('/api/texttospeech', methods=['POST'])
 @limiter.limit("10 per minute")
 @login_required # Protect this endpoint
 def text_to_speech_custom():
+    from google.api_core import exceptions
     user_id = session.get('user_id') # Get current user
     logger.info(f"User {user_id} requesting /api/texttospeech (Multi-language TTS)")
     # Log the request headers for debugging
     logger.info(f"Request headers: {dict(request.headers)}")
     
     try:
+        tts_client = services.get('tts')
         if tts_client is None:
             logger.error("Google Cloud TTS client not initialized")
             return jsonify({'error': 'Text-to-speech service unavailable'}), 503
@@ -623,110 +936,103 @@ def text_to_speech_custom():
             logger.warning("Missing or empty 'text' field in custom TTS request")
             return jsonify({'error': 'Text is required'}), 400
 
+        mode = data.get('mode', current_app.config['TTS_RENDER_MODE'])
+        if mode not in RENDER_MODES:
+            return jsonify({'error': f"mode must be one of: {', '.join(RENDER_MODES)}"}), 400
+
+        # An audio type in Accept streams the audio (in that type, unless "format"
+        # names another); anything else gets the original base64-in-JSON body
+        best_type = request.accept_mimetypes.best_match(['application/json', *audio_formats.ACCEPT_TYPES])
+        stream_audio = best_type is not None and best_type != 'application/json'
+        try:
+            encoding, sample_rate = audio_formats.negotiate(data.get('format'), data.get('sampleRate'),
+                                                            request.accept_mimetypes if stream_audio else None)
+        except ValueError as e:
+            logger.warning(f"Invalid audio format request: {str(e)}")
+            return jsonify({'error': str(e)}), 400
+
         # Add to history
         add_user_history(user_id, 'texttospeech_custom', {'text_length': len(text)})
 
         logger.info(f"Processing text for TTS: '{text}' for user {user_id}")
-        words = text.split(' ')
-        logger.info(f"Split into {len(words)} words")
-        
-        # Create an in-memory bytes buffer for the MP3 data
-        mp3_fp = io.BytesIO()
-        
-        # Group words by language for better performance
-        current_lang = None
-        current_group = []
-        lang_groups = []
-        
-        for word in words:
-            if not word.strip():  # Skip empty strings
-                continue
-                
-            detected_lang = detect_language_for_word(word)
-            
-            # If language changes or this is the first word, start a new group
-            if detected_lang != current_lang:
-                if current_group:
-                    lang_groups.append((current_lang, ' '.join(current_group)))
-                current_lang = detected_lang
-                current_group = [word]
-            else:
-                current_group.append(word)
-        
-        # Add the last group if it exists
-        if current_group:
-            lang_groups.append((current_lang, ' '.join(current_group)))
-        
-        logger.info(f"Grouped text into {len(lang_groups)} language segments")
-        groups_processed = 0
-        
-        # Map language codes to ones supported by Google Cloud TTS
-        lang_code_map = {
-            'en': 'en-US',
-            'fr': 'fr-FR',
-            'es': 'es-ES',
-            'de': 'de-DE'
-        }
-        
-        for lang, text_segment in lang_groups:
-            try:
-                google_lang_code = lang_code_map.get(lang, 'en-US')
-                
-                # Use Google Cloud TTS to synthesize speech for the entire segment
-                synthesis_input = texttospeech.SynthesisInput(text=text_segment)
-                
-                # Select a voice appropriate for the language
-                voice = texttospeech.VoiceSelectionParams(
-                    language_code=google_lang_code,
-                    ssml_gender=texttospeech.SsmlVoiceGender.NEUTRAL
-                )
-                
-                # Configure audio settings
-                audio_config = texttospeech.AudioConfig(
-                    audio_encoding=texttospeech.AudioEncoding.MP3
-                )
-                
-                # Make the API call for the whole segment
-                logger.info(f"Calling Google TTS API for segment in language {google_lang_code}: '{text_segment[:50]}...'")
-                response = tts_client.synthesize_speech(
-                    input=synthesis_input,
-                    voice=voice,
-                    audio_config=audio_config
-                )
-                
-                # Write the audio content to our buffer
-                mp3_fp.write(response.audio_content)
-                groups_processed += 1
-                
-            except exceptions.GoogleAPICallError as e:
-                logger.error(f"Google API call error for segment '{text_segment[:50]}...': {str(e)}")
-                if groups_processed == 0:
-                    return jsonify({'error': f'Text-to-speech API error: {str(e)}'}), 500
-                continue
-            except Exception as e:
-                logger.error(f"Error generating TTS for segment in lang '{lang}': {e}")
-                logger.error(traceback.format_exc())
-                
-                if groups_processed == 0:
-                    return jsonify({'error': f'Failed to generate speech. Error: {str(e)}'}), 500
-                logger.warning(f"Skipping segment and continuing with the rest of the text")
-                continue
-        
-        # If we haven't processed any groups successfully, return an error
-        if groups_processed == 0:
+        # Split into sentences, then group consecutive words of the same language in
+        # each into one synthesis call, classified by the trigram model (or the
+        # built-in lexicons if it failed to load) and smoothed so a single
+        # misdetected word does not cost two extra calls
+        segmentation = {}
+        sentences = split_sentences(text, app_nltk())
+        sentence_groups = segment_sentences(sentences, langid_model(current_app.config),
+                                            current_app.config['LANGID_SWITCH_PENALTY'], segmentation)
+        record_segmentation(segmentation)
+        logger.info(f"Grouped {len(sentences)} sentences into {segmentation['segments']} language segments "
+                    f"({segmentation['segments_unsmoothed']} before smoothing)")
+
+        # Either one SSML call voicing each mixed-language sentence, or one call per
+        # segment, run concurrently (at most TTS_SEGMENT_CONCURRENCY at once) and
+        # produced in order; SSML falls back to segments for languages it has no
+        # voice for. Sentences and segments already in the TTS cache are reused
+        synthesis = {}
+        parts = iter_multilingual(tts_client, sentence_groups, mode,
+                                  current_app.config['TTS_SEGMENT_CONCURRENCY'], voices=multilingual_voices(),
+                                  cache=app_state().tts_cache, bypass_cache=bool(data.get('no_cache')), info=synthesis,
+                                  flights=tts_flights, encoding=encoding, sample_rate=sample_rate)
+
+        # A failed segment is skipped unless all fail. Wait for the first audio
+        # before answering, so a request that produces none still gets an error
+        first_error = None
+        first_audio = None
+        for lang, text_segment, audio_content, error in parts:
+            if error is None:
+                first_audio = audio_content
+                break
+            first_error = first_error or error
+            log_segment_error(lang, text_segment, error)
+
+        if first_audio is None:
             logger.error("No language segments were successfully processed")
+            if isinstance(first_error, exceptions.GoogleAPICallError):
+                return jsonify({'error': f'Text-to-speech API error: {str(first_error)}'}), 500
+            if first_error is not None:
+                return jsonify({'error': f'Failed to generate speech. Error: {str(first_error)}'}), 500
             return jsonify({'error': 'Failed to generate speech for any parts of the text'}), 500
-        
-        # Rewind the buffer to the beginning to read the data
-        mp3_fp.seek(0)
-        audio_bytes = mp3_fp.read()
+
+        def remaining_audio():
+            for lang, text_segment, audio_content, error in parts:
+                if error is None:
+                    yield audio_content
+                else:
+                    log_segment_error(lang, text_segment, error)
+            logger.info(f"Synthesized {len(sentences)} sentences with {synthesis['calls']} upstream calls "
+                        f"and {synthesis['cache_hits']} cache hits ({synthesis['mode']} mode)")
+
+        # Streamed with chunked transfer, each segment written as soon as it and
+        # the ones before it are synthesized
+        if stream_audio:
+            logger.info(f"Streaming multi-language TTS audio as {encoding}")
+            stream = audio_formats.stitch(chain([first_audio], remaining_audio()), encoding)
+            response = current_app.response_class(stream_with_context(stream),
+                                                  mimetype=audio_formats.MIMETYPES[encoding])
+            response.vary.add('Accept')
+            # Cache counts are only known once the stream ends; they are logged instead
+            response.headers['X-TTS-Sentences'] = str(len(sentences))
+            return response
+
+        audio_bytes = audio_formats.join([first_audio, *remaining_audio()], encoding)
         
         # Encode the audio data to base64
         audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
+        del audio_bytes
         
         logger.info(f"Successfully generated and encoded multi-language TTS audio, size: {len(audio_base64)} bytes")
-        response = jsonify({'audio_base64': audio_base64})
-        
+        response = jsonify({
+            'audio_base64': audio_base64,
+            'mimetype': audio_formats.MIMETYPES[encoding],
+            'sentences': synthesis['sentences'],
+            'sentence_cache_hits': synthesis['sentence_cache_hits']
+        })
+        response.headers['X-Cache'] = cache_status(data, synthesis)
+        response.vary.add('Accept')
+
         # Log the response headers for debugging
         logger.info(f"Response headers: {dict(response.headers)}")
         return response
@@ -736,59 +1042,51 @@ def text_to_speech_custom():
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
 
-@app.route('/api/voices', methods=['GET'])
+def fetch_voice_catalog():
+    tts_client = services.get('tts')
+    if tts_client is None:
+        raise RuntimeError('Google Cloud TTS client not initialized')
+    return fetch_voices(tts_client)
+
+@api.route('/api/voices', methods=['GET'])
 @login_required # Protect this endpoint
 def get_voices():
     user_id = session.get('user_id') # Get current user
     logger.info(f"User {user_id} requesting /api/voices") # Log access
-    if tts_client is None:
-        logger.error("Google Cloud TTS client not initialized")
-        return jsonify({'error': 'Voice service unavailable'}), 503
+
+    # Filter with ?language=fr-FR (or just fr), ?gender=female and ?accent=british;
+    # without a language, English voices as before, and ?language=all for every language
+    language = request.args.get('language', 'en')
+    filters = {
+        'language': None if language.lower() == 'all' else language,
+        'gender': request.args.get('gender'),
+        'accent': request.args.get('accent')
+    }
 
     try:
-        logger.info("Retrieving available voices from Google TTS API")
+        # Served from the in-memory catalog; list_voices() is only called when
+        # it expires, in the background, or on the first request of a cold worker
+        # without a snapshot
+        if app_state().voice_catalog.peek() is None and services.get('tts') is None:
+            logger.error("Google Cloud TTS client not initialized")
+            return jsonify({'error': 'Voice service unavailable'}), 503
         try:
-            response = tts_client.list_voices()
-        except exceptions.GoogleAPICallError as e:
-            logger.error(f"Google API call error: {str(e)}")
+            catalog = app_state().voice_catalog.get()
+        except Exception as e:
+            logger.error(f"Failed to retrieve voices: {str(e)}")
             return jsonify({'error': f'Failed to retrieve voices: {str(e)}'}), 500
 
-        voices = []
-        for voice in response.voices:
-            if any(lang_code.startswith('en-') for lang_code in voice.language_codes):
-                if voice.ssml_gender == texttospeech.SsmlVoiceGender.MALE:
-                    gender = "Male"
-                elif voice.ssml_gender == texttospeech.SsmlVoiceGender.FEMALE:
-                    gender = "Female"
-                else:
-                    gender = "Neutral"
-
-                language_code = voice.language_codes[0]
-                if language_code == "en-US":
-                    accent = "American"
-                elif language_code == "en-GB":
-                    accent = "British"
-                elif language_code == "en-AU":
-                    accent = "Australian"
-                elif language_code == "en-IN":
-                    accent = "Indian"
-                else:
-                    accent = language_code
-
-                voices.append({
-                    "id": voice.name,
-                    "name": voice.name.split('-')[-1],
-                    "accent": accent,
-                    "gender": gender,
-                    "language": language_code
-                })
-
-        if not voices:
+        voices = catalog.query(**filters)
+        if not voices and request.args.get('language') is None:
             logger.warning("No English voices found in API response")
             return jsonify({'warning': 'No English voices available', 'voices': []}), 200
 
         logger.info(f"Successfully retrieved {len(voices)} voices")
-        return jsonify(voices)
+        response = jsonify(voices)
+        # The catalog's version plus the query: unchanged until the catalog is
+        response.set_etag(f"{catalog.etag}-{hashlib.sha256(repr(sorted(filters.items())).encode()).hexdigest()[:8]}")
+        response.headers['Cache-Control'] = f"private, max-age={current_app.config['VOICE_CATALOG_MAX_AGE']}"
+        return response.make_conditional(request)
 
     except Exception as e:
         logger.error(f"Error in get_voices: {str(e)}")
@@ -796,15 +1094,36 @@ def get_voices():
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
 
-@app.route('/api/grammar-check', methods=['POST'])
+def languagetool_corrections(lang_tool, text):
+    corrections = []
+    for match in lang_tool.check(text):
+        if match.replacements:  # Only add if there are suggestions
+            corrections.append({
+                "original": text[match.offset:match.offset+match.errorLength],
+                "corrected": match.replacements[0],
+                "explanation": match.message,
+                "rule": match.ruleId
+            })
+    return corrections
+
+def languagetool_fallback(text, reason, unavailable_message):
+    lang_tool = services.get('language_tool')
+    if not lang_tool:
+        logger.warning(unavailable_message)
+        return []
+    logger.info(reason)
+    corrections = languagetool_corrections(lang_tool, text)
+    logger.info(f"Processed with LanguageTool fallback, found {len(corrections)} corrections.")
+    return corrections
+
+
+@api.route('/api/grammar-check', methods=['POST'])
 @limiter.limit("15 per minute") # Example: 15 requests per minute
 @login_required # Protect this endpoint
 def grammar_check():
+    from google.api_core import exceptions
     user_id = session.get('user_id') # Get current user
     logger.info(f"User {user_id} requesting /api/grammar_check")
-    if lang_tool is None:
-        logger.error("LanguageTool not initialized")
-        return jsonify({'error': 'Grammar check service unavailable'}), 503
 
     if not request.is_json:
         return jsonify({"error": "Request must be JSON"}), 400
@@ -824,8 +1143,9 @@ def grammar_check():
     logger.info(f"Received grammar check request for text: '{text_to_check[:100]}...'")  # Log more text
 
     corrections = []
-    # Prioritize Gemini if available
-    if gemini_available and gemini_model:
+    # Prioritize Gemini if available; LanguageTool (and its JVM) is only started when needed
+    gemini_model = services.get('gemini')
+    if gemini_model:
         try:
             prompt = f"""Please correct the grammar of the following text and provide explanations for each correction.
             Respond ONLY with a valid JSON list of objects, where each object has 'original', 'corrected', and 'explanation' keys.
@@ -853,7 +1173,7 @@ def grammar_check():
             """
             logger.info("Sending request to Gemini for grammar check.")
             # Using the new SDK structure
-            response = gemini_model.generate_content(prompt)
+            response = generate_content(gemini_model, prompt)
             
             # Debug: Print raw Gemini response text
             logger.debug(f"Raw Gemini response text: {response.text}")
@@ -883,88 +1203,32 @@ def grammar_check():
                 logger.error(f"Failed to parse Gemini JSON response: {e}")
                 logger.error(f"Problematic Gemini response text: {response.text}")
                 # Fallback to LanguageTool if Gemini response is not valid JSON
-                if lang_tool:
-                    logger.info("Falling back to LanguageTool due to Gemini JSON parsing error.")
-                    matches = lang_tool.check(text_to_check)
-                    for match in matches:
-                        if match.replacements:
-                            corrections.append({
-                                "original": text_to_check[match.offset:match.offset+match.errorLength],
-                                "corrected": match.replacements[0],
-                                "explanation": match.message,
-                                "rule": match.ruleId
-                            })
-                    logger.info(f"Processed with LanguageTool fallback, found {len(corrections)} corrections.")
-                else:
-                    logger.warning("LanguageTool not available for fallback after JSON parsing error.")
+                corrections = languagetool_fallback(text_to_check, "Falling back to LanguageTool due to Gemini JSON parsing error.",
+                                                    "LanguageTool not available for fallback after JSON parsing error.")
             except Exception as e:  # Catch other potential errors from Gemini processing
                 logger.error(f"An unexpected error occurred while processing Gemini response: {str(e)}")
                 logger.error(traceback.format_exc())
-                if lang_tool:  # Fallback for other errors
-                    logger.info("Falling back to LanguageTool due to an unexpected error with Gemini.")
-                    matches = lang_tool.check(text_to_check)
-                    for match in matches:
-                        if match.replacements:
-                            corrections.append({
-                                "original": text_to_check[match.offset:match.offset+match.errorLength],
-                                "corrected": match.replacements[0],
-                                "explanation": match.message,
-                                "rule": match.ruleId
-                            })
-                    logger.info(f"Processed with LanguageTool fallback, found {len(corrections)} corrections.")
-                else:
-                    logger.warning("LanguageTool not available for fallback after unexpected Gemini error.")
+                corrections = languagetool_fallback(text_to_check, "Falling back to LanguageTool due to an unexpected error with Gemini.",
+                                                    "LanguageTool not available for fallback after unexpected Gemini error.")
 
         except exceptions.GoogleAPIError as e:  # This might need to be a more general google.api_core.exceptions.GoogleAPIError or specific genai exception
             logger.error(f"Gemini API Error: {str(e)}")
             logger.error(traceback.format_exc())
             # Fallback to LanguageTool if Gemini API fails
-            if lang_tool:
-                logger.info("Falling back to LanguageTool due to Gemini API error.")
-                matches = lang_tool.check(text_to_check)
-                for match in matches:
-                    if match.replacements:
-                        corrections.append({
-                            "original": text_to_check[match.offset:match.offset+match.errorLength],
-                            "corrected": match.replacements[0],
-                            "explanation": match.message,
-                            "rule": match.ruleId
-                        })
-                logger.info(f"Processed with LanguageTool fallback, found {len(corrections)} corrections.")
-            else:
-                logger.warning("LanguageTool not available for fallback after Gemini API error.")
+            corrections = languagetool_fallback(text_to_check, "Falling back to LanguageTool due to Gemini API error.",
+                                                "LanguageTool not available for fallback after Gemini API error.")
         except Exception as e:
             logger.error(f"Unexpected error during Gemini grammar check: {str(e)}")
             logger.error(traceback.format_exc())
             # Fallback for other unexpected errors
-            if lang_tool:
-                logger.info("Falling back to LanguageTool due to an unexpected error during Gemini call.")
-                matches = lang_tool.check(text_to_check)
-                for match in matches:
-                    if match.replacements:
-                        corrections.append({
-                            "original": text_to_check[match.offset:match.offset+match.errorLength],
-                            "corrected": match.replacements[0],
-                            "explanation": match.message,
-                            "rule": match.ruleId
-                        })
-                logger.info(f"Processed with LanguageTool fallback, found {len(corrections)} corrections.")
-            else:
-                logger.warning("LanguageTool not available for fallback after unexpected error.")
+            corrections = languagetool_fallback(text_to_check, "Falling back to LanguageTool due to an unexpected error during Gemini call.",
+                                                "LanguageTool not available for fallback after unexpected error.")
 
     # If Gemini is not available or failed, and LanguageTool is available, use it
-    elif lang_tool:
+    elif services.get('language_tool'):
         logger.info("Using LanguageTool for grammar check (Gemini not available or failed).")
         try:
-            matches = lang_tool.check(text_to_check)
-            for match in matches:
-                if match.replacements:  # Only add if there are suggestions
-                    corrections.append({
-                        "original": text_to_check[match.offset:match.offset+match.errorLength],
-                        "corrected": match.replacements[0],
-                        "explanation": match.message,
-                        "rule": match.ruleId
-                    })
+            corrections = languagetool_corrections(services.get('language_tool'), text_to_check)
             logger.info(f"Processed with LanguageTool, found {len(corrections)} corrections.")
         except Exception as e:
             logger.error(f"Error during LanguageTool grammar check: {str(e)}")
@@ -977,13 +1241,82 @@ def grammar_check():
     return jsonify(corrections)
 
 
-@app.route('/api/summarize_concept', methods=['POST'])
+def summarize_concept(gemini_model, concept_text, target_audience, compression_level):
+    """The summary, key concepts and learning suggestions for a text; raises ValueError if Gemini's answer is unusable."""
+    # Tailor the prompt based on compression level
+    if compression_level == 'high':
+        prompt = f"""Summarize the following concept text concisely for a {target_audience} audience. Identify up to 5 key concepts. Suggest 3-4 focus points for learning and 3-4 related topics.
+            Concept: "{concept_text}"
+            Format your response as a JSON object with keys "summary", "keyConcepts" (list of strings), "learningEnhancement" (an object with "focusPoints" and "suggestedRelatedTopics" as lists of strings).
+            Ensure the summary is very short and highly compressed.
+            """
+    elif compression_level == 'low':
+        prompt = f"""Provide a detailed summary of the following concept text for a {target_audience} audience. Identify 7-10 key concepts. Suggest 5-6 focus points for learning and 5-6 related topics.
+            Concept: "{concept_text}"
+            Format your response as a JSON object with keys "summary", "keyConcepts" (list of strings), "learningEnhancement" (an object with "focusPoints" and "suggestedRelatedTopics" as lists of strings).
+            Ensure the summary is comprehensive and less compressed.
+            """
+    else:  # Medium compression
+        prompt = f"""Summarize the following concept text for a {target_audience} audience. Identify 5-7 key concepts. Suggest 4-5 focus points for learning and 4-5 related topics.
+            Concept: "{concept_text}"
+            Format your response as a JSON object with keys "summary", "keyConcepts" (list of strings), "learningEnhancement" (an object with "focusPoints" and "suggestedRelatedTopics" as lists of strings).
+            The summary should be balanced in detail.
+            """
+
+    logger.info(f"Generating summary with Gemini. Compression: {compression_level}. Concept length: {len(concept_text)}")
+    response = generate_content(gemini_model, prompt)
+
+    # Attempt to parse the response as JSON
+    try:
+        # It's common for the API to return markdown with a JSON block.
+        # We need to extract the JSON part.
+        response_text = response.text
+        # Find the start and end of the JSON block
+        json_start_index = response_text.find('{')
+        json_end_index = response_text.rfind('}') + 1
+
+        if json_start_index != -1 and json_end_index != -1:
+            json_string = response_text[json_start_index:json_end_index]
+            summary_data = json.loads(json_string)
+            logger.info("Successfully parsed Gemini response as JSON.")
+        else:
+            logger.error(f"Could not find JSON in Gemini response: {response_text}")
+            # Fallback: try to create a basic summary if JSON parsing fails
+            summary_data = {
+                "summary": response_text, # Use the whole text as summary
+                "keyConcepts": ["Could not extract key concepts"],
+                "learningEnhancement": {
+                    "focusPoints": ["Unable to determine focus points"],
+                    "suggestedRelatedTopics": ["Unable to determine related topics"]
+                }
+            }
+
+    except json.JSONDecodeError as e:
+        logger.error(f"Failed to parse Gemini response as JSON: {str(e)}. Response text: {response.text}")
+        # Fallback if JSON parsing fails
+        summary_data = {
+            "summary": response.text, # Use the whole text as summary
+            "keyConcepts": ["Failed to parse key concepts from model output"],
+            "learningEnhancement": {
+                "focusPoints": ["Failed to parse focus points"],
+                "suggestedRelatedTopics": ["Failed to parse related topics"]
+            }
+        }
+    except Exception as e: # Catch other potential errors with the response object
+        logger.error(f"Error processing Gemini response: {str(e)}. Response: {response}")
+        raise ValueError(f'Error processing Gemini response: {str(e)}')
+
+    return summary_data
+
+
+@api.route('/api/summarize_concept', methods=['POST'])
 @limiter.limit("5 per minute") # Example: 5 requests per minute
 @login_required # Protect this endpoint
 def summarize_concept_api():
     user_id = session.get('user_id') # Get current user
     logger.info(f"User {user_id} requesting /api/summarize_concept")
-    if not gemini_available or gemini_model is None:
+    gemini_model = services.get('gemini')
+    if gemini_model is None:
         logger.error("Gemini API not available for summarization.")
         return jsonify({'error': 'Summarization service unavailable due to Gemini API issue'}), 503
 
@@ -999,73 +1332,301 @@ def summarize_concept_api():
         # Add to history
         add_user_history(user_id, 'summarize_concept', {'concept_length': len(concept_text), 'audience': target_audience, 'level': compression_level}) # Changed 'concept' to 'concept_text'
 
-        # Tailor the prompt based on compression level
-        if compression_level == 'high':
-            prompt = f"""Summarize the following concept text concisely for a {target_audience} audience. Identify up to 5 key concepts. Suggest 3-4 focus points for learning and 3-4 related topics.
-            Concept: "{concept_text}"
-            Format your response as a JSON object with keys "summary", "keyConcepts" (list of strings), "learningEnhancement" (an object with "focusPoints" and "suggestedRelatedTopics" as lists of strings).
-            Ensure the summary is very short and highly compressed.
-            """
-        elif compression_level == 'low':
-            prompt = f"""Provide a detailed summary of the following concept text for a {target_audience} audience. Identify 7-10 key concepts. Suggest 5-6 focus points for learning and 5-6 related topics.
-            Concept: "{concept_text}"
-            Format your response as a JSON object with keys "summary", "keyConcepts" (list of strings), "learningEnhancement" (an object with "focusPoints" and "suggestedRelatedTopics" as lists of strings).
-            Ensure the summary is comprehensive and less compressed.
-            """
-        else:  # Medium compression
-            prompt = f"""Summarize the following concept text for a {target_audience} audience. Identify 5-7 key concepts. Suggest 4-5 focus points for learning and 4-5 related topics.
-            Concept: "{concept_text}"
-            Format your response as a JSON object with keys "summary", "keyConcepts" (list of strings), "learningEnhancement" (an object with "focusPoints" and "suggestedRelatedTopics" as lists of strings).
-            The summary should be balanced in detail.
-            """
-
-        logger.info(f"Generating summary with Gemini. Compression: {compression_level}. Concept length: {len(concept_text)}")
-        response = gemini_model.generate_content(prompt)
-
-        # Attempt to parse the response as JSON
         try:
-            # It's common for the API to return markdown with a JSON block.
-            # We need to extract the JSON part.
-            response_text = response.text
-            # Find the start and end of the JSON block
-            json_start_index = response_text.find('{')
-            json_end_index = response_text.rfind('}') + 1
-
-            if json_start_index != -1 and json_end_index != -1:
-                json_string = response_text[json_start_index:json_end_index]
-                summary_data = json.loads(json_string)
-                logger.info("Successfully parsed Gemini response as JSON.")
-            else:
-                logger.error(f"Could not find JSON in Gemini response: {response_text}")
-                # Fallback: try to create a basic summary if JSON parsing fails
-                summary_data = {
-                    "summary": response_text, # Use the whole text as summary
-                    "keyConcepts": ["Could not extract key concepts"],
-                    "learningEnhancement": {
-                        "focusPoints": ["Unable to determine focus points"],
-                        "suggestedRelatedTopics": ["Unable to determine related topics"]
-                    }
-                }
-
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse Gemini response as JSON: {str(e)}. Response text: {response.text}")
-            # Fallback if JSON parsing fails
-            summary_data = {
-                "summary": response.text, # Use the whole text as summary
-                "keyConcepts": ["Failed to parse key concepts from model output"],
-                "learningEnhancement": {
-                    "focusPoints": ["Failed to parse focus points"],
-                    "suggestedRelatedTopics": ["Failed to parse related topics"]
-                }
-            }
-        except Exception as e: # Catch other potential errors with the response object
-            logger.error(f"Error processing Gemini response: {str(e)}. Response: {response}")
-            return jsonify({'error': f'Error processing Gemini response: {str(e)}'}), 500
-
-
+            summary_data = summarize_concept(gemini_model, concept_text, target_audience, compression_level)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 500
         return jsonify(summary_data)
 
     except Exception as e:
         logger.error(f"Error in summarize_concept_api: {str(e)}")
         logger.error(traceback.format_exc())
         return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+
+# --- Background jobs ---
+# A job kind is (validate, run): validate(params) raises ValueError for a 400 at
+# submit time; run(params, progress, config) runs on a job worker thread, outside
+# any request, and returns the job's result.
+
+def validate_texttospeech_job(params):
+    if not isinstance(params.get('text'), str) or not params['text'].strip():
+        raise ValueError('Text is required')
+    if params.get('mode') is not None and params['mode'] not in RENDER_MODES:
+        raise ValueError(f"mode must be one of: {', '.join(RENDER_MODES)}")
+    audio_formats.negotiate(params.get('format'), params.get('sampleRate'))
+    return {'text_length': len(params['text'])}
+
+def run_texttospeech_job(params, progress, config):
+    # /api/texttospeech's synthesis, collected into its JSON body
+    tts_client = services.get('tts')
+    if tts_client is None:
+        raise RuntimeError('Text-to-speech service unavailable')
+    encoding, sample_rate = audio_formats.negotiate(params.get('format'), params.get('sampleRate'))
+    sentences = split_sentences(params['text'], app_nltk())
+    sentence_groups = segment_sentences(sentences, langid_model(config), config['LANGID_SWITCH_PENALTY'])
+    segments = sum(len(groups) for groups in sentence_groups)
+    progress(0.0, f"Synthesizing {len(sentences)} sentences")
+
+    synthesis = {}
+    audios, errors = [], []
+    parts = iter_multilingual(tts_client, sentence_groups, params.get('mode', config['TTS_RENDER_MODE']),
+                              config['TTS_SEGMENT_CONCURRENCY'], voices=multilingual_voices(),
+                              cache=app_state().tts_cache, bypass_cache=bool(params.get('no_cache')), info=synthesis,
+                              flights=tts_flights, encoding=encoding, sample_rate=sample_rate)
+    for done, (lang, text_segment, audio_content, error) in enumerate(parts, 1):
+        if error is None:
+            audios.append(audio_content)
+        else:
+            errors.append(error)
+            log_segment_error(lang, text_segment, error)
+        # An SSML part voices several segments, so this may jump ahead
+        progress(min(done / segments, 0.99), f"{done} parts synthesized")
+    if not audios:
+        raise errors[0] if errors else RuntimeError('Failed to generate speech for any parts of the text')
+    return {
+        'audio_base64': base64.b64encode(audio_formats.join(audios, encoding)).decode('utf-8'),
+        'mimetype': audio_formats.MIMETYPES[encoding],
+        'sentences': synthesis['sentences'],
+        'sentence_cache_hits': synthesis['sentence_cache_hits'],
+        'failed_segments': len(errors)
+    }
+
+def validate_summarize_job(params):
+    if not params.get('text'):
+        raise ValueError('No text provided for summarization')
+    return {'concept_length': len(params['text']), 'audience': params.get('audience', 'general'),
+            'level': params.get('level', 'medium')}
+
+def run_summarize_job(params, progress, config):
+    gemini_model = services.get('gemini')
+    if gemini_model is None:
+        raise RuntimeError('Summarization service unavailable due to Gemini API issue')
+    progress(0.0, 'Generating summary')
+    return summarize_concept(gemini_model, params['text'], params.get('audience', 'general'),
+                             params.get('level', 'medium'))
+
+# Kind -> (validate, run); each kind is recorded in history under its endpoint's feature name
+JOB_KINDS = {
+    'texttospeech': (validate_texttospeech_job, run_texttospeech_job),
+    'summarize_concept': (validate_summarize_job, run_summarize_job)
+}
+JOB_HISTORY_FEATURES = {'texttospeech': 'texttospeech_custom', 'summarize_concept': 'summarize_concept'}
+
+# How long one /events stream holds a request thread; EventSource then reconnects
+# (after the stream's retry: delay) with Last-Event-ID and picks up where it was
+JOB_EVENTS_TIMEOUT = 25
+JOB_EVENTS_POLL_INTERVAL = 0.25
+# A comment line this often keeps proxies from closing a quiet stream
+JOB_EVENTS_KEEPALIVE = 15
+
+@api.route('/api/jobs', methods=['POST'])
+@limiter.limit("20 per minute")
+@login_required # Protect this endpoint
+def submit_job():
+    user_id = session.get('user_id') # Get current user
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': 'Invalid request: No JSON data'}), 400
+    kind = data.get('kind')
+    params = data.get('params') or {}
+    if kind not in JOB_KINDS:
+        return jsonify({'error': f"kind must be one of: {', '.join(JOB_KINDS)}"}), 400
+    if not isinstance(params, dict):
+        return jsonify({'error': 'params must be an object'}), 400
+    try:
+        details = JOB_KINDS[kind][0](params)
+        job_id = app_state().job_queue.submit(user_id, kind, params)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except JobLimitError as e:
+        logger.warning(f"User {user_id} job limit reached: {str(e)}")
+        return jsonify({'error': str(e)}), 429
+
+    add_user_history(user_id, JOB_HISTORY_FEATURES[kind], {**details, 'job_id': job_id})
+    logger.info(f"User {user_id} submitted {kind} job {job_id}")
+    response = jsonify(app_state().job_queue.get(job_id, user_id))
+    response.status_code = 202
+    response.headers['Location'] = f"/api/jobs/{job_id}"
+    return response
+
+@api.route('/api/jobs', methods=['GET'])
+@login_required # Protect this endpoint
+def list_jobs():
+    return jsonify({'jobs': app_state().job_queue.recent(session.get('user_id'))})
+
+@api.route('/api/jobs/<job_id>', methods=['GET'])
+@login_required # Protect this endpoint
+def get_job(job_id):
+    job = app_state().job_queue.get(job_id, session.get('user_id'))
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@api.route('/api/jobs/<job_id>/events', methods=['GET'])
+@login_required # Protect this endpoint
+def job_events(job_id):
+    user_id = session.get('user_id')
+    if app_state().job_queue.get(job_id, user_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    last_event_id = request.headers.get('Last-Event-ID')
+
+    def events():
+        # The job may run in another worker process, so its row is polled rather
+        # than waited on; an event goes out whenever it changes. Each event's id is
+        # the job's updated_at, so a reconnecting client is not sent the same state again
+        last_update = last_event_id
+        last_sent = time.monotonic()
+        deadline = last_sent + JOB_EVENTS_TIMEOUT
+        yield "retry: 1000\n\n"
+        while time.monotonic() < deadline:
+            job = app_state().job_queue.get(job_id, user_id)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'Job not found'})}\n\n"
+                return
+            if job['state'] in FINISHED:
+                yield f"id: {job['updated_at']}\nevent: {job['state']}\ndata: {json.dumps(job)}\n\n"
+                return
+            if job['updated_at'] != last_update:
+                last_update = job['updated_at']
+                last_sent = time.monotonic()
+                yield f"id: {last_update}\nevent: progress\ndata: {json.dumps(job)}\n\n"
+            elif time.monotonic() - last_sent >= JOB_EVENTS_KEEPALIVE:
+                last_sent = time.monotonic()
+                yield ": keepalive\n\n"
+            time.sleep(JOB_EVENTS_POLL_INTERVAL)
+
+    response = current_app.response_class(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Keep nginx from buffering the stream
+    return response
+
+
+# --- Application Factory ---
+
+def create_app(config=None):
+    """
+    Build the Flask app. Only state that is safe to share across fork() is
+    created here; gRPC clients, the LanguageTool JVM and background threads
+    are created lazily (or by post_fork()) in the process that uses them.
+    """
+    settings = load_config()
+    settings.update(config or {})
+    app = Flask(__name__, static_folder='static')
+    app.config.update(settings)
+    CORS(app, resources={r"/api/*": {"origins": app.config['CORS_ORIGINS']}}, supports_credentials=True,
+         expose_headers=['X-Cache', 'X-TTS-Sentences', 'X-TTS-Sentence-Cache-Hits', 'X-TTS-Clips']) # Ensure frontend origin is allowed and credentials supported
+    limiter.init_app(app)
+
+    # SQLite connections are per process and the writer thread starts on first
+    # use, so both are safe to create before a fork
+    user_store = UserStore(app.config['USERS_DB'])
+    user_store.migrate_from_json(app.config['USERS_FILE'])
+    # History is written behind the request: handlers enqueue, one thread commits in batches
+    history_writer = HistoryWriter(
+        user_store,
+        flush_interval_ms=app.config['HISTORY_FLUSH_INTERVAL_MS'],
+        max_batch=app.config['HISTORY_FLUSH_BATCH'],
+        retention_days=app.config['HISTORY_RETENTION_DAYS'] or None
+    )
+
+    nltk_data_dir = app.config['NLTK_DATA_DIR']
+    nltk_missing = validate_nltk_data(nltk_data_dir)
+    if nltk_missing:
+        logger.warning(f"NLTK data missing from {nltk_data_dir}: {', '.join(nltk_missing)}. "
+                       f"Run 'python provision.py nltk' when building the image.")
+
+    # Entries are written atomically, so every worker can share the directory
+    tts_cache = cache_warmer = None
+    if app.config['TTS_CACHE_ENABLED']:
+        tts_cache = TTSCache(app.config['TTS_CACHE_DIR'], app.config['TTS_CACHE_MAX_BYTES'])
+        # The warmer thread is per process too; workers take turns through a lock in the cache directory
+        warm_entries = load_warm_set(app.config['TTS_WARM_SET'])
+        if warm_entries:
+            cache_warmer = CacheWarmer(
+                tts_cache.root,
+                warm_entries,
+                in_app_context(app, lambda entry: warm_tts_entry(entry, app.config)),
+                interval=app.config['TTS_WARM_INTERVAL'],
+                budget=app.config['TTS_WARM_BUDGET']
+            )
+
+    voice_catalog = VoiceCatalog(
+        fetch_voice_catalog,
+        ttl=app.config['VOICE_CATALOG_TTL'],
+        snapshot_path=app.config['VOICE_CATALOG_SNAPSHOT'] or None
+    )
+
+    # Jobs are shared through the database; each process runs its own pool, started
+    # here, by post_fork(), or by the first submit
+    job_queue = JobQueue(
+        app.config['JOBS_DB'],
+        {kind: in_app_context(app, lambda params, progress, run=run: run(params, progress, app.config))
+         for kind, (_, run) in JOB_KINDS.items()},
+        workers=app.config['JOBS_WORKERS'],
+        per_user=app.config['JOBS_USER_CONCURRENCY'],
+        max_pending=app.config['JOBS_USER_MAX_PENDING'],
+        lease_seconds=app.config['JOBS_LEASE_SECONDS'],
+        retention_seconds=app.config['JOBS_RETENTION_HOURS'] * 3600
+    )
+
+    # Like the writer, the prober thread is per process: started here, or by post_fork()
+    health_prober = HealthProber(
+        services,
+        build_health_probes(app.config['HEALTH_PROBE_TIMEOUT'], nltk_data_dir),
+        interval=app.config['HEALTH_PROBE_INTERVAL']
+    )
+
+    state = app.extensions['edu_speak'] = AppState(user_store, history_writer, health_prober, voice_catalog,
+                                                   job_queue, tts_cache=tts_cache, cache_warmer=cache_warmer,
+                                                   nltk_data_dir=nltk_data_dir, nltk_missing=nltk_missing)
+    app.register_blueprint(api)
+
+    if app.config['SERVICES_WARMUP']:
+        services.warmup(WARMUP_SERVICES)
+        state.start()
+    return app
+
+
+def in_app_context(app, function):
+    # For callbacks run on background threads, which have no app context of their own
+    def call(*args):
+        with app.app_context():
+            return function(*args)
+    return call
+
+
+def preload_shared():
+    """
+    Called once in a preloading master process before workers are forked:
+    load what workers only ever read, then freeze it out of the garbage
+    collector so copy-on-write pages stay shared.
+    """
+    services.warmup([name for name in WARMUP_SERVICES if services.fork_safe(name)], background=False)
+    gc.freeze()
+
+
+def post_fork(app, warmup=True):
+    """
+    Called in each worker right after fork with the app it serves. Fork-unsafe
+    clients and the history writer were already reset by their at-fork hooks;
+    start this worker's own.
+    """
+    state = app_state(app)
+    state.history_writer.start()
+    if warmup:
+        services.warmup(WARMUP_SERVICES)
+    state.start()
+
+
+_default_app = None
+
+def __getattr__(name):
+    # `app:app` (gunicorn, flask run) is built from the environment on first use,
+    # not on import, so importing this module creates no stores
+    global _default_app
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if _default_app is None:
+        _default_app = create_app()
+    return _default_app
@@ -0,0 +1,234 @@
+"""
+Output formats for the TTS endpoints.
+
+A request picks its encoding with a "format" parameter or, failing that, its
+Accept header, and optionally a "sampleRate"; MP3 at the voice's natural
+rate is the default.
+
+Text is synthesized in pieces (sentences, language segments), and upstream
+returns every piece as a complete file. stitch() turns them into one
+playable file, piece by piece so it can be streamed:
+
+  MP3       frames are self-contained, so pieces are concatenated as they are
+  OGG_OPUS  the pages of every later piece are moved into the first piece's
+            logical stream: its header pages dropped, page sequence and
+            granule positions continued, checksums recomputed
+  LINEAR16  upstream returns a WAV file per piece: one RIFF header, then the
+            PCM data of every piece
+"""
+
+import struct
+
+MP3 = 'MP3'
+OGG_OPUS = 'OGG_OPUS'
+LINEAR16 = 'LINEAR16'
+
+MIMETYPES = {MP3: 'audio/mpeg', OGG_OPUS: 'audio/ogg', LINEAR16: 'audio/wav'}
+
+# Values accepted in a request's "format" parameter
+FORMAT_NAMES = {
+    'mp3': MP3,
+    'ogg': OGG_OPUS,
+    'opus': OGG_OPUS,
+    'ogg_opus': OGG_OPUS,
+    'wav': LINEAR16,
+    'linear16': LINEAR16
+}
+# Accept header media types, in order of preference when several match equally
+ACCEPT_TYPES = {
+    'audio/mpeg': MP3,
+    'audio/mp3': MP3,
+    'audio/ogg': OGG_OPUS,
+    'audio/opus': OGG_OPUS,
+    'audio/wav': LINEAR16,
+    'audio/x-wav': LINEAR16,
+    'audio/wave': LINEAR16
+}
+
+MIN_SAMPLE_RATE = 8000
+MAX_SAMPLE_RATE = 48000
+# Opus only runs at these rates
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+
+def negotiate(format_name=None, sample_rate=None, accept=None):
+    """
+    (encoding, sample_rate or None) for a request's "format" and "sampleRate"
+    parameters and its Accept header (a werkzeug MIMEAccept). Raises
+    ValueError with a message fit for a 400 response.
+    """
+    if format_name:
+        encoding = FORMAT_NAMES.get(str(format_name).lower())
+        if encoding is None:
+            raise ValueError(f"format must be one of: {', '.join(FORMAT_NAMES)}")
+    else:
+        best = accept.best_match(list(ACCEPT_TYPES)) if accept is not None else None
+        encoding = ACCEPT_TYPES.get(best, MP3)
+
+    if sample_rate is None:
+        return encoding, None
+    try:
+        sample_rate = int(sample_rate)
+    except (TypeError, ValueError):
+        raise ValueError('sampleRate must be a whole number of hertz')
+    if not MIN_SAMPLE_RATE <= sample_rate <= MAX_SAMPLE_RATE:
+        raise ValueError(f"sampleRate must be between {MIN_SAMPLE_RATE} and {MAX_SAMPLE_RATE}")
+    if encoding == OGG_OPUS and sample_rate not in OPUS_SAMPLE_RATES:
+        raise ValueError(f"sampleRate for Opus must be one of: {', '.join(map(str, OPUS_SAMPLE_RATES))}")
+    return encoding, sample_rate
+
+
+def stitch(pieces, encoding):
+    """Yield one playable file's bytes from consecutive audio files, consuming `pieces` lazily."""
+    if encoding == LINEAR16:
+        yield from _stitch_wav(pieces, STREAMING_WAV_SIZE)
+    elif encoding == OGG_OPUS:
+        stitcher = OggStitcher()
+        for piece in pieces:
+            yield stitcher.add(piece)
+        yield stitcher.finish()
+    else:
+        yield from pieces
+
+
+def join(pieces, encoding):
+    """stitch() into bytes; a WAV gets its exact size in the header."""
+    if encoding != LINEAR16:
+        return b''.join(stitch(pieces, encoding))
+    pieces = list(pieces)
+    data_size = sum(len(parse_wav(piece)[1]) for piece in pieces)
+    return b''.join(_stitch_wav(pieces, data_size))
+
+
+# --- WAV ---
+
+# Size written into a streamed WAV header, whose length is not known up front
+STREAMING_WAV_SIZE = 0xFFFFFFFF - 36
+
+
+def parse_wav(data):
+    """(fmt chunk body, PCM data) of a RIFF/WAVE file."""
+    if data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise ValueError('Not a WAV file')
+    fmt = pcm = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id, size = struct.unpack_from('<4sI', data, offset)
+        body = data[offset + 8:offset + 8 + size]
+        if chunk_id == b'fmt ':
+            fmt = body
+        elif chunk_id == b'data':
+            pcm = body
+        offset += 8 + size + (size & 1)
+    if fmt is None or pcm is None:
+        raise ValueError('WAV file without fmt or data chunk')
+    return fmt, pcm
+
+
+def wav_header(fmt, data_size):
+    riff_size = min(4 + 8 + len(fmt) + 8 + data_size, 0xFFFFFFFF)
+    return (struct.pack('<4sI4s', b'RIFF', riff_size, b'WAVE') +
+            struct.pack('<4sI', b'fmt ', len(fmt)) + fmt +
+            struct.pack('<4sI', b'data', data_size))
+
+
+def _stitch_wav(pieces, data_size):
+    for index, piece in enumerate(pieces):
+        fmt, pcm = parse_wav(piece)
+        if index == 0:
+            yield wav_header(fmt, data_size)
+        yield pcm
+
+
+# --- Ogg ---
+
+BOS = 0x02
+EOS = 0x04
+
+
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 24
+        for _ in range(8):
+            crc = (crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+CRC_TABLE = _crc_table()
+
+
+def ogg_crc(data):
+    """The Ogg page checksum: CRC-32, polynomial 0x04C11DB7, not reflected, no initial or final xor."""
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ CRC_TABLE[(crc >> 24) ^ byte]
+    return crc
+
+
+def ogg_pages(data):
+    """Yield (header_type, granule, serial, sequence, lacing, body) for every page of an Ogg file."""
+    offset = 0
+    while offset < len(data):
+        if data[offset:offset + 4] != b'OggS':
+            raise ValueError('Not an Ogg stream')
+        header_type, granule, serial, sequence = struct.unpack_from('<BqII', data, offset + 5)
+        segments = data[offset + 26]
+        lacing = data[offset + 27:offset + 27 + segments]
+        start = offset + 27 + segments
+        end = start + sum(lacing)
+        yield header_type, granule, serial, sequence, lacing, data[start:end]
+        offset = end
+
+
+def ogg_page(header_type, granule, serial, sequence, lacing, body):
+    header = struct.pack('<4sBBqIII', b'OggS', 0, header_type, granule, serial, sequence, 0)
+    page = bytearray(header + bytes([len(lacing)]) + bytes(lacing) + body)
+    struct.pack_into('<I', page, 22, ogg_crc(page))
+    return bytes(page)
+
+
+class OggStitcher:
+    """
+    Chains Ogg Opus files into one logical stream. Each later file's decoder
+    priming (its pre-skip) stays in as a few milliseconds of audio, and the
+    last page is held back until the next file or finish() shows whether it
+    ends the stream.
+    """
+    def __init__(self):
+        self.serial = None
+        self.sequence = 0
+        self.granule_offset = 0
+        self.held = None
+
+    def add(self, data):
+        out = []
+        first_file = self.serial is None
+        end_granule = 0
+        for header_type, granule, serial, _, lacing, body in ogg_pages(data):
+            if first_file:
+                self.serial = serial
+            elif granule == 0:
+                continue  # OpusHead/OpusTags of a later file: the first file's describe the stream
+            if granule != -1:  # -1: no packet ends on this page
+                end_granule = granule
+                granule += self.granule_offset
+            if self.held is not None:
+                out.append(self._page(*self.held))
+            self.held = (header_type & ~EOS, granule, lacing, body)
+        self.granule_offset += end_granule
+        return b''.join(out)
+
+    def finish(self):
+        if self.held is None:
+            return b''
+        header_type, granule, lacing, body = self.held
+        self.held = None
+        return self._page(header_type | EOS, granule, lacing, body)
+
+    def _page(self, header_type, granule, lacing, body):
+        page = ogg_page(header_type if self.sequence == 0 else header_type & ~BOS,
+                        granule, self.serial, self.sequence, lacing, body)
+        self.sequence += 1
+        return page
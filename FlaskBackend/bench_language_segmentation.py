@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""
+Microbenchmark for language segmentation.
+
+Times the per-word cost of `segment_languages()` (lexicon and trigram-model
+paths) against the per-word `detect_language_for_word()` loop it replaced
+(reproduced below, including its INFO log line per word, written to
+/dev/null), on multi-language inputs built from the test_language_detection
+phrases. Also reports how each path segments held-out sentences (none of
+them in langid_corpus/, most of them plain English), the latency of one
+50-word sentence, and how many TTS segments Viterbi smoothing saves:
+
+    python bench_language_segmentation.py                 # 100k words
+    python bench_language_segmentation.py --words 1000000 --repeat 5
+    python bench_language_segmentation.py --switch-penalty 3
+"""
+
+import argparse
+import logging
+import os
+import time
+
+from langid import SWITCH_PENALTY, LanguageModel
+from language_segmentation import segment_languages
+
+PHRASES = [
+    "Hello bonjour hola guten tag",
+    "I speak English, je parle français, y hablo español",
+    "The quick brown fox jumps over the lazy dog",
+    "Bonjour mes amis, comment allez-vous aujourd'hui?",
+    "Hola amigos, ¿cómo están todos hoy?",
+    "Guten Morgen, wie geht es dir heute?",
+]
+
+# Everyday sentences with words the model alone tends to misdetect
+MIXED_SENTENCES = [
+    "She sat at the table and read a la carte menu in the cafe",
+    "Yesterday we went to the park and ate a sandwich",
+    "Je suis allé au marché avec ma mère hier matin",
+    "My friend Pedro es muy simpático and he likes to sing",
+    "We say danke schön when someone helps us in Berlin",
+]
+
+# Plain English prose, the bulk of /api/texttospeech input: each sentence is one English segment
+ENGLISH_PROSE = [
+    "Vocabulary exercises improve reading comprehension.",
+    "Taxes and regulations complicate international trade.",
+    "The delicious pasta was cooked by a retired professor.",
+    "Electric cars are becoming cheaper every year.",
+    "Temperatures will drop sharply after midnight.",
+    "Students should review their notes before the final examination.",
+    "The museum offers guided tours on weekends.",
+    "Our neighbours adopted a playful puppy last summer.",
+    "Regular practice builds confidence when speaking a foreign language.",
+    "The committee postponed its decision until further information arrives.",
+    "Photosynthesis converts sunlight into chemical energy.",
+    "Please submit your assignment through the online portal.",
+]
+
+# Evaluation sentences kept out of langid_corpus/ (test_language_segmentation checks),
+# with the languages of the TTS segments each should be split into
+HELD_OUT = [(sentence, ('en',)) for sentence in ENGLISH_PROSE] + [
+    ("Les élèves préparent un exposé sur la révolution française.", ('fr',)),
+    ("Ma cousine travaille dans une boulangerie près du marché.", ('fr',)),
+    ("Los estudiantes preparan una presentación sobre la historia de México.", ('es',)),
+    ("Mi hermana trabaja en una panadería cerca del mercado.", ('es',)),
+    ("Die Schüler bereiten einen Vortrag über die Geschichte Berlins vor.", ('de',)),
+    ("Meine Schwester arbeitet in einer Bäckerei neben dem Markt.", ('de',)),
+    ("Gli studenti preparano una presentazione sulla storia di Roma.", ('it',)),
+    ("Mia sorella lavora in una panetteria vicino al mercato.", ('it',)),
+    ("Os alunos preparam uma apresentação sobre a história do Brasil.", ('pt',)),
+    ("Minha irmã trabalha numa padaria perto do mercado.", ('pt',)),
+    ("My teacher always greets us with bonjour à tous et bienvenue", ('en', 'fr')),
+    ("At the restaurant we asked for una botella de agua por favor", ('en', 'es')),
+    ("Ich habe leider keine Zeit today because of my exams", ('de', 'en')),
+]
+
+legacy_logger = logging.getLogger('bench.legacy')
+
+
+def legacy_detect_language_for_word(text):
+    # The pre-segmentation implementation from app.py, unchanged apart from the logger
+    french_words = {'bonjour', 'merci', 'oui', 'non', 'le', 'la', 'les', 'et', 'je', 'tu', 'il', 'elle', 'nous', 'vous', 'ils', 'elles', 'un', 'une', 'des', 'du', 'de', 'à', 'au', 'aux', 'avec', 'pour', 'dans', 'sur', 'sous', 'sans', 'qui', 'que', 'quoi', 'comment', 'pourquoi', 'où'}
+    spanish_words = {'hola', 'gracias', 'sí', 'no', 'el', 'la', 'los', 'las', 'y', 'yo', 'tú', 'él', 'ella', 'nosotros', 'vosotros', 'ellos', 'ellas', 'un', 'una', 'unos', 'unas', 'del', 'al', 'a', 'con', 'para', 'en', 'sobre', 'bajo', 'sin', 'quien', 'que', 'como', 'porque', 'donde'}
+    german_words = {'hallo', 'danke', 'ja', 'nein', 'der', 'die', 'das', 'und', 'ich', 'du', 'er', 'sie', 'es', 'wir', 'ihr', 'sie', 'ein', 'eine', 'einen', 'einem', 'einer', 'eines', 'mit', 'für', 'in', 'auf', 'unter', 'ohne', 'wer', 'was', 'wie', 'warum', 'wo'}
+    try:
+        cleaned_text = text.lower().strip().rstrip('.,:;!?')
+        if cleaned_text in french_words:
+            legacy_logger.info(f"Detected '{text}' as French")
+            return 'fr'
+        elif cleaned_text in spanish_words:
+            legacy_logger.info(f"Detected '{text}' as Spanish")
+            return 'es'
+        elif cleaned_text in german_words:
+            legacy_logger.info(f"Detected '{text}' as German")
+            return 'de'
+        if any(char in 'éèêëàâäæçîïôœùûüÿ' for char in cleaned_text):
+            legacy_logger.info(f"Detected '{text}' as likely French (character patterns)")
+            return 'fr'
+        elif any(char in 'áéíóúüñ¿¡' for char in cleaned_text):
+            legacy_logger.info(f"Detected '{text}' as likely Spanish (character patterns)")
+            return 'es'
+        elif any(char in 'äöüß' for char in cleaned_text):
+            legacy_logger.info(f"Detected '{text}' as likely German (character patterns)")
+            return 'de'
+        legacy_logger.info(f"Defaulting '{text}' to English")
+        return 'en'
+    except Exception as e:
+        legacy_logger.error(f"Error detecting language for '{text}': {e}")
+        return 'en'
+
+
+def legacy_segment(text):
+    """The old grouping loop from text_to_speech_custom: [(lang, segment_text)]."""
+    current_lang = None
+    current_group = []
+    lang_groups = []
+    for word in text.split(' '):
+        if not word.strip():
+            continue
+        detected_lang = legacy_detect_language_for_word(word)
+        if detected_lang != current_lang:
+            if current_group:
+                lang_groups.append((current_lang, ' '.join(current_group)))
+            current_lang = detected_lang
+            current_group = [word]
+        else:
+            current_group.append(word)
+    if current_group:
+        lang_groups.append((current_lang, ' '.join(current_group)))
+    return lang_groups
+
+
+def segment_counts(model, switch_penalty, texts):
+    """Total TTS segments for texts, (unsmoothed, smoothed)."""
+    unsmoothed = smoothed = 0
+    for text in texts:
+        stats = {}
+        segment_languages(text, model, switch_penalty, stats)
+        unsmoothed += stats['segments_unsmoothed']
+        smoothed += stats['segments']
+    return unsmoothed, smoothed
+
+
+def held_out_results(model=None, switch_penalty=0.0, sentences=HELD_OUT):
+    """
+    (sentences split into exactly their labelled languages, total segments)
+    over (sentence, languages) pairs; without a model, the lexicon path.
+    """
+    correct = segments = 0
+    for sentence, languages in sentences:
+        spans = segment_languages(sentence, model, switch_penalty)
+        correct += tuple(lang for lang, _, _ in spans) == languages
+        segments += len(spans)
+    return correct, segments
+
+
+def build_text(words):
+    pool = ' '.join(PHRASES).split()
+    return ' '.join(pool[i % len(pool)] for i in range(words))
+
+
+def best_of(repeat, func, text):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--words', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=3, help='Report the best of N runs')
+    parser.add_argument('--switch-penalty', type=float,
+                        default=float(os.environ.get('LANGID_SWITCH_PENALTY', SWITCH_PENALTY)))
+    args = parser.parse_args()
+
+    handler = logging.FileHandler(os.devnull)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    legacy_logger.addHandler(handler)
+    legacy_logger.setLevel(logging.INFO)
+    legacy_logger.propagate = False
+
+    model = LanguageModel.load()
+    text = build_text(args.words)
+    legacy = best_of(args.repeat, legacy_segment, text)
+    lexicon = best_of(args.repeat, segment_languages, text)
+    penalty = args.switch_penalty
+    trigram = best_of(args.repeat, lambda text: segment_languages(text, model), text)
+    smoothed = best_of(args.repeat, lambda text: segment_languages(text, model, penalty), text)
+    sentence = build_text(50)
+    sentence_seconds = best_of(max(args.repeat, 100), lambda text: segment_languages(text, model, penalty), sentence)
+
+    print(f"{args.words} words (best of {args.repeat})")
+    for label, seconds in [('per-word detect loop', legacy), ('lexicons', lexicon), ('trigram model', trigram),
+                           ('trigram + smoothing', smoothed)]:
+        print(f"  {label:22s} {seconds * 1000:9.1f} ms  {seconds / args.words * 1e9:8.0f} ns/word  "
+              f"{legacy / seconds:6.1f}x")
+    print(f"50-word sentence, trigram model + smoothing: {sentence_seconds * 1e6:.0f} us")
+    prose = [(sentence, ('en',)) for sentence in ENGLISH_PROSE]
+    print(f"Held-out sentences segmented as labelled ({len(HELD_OUT)} sentences, "
+          f"{sum(len(languages) for _, languages in HELD_OUT)} segments; {len(prose)} English prose, 1 segment each):")
+    for label, settings in [('lexicons', (None, 0.0)), ('trigram model', (model, 0.0)),
+                            ('trigram + smoothing', (model, penalty))]:
+        correct, segments = held_out_results(*settings)
+        prose_correct, prose_segments = held_out_results(*settings, sentences=prose)
+        print(f"  {label:22s} {correct:3d}/{len(HELD_OUT)} ({segments} segments)  "
+              f"English prose {prose_correct:2d}/{len(prose)} ({prose_segments} segments)")
+    for label, texts in [('test phrases', PHRASES), ('mixed sentences', MIXED_SENTENCES)]:
+        before, after = segment_counts(model, penalty, texts)
+        print(f"TTS segments for {len(texts)} {label} (switch penalty {penalty:g}): "
+              f"{before} unsmoothed -> {after} smoothed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Startup benchmark for the Flask backend.
+
+Runs `python -X importtime -c "import app"` in a fresh interpreter, parses
+the import-time report, and separately measures wall-clock time from a cold
+interpreter to the first /api/health response. Exits non-zero when either
+exceeds its threshold, so it can gate CI:
+
+    python bench_startup.py
+    python bench_startup.py --import-budget-ms 800 --health-budget-ms 1200 --top 15
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Lines look like: "import time:       123 |       4567 |   package.module"
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)')
+
+HEALTH_SCRIPT = """
+import time
+start = time.perf_counter()
+import app
+app.app.test_client().get('/api/health')
+print(time.perf_counter() - start)
+"""
+
+# Libraries that must only be imported on the request paths that need them
+LAZY_MODULES = ['google.cloud.texttospeech', 'google.cloud.speech', 'google.cloud.vision',
+                'google.generativeai', 'language_tool_python', 'nltk', 'numpy', 'googletrans']
+
+
+def run_app_python(args, tmp):
+    # Every store the app creates goes in `tmp`, not the source tree
+    env = dict(os.environ, SERVICES_WARMUP='0', USERS_DB=os.path.join(tmp, 'users.db'),
+               JOBS_DB=os.path.join(tmp, 'jobs.db'), TTS_CACHE_DIR=os.path.join(tmp, 'tts_cache'),
+               VOICE_CATALOG_SNAPSHOT=os.path.join(tmp, 'voice_catalog.json'))
+    return subprocess.run([sys.executable] + args, cwd=HERE, env=env,
+                          capture_output=True, text=True, timeout=120)
+
+
+def parse_importtime(stderr):
+    """Returns (total self time in us, [(cumulative us, module)] for app's direct imports, set of modules)."""
+    total_self, top_level, modules = 0, [], set()
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        total_self += int(self_us)
+        modules.add(module)
+        if len(indent) == 3:  # Nesting adds two spaces per level; level 1 is what app imports itself
+            top_level.append((int(cumulative_us), module))
+    return total_self, sorted(top_level, reverse=True), modules
+
+
+def measure(tmp):
+    result = run_app_python(['-X', 'importtime', '-c', 'import app'], tmp)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing app failed:\n{result.stderr}")
+    total_us, top_level, modules = parse_importtime(result.stderr)
+
+    result = run_app_python(['-c', HEALTH_SCRIPT], tmp)
+    if result.returncode != 0:
+        raise RuntimeError(f"First /api/health failed:\n{result.stderr}")
+    health_seconds = float(result.stdout.strip().splitlines()[-1])
+    return {
+        'import_ms': total_us / 1000,
+        'top_level': top_level,
+        'eager_heavy_modules': [m for m in LAZY_MODULES if m in modules],
+        'first_health_ms': health_seconds * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--import-budget-ms', type=float,
+                        default=float(os.environ.get('IMPORT_BUDGET_MS', '1000')))
+    parser.add_argument('--health-budget-ms', type=float,
+                        default=float(os.environ.get('HEALTH_BUDGET_MS', '2000')))
+    parser.add_argument('--top', type=int, default=10, help='Show the N slowest direct imports')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        result = measure(tmp)
+
+    print("Slowest imports made directly by app.py:")
+    for cumulative_us, module in result['top_level'][:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {module}")
+    print(f"Total import time:     {result['import_ms']:8.1f} ms (budget {args.import_budget_ms:.0f} ms)")
+    print(f"First /api/health:     {result['first_health_ms']:8.1f} ms (budget {args.health_budget_ms:.0f} ms)")
+
+    failures = []
+    if result['import_ms'] > args.import_budget_ms:
+        failures.append('import time over budget')
+    if result['first_health_ms'] > args.health_budget_ms:
+        failures.append('time to first /api/health over budget')
+    if result['eager_heavy_modules']:
+        failures.append(f"imported eagerly: {', '.join(result['eager_heavy_modules'])}")
+    if failures:
+        print(f"FAIL: {'; '.join(failures)}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Benchmark /api/tts_google output formats: bytes per second of speech.
+
+Synthesizes the warm set's phrases (or --text) with the real Google TTS API,
+so it needs GOOGLE_APPLICATION_CREDENTIALS, once per format and sample rate,
+stitched the way the endpoint does it. The length of the speech is taken
+from an uncompressed LINEAR16 run (16-bit mono PCM: two bytes per sample).
+
+    python bench_tts_formats.py
+    python bench_tts_formats.py --voice fr-FR-Standard-A --text "Bonjour à tous."
+"""
+
+import argparse
+import time
+
+import audio_formats
+from cache_warmer import TTS_GOOGLE, load_warm_set
+from tts_synthesis import split_sentences, synthesize_sentences, voice_language_code
+
+OPTIONS = [
+    (audio_formats.MP3, None),
+    (audio_formats.MP3, 16000),
+    (audio_formats.OGG_OPUS, None),
+    (audio_formats.OGG_OPUS, 16000),
+    (audio_formats.OGG_OPUS, 8000),
+    (audio_formats.LINEAR16, 24000),
+    (audio_formats.LINEAR16, 16000),
+]
+
+
+def synthesize(client, texts, voice, speed, encoding, sample_rate):
+    """Total bytes and seconds of synthesis for every text in `encoding`."""
+    lang = voice_language_code(voice).split('-')[0]
+    total = 0
+    start = time.perf_counter()
+    for text in texts:
+        results, _ = synthesize_sentences(client, split_sentences(text, lang=lang), voice, speed,
+                                          encoding=encoding, sample_rate=sample_rate)
+        for _, error in results:
+            if error is not None:
+                raise error
+        total += len(audio_formats.join([audio for audio, _ in results], encoding))
+    return total, time.perf_counter() - start
+
+
+def speech_seconds(client, texts, voice, speed):
+    rate = 16000
+    seconds = 0.0
+    lang = voice_language_code(voice).split('-')[0]
+    for text in texts:
+        results, _ = synthesize_sentences(client, split_sentences(text, lang=lang), voice, speed,
+                                          encoding=audio_formats.LINEAR16, sample_rate=rate)
+        for audio, error in results:
+            if error is not None:
+                raise error
+            seconds += len(audio_formats.parse_wav(audio)[1]) / (2 * rate)
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--voice', default='en-US-Standard-D')
+    parser.add_argument('--speed', type=float, default=1.0)
+    parser.add_argument('--text', action='append', help='Text to synthesize (repeatable); default: the warm set')
+    parser.add_argument('--warm-set', default='warm_set.json')
+    args = parser.parse_args()
+
+    from google.cloud import texttospeech
+    client = texttospeech.TextToSpeechClient()
+
+    texts = args.text or list(dict.fromkeys(entry['text'] for entry in load_warm_set(args.warm_set)
+                                            if entry['endpoint'] == TTS_GOOGLE))
+    seconds = speech_seconds(client, texts, args.voice, args.speed)
+    print(f"{len(texts)} texts, {seconds:.1f} s of speech ({args.voice}, speed {args.speed})")
+    for encoding, sample_rate in OPTIONS:
+        size, elapsed = synthesize(client, texts, args.voice, args.speed, encoding, sample_rate)
+        rate = f"{sample_rate} Hz" if sample_rate else 'natural rate'
+        print(f"  {encoding:9s} {rate:12s} {size:9d} bytes  {size / seconds:8.0f} bytes/s "
+              f"({size * 8 / seconds / 1000:6.1f} kbit/s)  {elapsed * 1000:7.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
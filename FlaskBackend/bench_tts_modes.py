@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Benchmark /api/texttospeech render modes: upstream calls and latency per request.
+
+Runs `synthesize_multilingual()` against a simulated TTS client (no network or
+credentials needed) whose latency is a fixed round trip plus a per-character
+cost, on the test_language_detection phrases and a few mixed sentences,
+segmented the way the endpoint does it. Compares:
+
+  serial    one call per segment, one after another (the original loop)
+  segments  one call per segment, concurrently
+  ssml      one SSML call per mixed-language sentence
+
+    python bench_tts_modes.py
+    python bench_tts_modes.py --rtt-ms 250 --per-char-ms 1 --concurrency 2
+"""
+
+import argparse
+import os
+import re
+import statistics
+import time
+
+from bench_language_segmentation import MIXED_SENTENCES, PHRASES
+from langid import SWITCH_PENALTY, LanguageModel
+from language_segmentation import segment_sentences
+from tts_synthesis import SEGMENTS, SSML, split_sentences, synthesize_multilingual
+
+
+class SimulatedClient:
+    def __init__(self, rtt, per_char):
+        self.rtt = rtt
+        self.per_char = per_char
+        self.calls = 0
+
+    def synthesize_speech(self, input, voice, audio_config):
+        self.calls += 1
+        text = input.ssml or input.text
+        # Synthesis time follows what is spoken, not the markup around it
+        spoken = re.sub(r'<[^>]+>', '', text)
+        time.sleep(self.rtt + self.per_char * len(spoken))
+
+        class Response:
+            audio_content = text.encode('utf-8')
+        return Response()
+
+
+def run(mode, texts, model, args):
+    client = SimulatedClient(args.rtt_ms / 1000, args.per_char_ms / 1000)
+    latencies = []
+    for text in texts:
+        groups = segment_sentences(split_sentences(text), model, args.switch_penalty)
+        start = time.perf_counter()
+        if mode == 'serial':
+            synthesize_multilingual(client, groups, SEGMENTS, max_concurrency=1)
+        else:
+            synthesize_multilingual(client, groups, mode, max_concurrency=args.concurrency)
+        latencies.append(time.perf_counter() - start)
+    return client.calls / len(texts), statistics.mean(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rtt-ms', type=float, default=150.0, help='Simulated per-call round trip')
+    parser.add_argument('--per-char-ms', type=float, default=0.5, help='Simulated synthesis cost per character')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--switch-penalty', type=float,
+                        default=float(os.environ.get('LANGID_SWITCH_PENALTY', SWITCH_PENALTY)))
+    args = parser.parse_args()
+
+    model = LanguageModel.load()
+    texts = PHRASES + MIXED_SENTENCES
+    print(f"{len(texts)} texts, simulated upstream: {args.rtt_ms:.0f} ms/call + {args.per_char_ms} ms/char")
+    for mode in ['serial', SEGMENTS, SSML]:
+        calls, latency_ms = run(mode, texts, model, args)
+        print(f"  {mode:9s} {calls:5.2f} calls/request  {latency_ms:7.1f} ms/request")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Benchmark history-append latency: legacy users.json rewrite vs SQLite store.
+
+Seeds both stores with N existing history rows spread over a set of users,
+then times a handful of single-entry appends against each.
+
+    python bench_user_store.py                  # 10k and 1M rows
+    python bench_user_store.py --rows 10000 --appends 50
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from user_store import UserStore, utc_timestamp
+
+USERS = 1000
+
+
+def seed_json(path, rows):
+    per_user = rows // USERS
+    users = {
+        f"user{i}": {
+            'password_hash': 'x',
+            'history': [
+                {'timestamp': utc_timestamp(), 'feature': 'tts_google', 'details': {'text_length': 42}}
+                for _ in range(per_user)
+            ]
+        }
+        for i in range(USERS)
+    }
+    with open(path, 'w') as f:
+        json.dump(users, f, indent=4)
+
+
+def seed_sqlite(path, rows):
+    store = UserStore(path)
+    per_user = rows // USERS
+    conn = store._connect()
+    conn.execute('BEGIN')
+    conn.executemany(
+        'INSERT INTO users (username, password_hash, created_at) VALUES (?, ?, ?)',
+        [(f"user{i}", 'x', utc_timestamp()) for i in range(USERS)]
+    )
+    details = json.dumps({'text_length': 42})
+    for i in range(USERS):
+        conn.executemany(
+            'INSERT INTO history (username, timestamp, feature, details) VALUES (?, ?, ?, ?)',
+            [(f"user{i}", utc_timestamp(), 'tts_google', details)] * per_user
+        )
+    conn.execute('COMMIT')
+    return store
+
+
+def append_json(path):
+    # What add_user_history used to do: load everything, append, rewrite everything
+    with open(path, 'r') as f:
+        users = json.load(f)
+    users['user0']['history'].append(
+        {'timestamp': utc_timestamp(), 'feature': 'tts_google', 'details': {'text_length': 42}}
+    )
+    with open(path, 'w') as f:
+        json.dump(users, f, indent=4)
+
+
+def time_appends(fn, appends):
+    samples = []
+    for _ in range(appends):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 1_000_000])
+    parser.add_argument('--appends', type=int, default=20)
+    parser.add_argument('--json-appends', type=int, default=3,
+                        help='Appends timed against users.json (each one rewrites the whole file)')
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'store':>8} {'median ms':>10} {'max ms':>10}")
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path = os.path.join(tmp, 'users.json')
+            db_path = os.path.join(tmp, 'users.db')
+
+            seed_json(json_path, rows)
+            median, worst = time_appends(lambda: append_json(json_path), args.json_appends)
+            print(f"{rows:>10} {'json':>8} {median:>10.2f} {worst:>10.2f}")
+
+            store = seed_sqlite(db_path, rows)
+            median, worst = time_appends(
+                lambda: store.add_history('user0', 'tts_google', {'text_length': 42}), args.appends
+            )
+            print(f"{rows:>10} {'sqlite':>8} {median:>10.2f} {worst:>10.2f}")
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""
+Background warming of the TTS cache for a fixed warm set.
+
+The warm set is a JSON file listing the phrases every learner is offered and
+the voices and speeds they are played with:
+
+    {
+        "phrases": ["The quick brown fox jumps over the lazy dog.", ...],
+        "voices": ["en-US-Standard-D"],
+        "speeds": [1.0],
+        "multilingual": true
+    }
+
+Each phrase becomes one entry per voice and speed (/api/tts_google), plus one
+for /api/texttospeech if "multilingual" is set. A daemon thread passes every
+entry to `warm(entry)`, which synthesizes whatever is not cached yet and
+returns the number of upstream calls it made. A run stops once it has spent
+`budget` calls; the rest (and anything that failed) is picked up by another
+run `retry_interval` seconds later.
+
+Runs happen at startup and then every `interval` seconds, which also
+re-synthesizes entries the cache has evicted meanwhile. Every worker has
+the thread, but only one runs at a time (an flock on <root>/.warm.lock), and
+a worker skips a run that another finished within the interval. The outcome
+of the last run is written to <root>/.warm.json, so any worker can report it.
+"""
+
+import datetime
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from process_hooks import after_fork_in_child
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, each worker warms on its own
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+TTS_GOOGLE = 'tts_google'
+TEXTTOSPEECH = 'texttospeech'
+
+
+def _utc_now():
+    return datetime.datetime.utcnow().isoformat() + 'Z'
+
+
+def load_warm_set(path):
+    """The warm set's entries, or [] if there is no file."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            warm_set = json.load(f)
+    except FileNotFoundError:
+        return []
+    entries = []
+    for phrase in warm_set.get('phrases', []):
+        if warm_set.get('multilingual'):
+            entries.append({'endpoint': TEXTTOSPEECH, 'text': phrase})
+        for voice in warm_set.get('voices', []):
+            for speed in warm_set.get('speeds', [1.0]):
+                entries.append({'endpoint': TTS_GOOGLE, 'text': phrase, 'voice': voice, 'speed': float(speed)})
+    return entries
+
+
+class CacheWarmer:
+    def __init__(self, root, entries, warm, interval=6 * 3600, budget=50, retry_interval=600, poll_interval=60):
+        self.root = root
+        self.entries = entries
+        self.warm = warm
+        self.interval = interval
+        self.budget = budget
+        self.retry_interval = min(retry_interval, interval)
+        self.poll_interval = min(poll_interval, self.retry_interval)
+        self.status_path = os.path.join(root, '.warm.json')
+        self._reset()
+        # The parent's thread does not survive fork(); post_fork() starts the child's
+        after_fork_in_child(self._reset)
+
+    def _reset(self):
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._wake = threading.Event()
+        self._stopping = False
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='tts-cache-warmer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        thread.join(timeout)
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"TTS cache warming run failed: {str(e)}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def due(self, status):
+        if status is None:
+            return True
+        complete = status['warm'] == status['entries'] == len(self.entries)
+        age = time.time() - status['finished_at_epoch']
+        return age >= (self.interval if complete else self.retry_interval)
+
+    def run_once(self, force=False):
+        """Warm the set unless another worker is at it or did so recently. Returns the status written, or None."""
+        lock_file = open(os.path.join(self.root, '.warm.lock'), 'a')
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return None  # Another worker is warming
+            if not force and not self.due(self.status()):
+                return None
+            status = self._warm_all()
+            self._write_status(status)
+            return status
+        finally:
+            lock_file.close()
+
+    def _warm_all(self):
+        started_at = _utc_now()
+        calls = warm = failed = 0
+        last_error = None
+        for entry in self.entries:
+            if calls >= self.budget:
+                logger.info(f"TTS warming budget of {self.budget} calls spent; "
+                            f"{len(self.entries) - warm - failed} entries left for the next run")
+                break
+            try:
+                calls += self.warm(entry)
+                warm += 1
+            except Exception as e:
+                failed += 1
+                last_error = f"{entry['endpoint']} '{entry['text'][:50]}': {str(e)}"
+                logger.warning(f"Failed to warm TTS cache entry {last_error}")
+        logger.info(f"Warmed {warm}/{len(self.entries)} TTS cache entries with {calls} upstream calls")
+        return {
+            'started_at': started_at,
+            'finished_at': _utc_now(),
+            'finished_at_epoch': time.time(),
+            'entries': len(self.entries),
+            'warm': warm,
+            'failed': failed,
+            'coverage': round(warm / len(self.entries), 3) if self.entries else None,
+            'calls': calls,
+            'budget': self.budget,
+            'last_error': last_error
+        }
+
+    def _write_status(self, status):
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.tmp-warm-')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(status, f)
+            os.replace(tmp_path, self.status_path)
+        except OSError as e:
+            logger.error(f"Failed to write TTS warming status: {str(e)}")
+
+    def status(self):
+        """The last run's outcome, whichever worker made it, or None before the first."""
+        try:
+            with open(self.status_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def stats(self):
+        status = self.status() or {}
+        return {
+            'running': self.running(),
+            'entries': len(self.entries),
+            'interval_seconds': self.interval,
+            'retry_interval_seconds': self.retry_interval,
+            'budget': self.budget,
+            'last_run': {name: value for name, value in status.items() if name != 'finished_at_epoch'} or None
+        }
@@ -0,0 +1,28 @@
+# Gunicorn configuration for the Flask backend: gunicorn -c gunicorn.conf.py app:app
+#
+# The master imports the app once (preload_app) and forks workers from it, so
+# parsed config, word lists and NLTK data are shared copy-on-write. Nothing that
+# is unsafe to fork may exist in the master: gRPC clients, the LanguageTool JVM
+# and background threads are only created in each worker, after the fork.
+import multiprocessing
+import os
+
+# Must be set before the app is imported: the master itself must not start warming clients
+os.environ['SERVICES_WARMUP'] = '0'
+WORKER_WARMUP = os.environ.get('WORKER_WARMUP', '1') == '1'
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+preload_app = True
+
+
+def when_ready(server):
+    import app
+    app.preload_shared()
+
+
+def post_fork(server, worker):
+    import app
+    app.post_fork(app.app, warmup=WORKER_WARMUP)
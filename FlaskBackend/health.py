@@ -0,0 +1,141 @@
+"""
+Background health prober for the upstream services.
+
+A daemon thread makes a cheap real call to every built client (list one
+locale's voices, count tokens, tokenize a sentence, ...) every `interval`
+seconds and caches the outcome with its timestamp and latency. Health
+endpoints only read that cache, so they answer in constant time and never
+call, build or wait on anything upstream.
+
+Services that have not been built yet are reported with their registry state
+instead of being probed: probing never triggers a client's initialization.
+"""
+
+import datetime
+import logging
+import threading
+import time
+
+from process_hooks import after_fork_in_child
+from services import UNINITIALIZED, INITIALIZING, READY, FAILED
+
+logger = logging.getLogger(__name__)
+
+AVAILABLE = 'available'
+UNAVAILABLE = 'unavailable'
+
+
+def _utc_now():
+    return datetime.datetime.utcnow().isoformat() + 'Z'
+
+
+class HealthProber:
+    def __init__(self, registry, probes, interval=30.0, pending_interval=1.0, stale_after=None):
+        """
+        `probes` maps a registered service name to a callable taking its client;
+        None means there is no cheap call for it and a built client counts as up.
+        While any service is still being built the cache is refreshed every
+        `pending_interval` seconds so it picks up warmup promptly.
+        """
+        self.registry = registry
+        self.probes = probes
+        self.interval = interval
+        self.pending_interval = pending_interval
+        self.stale_after = stale_after if stale_after is not None else 3 * interval
+        self._reset()
+        # The parent's thread does not survive fork(); a child probes its own clients
+        after_fork_in_child(self._reset)
+
+    def _reset(self):
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._wake = threading.Event()
+        self._stopping = False
+        self._cycles = 0
+        self._last_cycle = None
+        self._results = {
+            name: {'state': UNINITIALIZED, 'checked_at': None, 'latency_ms': None, 'error': None}
+            for name in self.probes
+        }
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='health-prober', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        thread.join(timeout)
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def refresh(self):
+        """Ask the prober thread to run a cycle now instead of at its next tick."""
+        self._wake.set()
+
+    def probe_all(self):
+        """Run one probe cycle in the calling thread. Returns True while anything is still being built."""
+        pending = False
+        for name in self.probes:
+            result = self._probe(name)
+            pending = pending or result['state'] in (UNINITIALIZED, INITIALIZING)
+            # Each entry is replaced whole, so readers never see a half-updated result
+            self._results[name] = result
+        self._cycles += 1
+        self._last_cycle = time.time()
+        return pending
+
+    def _probe(self, name):
+        state = self.registry.state(name)
+        if state == FAILED:
+            error = self.registry.status()[name]['error']
+            return {'state': UNAVAILABLE, 'checked_at': _utc_now(), 'latency_ms': None, 'error': error}
+        if state != READY:
+            return {'state': state, 'checked_at': _utc_now(), 'latency_ms': None, 'error': None}
+
+        probe = self.probes[name]
+        start = time.perf_counter()
+        try:
+            if probe is not None:
+                probe(self.registry.get(name))
+            result_state, error = AVAILABLE, None
+        except Exception as e:
+            result_state, error = UNAVAILABLE, str(e)
+            logger.warning(f"Health probe for {name} failed: {error}")
+        latency_ms = (time.perf_counter() - start) * 1000
+        return {'state': result_state, 'checked_at': _utc_now(), 'latency_ms': round(latency_ms, 1), 'error': error}
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                pending = self.probe_all()
+            except Exception as e:
+                pending = False
+                logger.error(f"Health probe cycle failed: {str(e)}")
+            self._wake.wait(self.pending_interval if pending else self.interval)
+            self._wake.clear()
+
+    def results(self):
+        """The cached probe results. Never calls upstream."""
+        return dict(self._results)
+
+    def stale(self):
+        """True when the cache has not been refreshed recently (e.g. a probe is hanging)."""
+        return self._last_cycle is None or time.time() - self._last_cycle > self.stale_after
+
+    def stats(self):
+        return {
+            'running': self.running(),
+            'cycles': self._cycles,
+            'interval_seconds': self.interval,
+            'last_cycle_age_seconds': round(time.time() - self._last_cycle, 1) if self._last_cycle else None,
+            'stale': self.stale()
+        }
@@ -0,0 +1,178 @@
+"""
+Write-behind queue for user history.
+
+Request handlers call `enqueue()`, which only timestamps the entry and puts it
+on an in-memory queue. A single flusher thread drains the queue and commits
+entries to the user store in batches, either every `flush_interval_ms` or as
+soon as `max_batch` entries are waiting, whichever comes first.
+
+With `retention_days` set, the same thread also prunes raw history older than
+the window (roughly every `prune_interval` seconds); the store's usage
+aggregates keep the totals exact.
+"""
+
+import datetime
+import logging
+import queue
+import threading
+import time
+
+from process_hooks import after_fork_in_child, at_exit
+from user_store import TIMESTAMP_FORMAT, utc_timestamp
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class HistoryWriter:
+    def __init__(self, store, flush_interval_ms=50, max_batch=200, retention_days=None, prune_interval=3600):
+        self.store = store
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_batch = max_batch
+        self.retention_days = retention_days
+        self.prune_interval = prune_interval
+        self._next_prune = 0.0
+        self._atexit_registered = False
+        self._reset()
+        # A forked child gets its own queue and thread; the parent flushes its own entries
+        after_fork_in_child(self._reset)
+
+    def _reset(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._entries_written = 0
+        self._entries_failed = 0
+        self._batches = 0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+        self._entries_pruned = 0
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                at_exit(self.close)
+                self._atexit_registered = True
+
+    def enqueue(self, username, feature, details):
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        self._queue.put((username, utc_timestamp(), feature, details))
+
+    def flush(self, timeout=5.0):
+        """Block until everything enqueued so far has been committed."""
+        if self._thread is None or not self._thread.is_alive():
+            return self._queue.empty()
+        marker = threading.Event()
+        self._queue.put(marker)
+        return marker.wait(timeout)
+
+    def close(self, timeout=10.0):
+        """Flush pending entries and stop the flusher thread."""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.warning(f"History writer did not stop within {timeout}s; {self._queue.qsize()} entries pending")
+        else:
+            logger.info("History writer flushed and stopped")
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'entries_written': self._entries_written,
+                'entries_failed': self._entries_failed,
+                'batches': self._batches,
+                'last_flush_ms': round(self._last_flush_ms, 3),
+                'max_flush_ms': round(self._max_flush_ms, 3),
+                'avg_flush_ms': round(self._total_flush_ms / self._batches, 3) if self._batches else 0.0,
+                'entries_pruned': self._entries_pruned
+            }
+
+    def _run(self):
+        while True:
+            self._maybe_prune()
+            try:
+                item = self._queue.get(timeout=self.prune_interval if self.retention_days else None)
+            except queue.Empty:
+                continue
+            batch, markers, stop = [], [], False
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    markers.append(item)
+                else:
+                    batch.append(item)
+                # A flush request or shutdown commits immediately
+                if stop or markers or len(batch) >= self.max_batch:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if stop:
+                # Drain whatever arrived before the stop sentinel was processed
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if isinstance(item, threading.Event):
+                        markers.append(item)
+                    elif item is not _STOP:
+                        batch.append(item)
+
+            if batch:
+                self._write(batch)
+            for marker in markers:
+                marker.set()
+            if stop:
+                return
+
+    def _maybe_prune(self):
+        if not self.retention_days or time.monotonic() < self._next_prune:
+            return
+        self._next_prune = time.monotonic() + self.prune_interval
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=self.retention_days)
+        try:
+            removed = self.store.prune_history(cutoff.strftime(TIMESTAMP_FORMAT))
+        except Exception as e:
+            logger.error(f"Failed to prune history older than {self.retention_days} days: {e}")
+            return
+        with self._stats_lock:
+            self._entries_pruned += removed
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        try:
+            written = self.store.add_history_batch(batch)
+        except Exception as e:
+            logger.error(f"Failed to write {len(batch)} history entries: {e}")
+            with self._stats_lock:
+                self._entries_failed += len(batch)
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if written < len(batch):
+            logger.warning(f"Skipped {len(batch) - written} history entries for non-existent users.")
+        with self._stats_lock:
+            self._entries_written += written
+            self._batches += 1
+            self._last_flush_ms = elapsed_ms
+            self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+            self._total_flush_ms += elapsed_ms
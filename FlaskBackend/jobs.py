@@ -0,0 +1,313 @@
+"""
+Background jobs for operations too long to run on a request thread.
+
+A request submits a job (a kind and JSON params) and gets its id back at once;
+the client then polls the job or follows its progress as server-sent events.
+Jobs live in a SQLite table (WAL, shared by every gunicorn worker like the
+user store), so a queued job survives a restart and any worker's pool may
+run it.
+
+Each process runs `workers` threads that claim queued jobs in submission
+order, skipping users who already have `per_user` jobs running. A running job
+holds a lease that a heartbeat thread extends while it runs; if its process
+dies, the lease runs out and the job is queued again, up to `max_attempts`
+runs in all. A user may have at most `max_pending` jobs queued or running.
+Finished jobs are deleted after `retention_seconds`.
+
+Handlers are called as handler(params, progress) and return the job's
+JSON-serializable result; progress(fraction, message=None) records how far
+they are.
+"""
+
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from process_hooks import after_fork_in_child
+from user_store import BUSY_TIMEOUT_SECONDS, _retry_busy
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+FINISHED = (SUCCEEDED, FAILED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    state TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs(username, state, created_at);
+"""
+
+# Deleting old finished jobs is attempted at most this often per process
+PURGE_INTERVAL = 60
+
+
+class JobLimitError(Exception):
+    """The user already has as many jobs pending as allowed."""
+
+
+def _iso(epoch):
+    return datetime.datetime.utcfromtimestamp(epoch).isoformat() + 'Z' if epoch else None
+
+
+def job_view(row):
+    """A job as the API returns it."""
+    return {
+        'id': row['id'],
+        'kind': row['kind'],
+        'state': row['state'],
+        'progress': row['progress'],
+        'message': row['message'],
+        'result': json.loads(row['result']) if row['result'] else None,
+        'error': row['error'],
+        'attempts': row['attempts'],
+        'created_at': _iso(row['created_at']),
+        'updated_at': _iso(row['updated_at']),
+        'finished_at': _iso(row['finished_at'])
+    }
+
+
+class JobQueue:
+    def __init__(self, db_path, handlers, workers=2, per_user=1, max_pending=10, lease_seconds=60,
+                 max_attempts=3, retention_seconds=24 * 3600, poll_interval=0.5):
+        self.db_path = db_path
+        self.handlers = handlers
+        self.workers = workers
+        self.per_user = per_user
+        self.max_pending = max_pending
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        with self._transaction() as conn:
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    conn.execute(statement)
+        self._reset()
+        # Worker threads do not survive fork(); post_fork() starts the child's
+        after_fork_in_child(self._reset)
+
+    def _reset(self):
+        self._start_lock = threading.Lock()
+        self._threads = []
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._running = {}  # id -> attempt of the jobs this process is running
+        self._running_lock = threading.Lock()
+        self._next_purge = 0.0
+        self._completed = 0
+        self._failed = 0
+
+    def _connect(self):
+        # Per thread and per process, as in UserStore
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            _retry_busy(lambda: conn.execute('PRAGMA journal_mode=WAL'))
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        _retry_busy(lambda: conn.execute('BEGIN IMMEDIATE'))
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+
+    # --- Submitting and reading ---
+
+    def submit(self, username, kind, params):
+        """Queue a job and return its id. Raises JobLimitError if the user has max_pending jobs already."""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self._transaction() as conn:
+            pending = conn.execute(
+                'SELECT COUNT(*) FROM jobs WHERE username = ? AND state IN (?, ?)', (username, QUEUED, RUNNING)
+            ).fetchone()[0]
+            if pending >= self.max_pending:
+                raise JobLimitError(f"At most {self.max_pending} jobs may be queued or running at once")
+            conn.execute(
+                'INSERT INTO jobs (id, username, kind, params, state, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (job_id, username, kind, json.dumps(params), QUEUED, now, now)
+            )
+        self.start()
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id, username):
+        """The user's job with this id, or None."""
+        row = self._connect().execute(
+            'SELECT * FROM jobs WHERE id = ? AND username = ?', (job_id, username)
+        ).fetchone()
+        return job_view(row) if row else None
+
+    def recent(self, username, limit=20):
+        """The user's most recent jobs, newest first, without their results."""
+        rows = self._connect().execute(
+            'SELECT * FROM jobs WHERE username = ? ORDER BY created_at DESC LIMIT ?', (username, limit)
+        ).fetchall()
+        return [{**job_view(row), 'result': None} for row in rows]
+
+    # --- Running ---
+
+    def start(self):
+        with self._start_lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            if self._threads:
+                return
+            self._stopping.clear()
+            for index in range(self.workers):
+                self._threads.append(threading.Thread(target=self._work, name=f'job-worker-{index}', daemon=True))
+            self._threads.append(threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True))
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stopping.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                job = self.claim()
+            except Exception as e:
+                logger.error(f"Failed to claim a job: {str(e)}")
+                job = None
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            self._run(job)
+
+    def claim(self):
+        """Mark the oldest job that may run now as running in this process, and return its row."""
+        now = time.time()
+        with self._transaction() as conn:
+            # Jobs whose process died: run again, or give up after max_attempts
+            conn.execute(
+                'UPDATE jobs SET state = ?, lease_until = NULL, updated_at = ? '
+                'WHERE state = ? AND lease_until < ? AND attempts < ?',
+                (QUEUED, now, RUNNING, now, self.max_attempts)
+            )
+            conn.execute(
+                'UPDATE jobs SET state = ?, error = ?, lease_until = NULL, updated_at = ?, finished_at = ? '
+                'WHERE state = ? AND lease_until < ?',
+                (FAILED, 'The job was interrupted too many times', now, now, RUNNING, now)
+            )
+            if now >= self._next_purge:
+                self._next_purge = now + PURGE_INTERVAL
+                conn.execute('DELETE FROM jobs WHERE state IN (?, ?) AND finished_at < ?',
+                             (*FINISHED, now - self.retention_seconds))
+            row = conn.execute(
+                'SELECT * FROM jobs AS queued WHERE state = ? AND '
+                '(SELECT COUNT(*) FROM jobs WHERE username = queued.username AND state = ?) < ? '
+                'ORDER BY created_at LIMIT 1',
+                (QUEUED, RUNNING, self.per_user)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                'UPDATE jobs SET state = ?, attempts = attempts + 1, lease_until = ?, updated_at = ? WHERE id = ?',
+                (RUNNING, now + self.lease_seconds, now, row['id'])
+            )
+        with self._running_lock:
+            self._running[row['id']] = row['attempts'] + 1
+        return row
+
+    def _run(self, job):
+        job_id, attempt = job['id'], job['attempts'] + 1
+        logger.info(f"Running {job['kind']} job {job_id} (attempt {attempt})")
+        start = time.perf_counter()
+
+        def progress(fraction, message=None):
+            self._update(job_id, attempt, 'progress = ?, message = ?', (max(0.0, min(1.0, fraction)), message))
+
+        try:
+            result = self.handlers[job['kind']](json.loads(job['params']), progress)
+            self._update(job_id, attempt, 'state = ?, progress = 1, result = ?, lease_until = NULL, finished_at = ?',
+                         (SUCCEEDED, json.dumps(result), time.time()))
+            with self._running_lock:
+                self._completed += 1
+            logger.info(f"Job {job_id} succeeded in {time.perf_counter() - start:.1f}s")
+        except Exception as e:
+            self._update(job_id, attempt, 'state = ?, error = ?, lease_until = NULL, finished_at = ?',
+                         (FAILED, str(e), time.time()))
+            with self._running_lock:
+                self._failed += 1
+            logger.error(f"Job {job_id} failed: {str(e)}", exc_info=True)
+        finally:
+            with self._running_lock:
+                self._running.pop(job_id, None)
+
+    def _update(self, job_id, attempt, assignments, params):
+        # Only while this run still holds the job: once requeued, it belongs to the next run
+        with self._transaction() as conn:
+            conn.execute(f'UPDATE jobs SET {assignments}, updated_at = ? WHERE id = ? AND state = ? AND attempts = ?',
+                         (*params, time.time(), job_id, RUNNING, attempt))
+
+    def _heartbeat(self):
+        while not self._stopping.wait(self.lease_seconds / 3):
+            with self._running_lock:
+                running = list(self._running.items())
+            if not running:
+                continue
+            try:
+                with self._transaction() as conn:
+                    conn.executemany(
+                        'UPDATE jobs SET lease_until = ? WHERE id = ? AND state = ? AND attempts = ?',
+                        [(time.time() + self.lease_seconds, job_id, RUNNING, attempt) for job_id, attempt in running]
+                    )
+            except Exception as e:
+                logger.error(f"Failed to extend job leases: {str(e)}")
+
+    def stats(self):
+        counts = dict(self._connect().execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+        with self._running_lock:
+            running_here, completed, failed = len(self._running), self._completed, self._failed
+        return {
+            'workers': self.workers if self.running() else 0,
+            'running_here': running_here,
+            'completed_here': completed,
+            'failed_here': failed,
+            'jobs': {state: counts.get(state, 0) for state in (QUEUED, RUNNING, SUCCEEDED, FAILED)}
+        }
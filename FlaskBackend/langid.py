@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""
+Character-trigram naive Bayes language identification.
+
+Each word is padded with spaces and split into character trigrams
+(" ho", "hol", "ola", "la "), which are hashed into BUCKETS buckets. The
+model is a single float32 array of shape (BUCKETS, len(LANGUAGES)) holding
+log P(bucket | language), Laplace-smoothed. A word's score for a language is
+the sum of its trigrams' rows, so scoring a whole sentence is one gather and
+one segmented sum over a (trigrams x languages) matrix. `smooth()` then runs
+Viterbi over those scores, divided by each word's trigram count, with a
+per-switch penalty, so that one odd word does not split a sentence into
+extra TTS requests.
+
+The array is trained from the plain-text samples in langid_corpus/ and
+saved as an .npy file, which `LanguageModel.load()` memory-maps: workers
+forked from one master share its pages. Rebuild it after editing the corpus:
+
+    python langid.py build
+    python langid.py check        # exit 1 if the .npy is stale
+
+The shipped corpus is a few hundred words per language, so until the model
+is shown to beat the lexicons on a broad held-out set the app only uses it
+with LANGID_MODEL_ENABLED=1. `--corpus DIR` trains on a larger one (<code>.txt
+per language); bench_language_segmentation.py compares both paths on
+held-out text.
+"""
+
+import argparse
+import logging
+import os
+import re
+import sys
+
+logger = logging.getLogger(__name__)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CORPUS_DIR = os.path.join(HERE, 'langid_corpus')
+MODEL_PATH = os.environ.get('LANGID_MODEL_PATH', os.path.join(HERE, 'langid_model.npy'))
+
+# Column order of the model array; corpus files are named <code>.txt
+LANGUAGES = ('en', 'fr', 'es', 'de', 'it', 'pt')
+BUCKET_BITS = 13
+BUCKETS = 1 << BUCKET_BITS
+SMOOTHING = 0.5
+# Default cost of a language switch, in nats per trigram (see smooth())
+SWITCH_PENALTY = 1.5
+
+# Letters and in-word apostrophes are features; digits and punctuation are not
+NON_LETTER = re.compile(r"[^\w']|[\d_]")
+_FIB_MULTIPLIER = 0x9E3779B97F4A7C15
+_PRIME = 1000003
+
+
+def clean_word(word):
+    return NON_LETTER.sub('', word.lower()).strip("'")
+
+
+def trigram_buckets(words):
+    """
+    Bucket ids of every word's trigrams, concatenated, and the index where each
+    word's run starts. `words` must be cleaned and non-empty.
+    """
+    import numpy as np
+    joined = ' ' + ' '.join(words) + ' '
+    codes = np.frombuffer(joined.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    hashes = (codes[:-2] * np.uint64(_PRIME) + codes[1:-1]) * np.uint64(_PRIME) + codes[2:]
+    # A space in the middle means the trigram straddles two words: drop it.
+    # What is left is exactly len(word) trigrams per word, in word order.
+    hashes = hashes[codes[1:-1] != ord(' ')]
+    buckets = (hashes * np.uint64(_FIB_MULTIPLIER)) >> np.uint64(64 - BUCKET_BITS)
+    lengths = np.fromiter((len(word) for word in words), dtype=np.intp, count=len(words))
+    starts = np.zeros(len(words), dtype=np.intp)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    return buckets.astype(np.intp), starts
+
+
+class LanguageModel:
+    def __init__(self, table, languages=LANGUAGES):
+        if table.shape != (BUCKETS, len(languages)):
+            raise ValueError(f"Model shape {table.shape} does not match {BUCKETS} buckets x {len(languages)} languages")
+        self.table = table
+        self.languages = languages
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        import numpy as np
+        return cls(np.load(path, mmap_mode='r'))
+
+    def word_scores(self, words, per_trigram=False):
+        """
+        Log-likelihood of each word under each language, shape (len(words), languages),
+        and a mask of the words that had any letters (other rows are zero). With
+        per_trigram, each word's row is divided by its number of trigrams.
+        """
+        import numpy as np
+        cleaned = [clean_word(word) for word in words]
+        has_letters = np.fromiter((bool(word) for word in cleaned), dtype=bool, count=len(cleaned))
+        scores = np.zeros((len(cleaned), len(self.languages)), dtype=np.float32)
+        if has_letters.any():
+            buckets, starts = trigram_buckets([word for word in cleaned if word])
+            scores[has_letters] = np.add.reduceat(self.table[buckets], starts, axis=0)
+            if per_trigram:
+                # A word of n letters has n trigrams
+                lengths = np.fromiter((len(word) for word in cleaned if word), dtype=np.float32)
+                scores[has_letters] /= lengths[:, None]
+        return scores, has_letters
+
+    def classify(self, words, switch_penalty=0.0):
+        """
+        Language code per word; None for words without letters. With a
+        switch_penalty the labels are Viterbi-smoothed (see smooth()).
+        """
+        return self.label_paths(words, switch_penalty)[1]
+
+    def label_paths(self, words, switch_penalty=0.0):
+        """(per-word argmax labels, smoothed labels); the same list when switch_penalty is 0."""
+        # Per-trigram scores pick the same argmax, and the penalty then weighs every
+        # word alike instead of letting long words outvote their neighbours
+        scores, has_letters = self.word_scores(words, per_trigram=True)
+        raw = self._labels(scores.argmax(axis=1).tolist(), has_letters)
+        if switch_penalty <= 0 or len(words) < 2:
+            return raw, raw
+        return raw, self._labels(smooth(scores, switch_penalty), has_letters)
+
+    def _labels(self, best, has_letters):
+        return [self.languages[index] if known else None for index, known in zip(best, has_letters)]
+
+
+def smooth(scores, switch_penalty):
+    """
+    Most likely language sequence for (words x languages) log-likelihoods under an
+    HMM whose only transition cost is switch_penalty for changing language
+    between adjacent words. A word has to out-score its neighbours' language
+    by more than the penalty to start a segment of its own, so lone
+    misdetections ("la", "a" in an English sentence) merge into their surroundings.
+
+    LanguageModel passes per-trigram scores, so the penalty is in nats per
+    trigram: with raw sums, a long word's gap grows with its length and
+    "exercises" or "Temperatures" cleared any fixed penalty by itself. A
+    one-word switch ("Hello bonjour") is usually absorbed as well; runs of a
+    few words that clearly score as another language still split.
+    """
+    # Plain floats: with only a handful of states, per-word numpy calls cost more than the math
+    rows = scores.tolist()
+    best = rows[0]
+    backpointers = []
+    for row in rows[1:]:
+        # Staying costs nothing, so each state's best predecessor is either
+        # itself or the overall best state minus the penalty: O(states) per word
+        top = max(best)
+        leader = best.index(top)
+        switched = top - switch_penalty
+        backpointers.append([state if score >= switched else leader for state, score in enumerate(best)])
+        best = [(score if score >= switched else switched) + emission for score, emission in zip(best, row)]
+    state = best.index(max(best))
+    path = [state]
+    for pointers in reversed(backpointers):
+        state = pointers[state]
+        path.append(state)
+    path.reverse()
+    return path
+
+
+def read_corpus(corpus_dir=CORPUS_DIR):
+    corpus = {}
+    for lang in LANGUAGES:
+        with open(os.path.join(corpus_dir, f'{lang}.txt'), encoding='utf-8') as f:
+            corpus[lang] = [word for word in map(clean_word, f.read().split()) if word]
+    return corpus
+
+
+def train(corpus):
+    import numpy as np
+    table = np.empty((BUCKETS, len(LANGUAGES)), dtype=np.float32)
+    for column, lang in enumerate(LANGUAGES):
+        buckets, _ = trigram_buckets(corpus[lang])
+        counts = np.bincount(buckets, minlength=BUCKETS).astype(np.float64)
+        table[:, column] = np.log((counts + SMOOTHING) / (counts.sum() + SMOOTHING * BUCKETS))
+    return table
+
+
+def build(corpus_dir=CORPUS_DIR, path=MODEL_PATH):
+    import numpy as np
+    table = train(read_corpus(corpus_dir))
+    np.save(path, table)
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['build', 'check'])
+    parser.add_argument('--corpus', default=CORPUS_DIR)
+    parser.add_argument('--model', default=MODEL_PATH)
+    args = parser.parse_args()
+
+    import numpy as np
+    if args.command == 'build':
+        table = build(args.corpus, args.model)
+        print(f"Wrote {args.model}: {table.shape[0]} buckets x {table.shape[1]} languages ({table.nbytes // 1024} KiB)")
+        return
+    expected = train(read_corpus(args.corpus))
+    if not os.path.exists(args.model) or not np.allclose(np.load(args.model), expected):
+        print(f"{args.model} is missing or out of date; run 'python langid.py build'")
+        sys.exit(1)
+    print(f"{args.model} is up to date")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Language segmentation for multi-language text-to-speech.
+
+`segment_languages(text)` walks the text once and returns `(lang, start, end)`
+spans: runs of consecutive words detected as the same language, with `start`
+and `end` indexing into the original text (so `text[start:end]` keeps its
+original spacing and punctuation).
+
+Given a `langid.LanguageModel` (character-trigram naive Bayes over six
+languages), every word is scored in one vectorized call. Without one, words
+are classified the way the old per-word `detect_language_for_word` did: a
+lexicon hit first (French, then Spanish, then German), then accented
+characters (same precedence), otherwise English. The lexicons are built once
+at import, and the accent check is a single precompiled character class.
+"""
+
+import re
+
+DEFAULT_LANGUAGE = 'en'
+
+FRENCH_WORDS = frozenset({
+    'bonjour', 'merci', 'oui', 'non', 'le', 'la', 'les', 'et', 'je', 'tu', 'il', 'elle', 'nous', 'vous',
+    'ils', 'elles', 'un', 'une', 'des', 'du', 'de', 'à', 'au', 'aux', 'avec', 'pour', 'dans', 'sur',
+    'sous', 'sans', 'qui', 'que', 'quoi', 'comment', 'pourquoi', 'où'
+})
+SPANISH_WORDS = frozenset({
+    'hola', 'gracias', 'sí', 'no', 'el', 'la', 'los', 'las', 'y', 'yo', 'tú', 'él', 'ella', 'nosotros',
+    'vosotros', 'ellos', 'ellas', 'un', 'una', 'unos', 'unas', 'del', 'al', 'a', 'con', 'para', 'en',
+    'sobre', 'bajo', 'sin', 'quien', 'que', 'como', 'porque', 'donde'
+})
+GERMAN_WORDS = frozenset({
+    'hallo', 'danke', 'ja', 'nein', 'der', 'die', 'das', 'und', 'ich', 'du', 'er', 'sie', 'es', 'wir',
+    'ihr', 'ein', 'eine', 'einen', 'einem', 'einer', 'eines', 'mit', 'für', 'in', 'auf', 'unter',
+    'ohne', 'wer', 'was', 'wie', 'warum', 'wo'
+})
+
+# (language, lexicon, characters that suggest it), in precedence order
+LANGUAGES = (
+    ('fr', FRENCH_WORDS, 'éèêëàâäæçîïôœùûüÿ'),
+    ('es', SPANISH_WORDS, 'áéíóúüñ¿¡'),
+    ('de', GERMAN_WORDS, 'äöüß'),
+)
+
+# Word -> language, earlier languages winning words that appear in several lexicons
+WORD_LANGUAGE = {}
+# Accented character -> precedence rank of the first language using it
+CHAR_RANK = {}
+for rank, (lang, words, chars) in enumerate(LANGUAGES):
+    for word in words:
+        WORD_LANGUAGE.setdefault(word, lang)
+    for char in chars:
+        CHAR_RANK.setdefault(char, rank)
+del rank, lang, words, chars, word, char
+
+WORD_PATTERN = re.compile(r'\S+')
+ACCENT_PATTERN = re.compile('[' + ''.join(sorted(CHAR_RANK)) + ']')
+TRAILING_PUNCTUATION = '.,:;!?'
+
+
+def detect_word(word):
+    """Language code for a single word."""
+    cleaned = word.lower().rstrip(TRAILING_PUNCTUATION)
+    lang = WORD_LANGUAGE.get(cleaned)
+    if lang is not None:
+        return lang
+    accents = ACCENT_PATTERN.findall(cleaned)
+    if accents:
+        return LANGUAGES[min(CHAR_RANK[char] for char in accents)][0]
+    return DEFAULT_LANGUAGE
+
+
+def segment_languages(text, model=None, switch_penalty=0.0, stats=None):
+    """
+    Split text into [(lang, start, end)] runs of same-language words.
+    With a langid.LanguageModel all words are scored in one vectorized call,
+    and a positive switch_penalty Viterbi-smooths the labels (langid.smooth())
+    so isolated misdetections do not start segments of their own. Without a
+    model, words are classified with the lexicons above.
+
+    If `stats` is a dict, it receives the number of segments before and after
+    smoothing ('segments_unsmoothed', 'segments').
+    """
+    if model is None:
+        spans = _segment_with_lexicons(text)
+        unsmoothed = len(spans)
+    else:
+        matches = list(WORD_PATTERN.finditer(text))
+        if not matches:
+            spans, unsmoothed = [], 0
+        else:
+            raw, smoothed = model.label_paths([match.group() for match in matches], switch_penalty)
+            spans = _merge_runs(matches, smoothed)
+            unsmoothed = len(spans) if smoothed is raw else _count_runs(raw)
+    if stats is not None:
+        stats['segments_unsmoothed'] = unsmoothed
+        stats['segments'] = len(spans)
+    return spans
+
+
+def _count_runs(langs):
+    runs, current_lang = 0, None
+    for lang in langs:
+        if lang is not None and lang != current_lang:
+            runs += 1
+            current_lang = lang
+    return max(runs, 1)
+
+
+def _merge_runs(matches, langs):
+    spans = []
+    current_lang = None
+    start = end = None
+    for match, lang in zip(matches, langs):
+        if start is None:
+            start = match.start()
+        # Words without letters (a lone dash, a number) join the run they are in
+        if lang is not None and lang != current_lang:
+            if current_lang is not None:
+                spans.append((current_lang, start, end))
+                start = match.start()
+            current_lang = lang
+        end = match.end()
+    spans.append((current_lang or DEFAULT_LANGUAGE, start, end))
+    return spans
+
+
+def _segment_with_lexicons(text):
+    spans = []
+    current_lang = None
+    start = end = 0
+    word_language = WORD_LANGUAGE
+    for match in WORD_PATTERN.finditer(text):
+        word = match.group()
+        # Inlined detect_word(): this loop runs once per word of every TTS request
+        cleaned = word.lower().rstrip(TRAILING_PUNCTUATION)
+        lang = word_language.get(cleaned)
+        if lang is None:
+            accents = ACCENT_PATTERN.findall(cleaned)
+            lang = LANGUAGES[min(CHAR_RANK[char] for char in accents)][0] if accents else DEFAULT_LANGUAGE
+        if lang != current_lang:
+            if current_lang is not None:
+                spans.append((current_lang, start, end))
+            current_lang = lang
+            start = match.start()
+        end = match.end()
+    if current_lang is not None:
+        spans.append((current_lang, start, end))
+    return spans
+
+
+def segment_texts(text, model=None, switch_penalty=0.0, stats=None):
+    """segment_languages() with each span's text: [(lang, segment_text)]."""
+    return [(lang, text[start:end]) for lang, start, end in segment_languages(text, model, switch_penalty, stats)]
+
+
+def segment_sentences(sentences, model=None, switch_penalty=0.0, stats=None):
+    """
+    segment_texts() of each sentence separately, so a sentence segments the same
+    way whatever surrounds it; `stats` gets the segment counts summed over all.
+    """
+    groups = []
+    totals = {'segments_unsmoothed': 0, 'segments': 0}
+    for sentence in sentences:
+        sentence_stats = {}
+        groups.append(segment_texts(sentence, model, switch_penalty, sentence_stats))
+        for name in totals:
+            totals[name] += sentence_stats[name]
+    if stats is not None:
+        stats.update(totals)
+    return groups
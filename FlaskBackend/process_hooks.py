@@ -0,0 +1,33 @@
+"""
+At-fork and at-exit hooks that do not keep their object alive.
+
+os.register_at_fork() and atexit.register() can never be undone, so a
+component registering a bound method would live (and be reset or closed) as
+long as the process does, however many times create_app() replaces it. These
+register a weak reference instead: once the object is gone, its hook does
+nothing.
+"""
+
+import atexit
+import os
+import weakref
+
+
+def _weak_call(method):
+    ref = weakref.WeakMethod(method)
+
+    def call():
+        method = ref()
+        if method is not None:
+            method()
+    return call
+
+
+def after_fork_in_child(method):
+    """os.register_at_fork(after_in_child=method), holding method's object weakly."""
+    os.register_at_fork(after_in_child=_weak_call(method))
+
+
+def at_exit(method):
+    """atexit.register(method), holding method's object weakly."""
+    atexit.register(_weak_call(method))
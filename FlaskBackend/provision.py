@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Build-time provisioning of data files the backend needs at runtime.
+
+Run once while building the image (the only step that needs network access):
+
+    python provision.py nltk                 # into $NLTK_DATA_DIR (default ./nltk_data)
+    python provision.py nltk --dir /opt/nltk_data
+
+At runtime the app only calls `validate_nltk_data()`, which checks that the
+files are on disk and never downloads anything, so worker boot time does not
+depend on the network.
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+NLTK_DATA_DIR = os.environ.get('NLTK_DATA_DIR', os.path.join(HERE, 'nltk_data'))
+
+# NLTK download id -> (category, package) directory inside an nltk_data directory.
+# punkt_tab is what nltk.sent_tokenize() loads on NLTK >= 3.8.2.
+NLTK_RESOURCES = {
+    'punkt_tab': ('tokenizers', 'punkt_tab'),
+}
+
+
+def configure_nltk_path(data_dir=NLTK_DATA_DIR):
+    """Make NLTK look in the provisioned directory first."""
+    import nltk
+    if data_dir not in nltk.data.path:
+        nltk.data.path.insert(0, data_dir)
+
+
+def validate_nltk_data(data_dir=NLTK_DATA_DIR):
+    """
+    Return the download ids of required NLTK resources missing from data_dir.
+    A plain filesystem check: it neither imports NLTK nor touches the network.
+    """
+    missing = []
+    for resource_id, (category, package) in NLTK_RESOURCES.items():
+        path = os.path.join(data_dir, category, package)
+        # nltk.download() leaves both the zip and its extracted directory; either will do
+        if not (os.path.isdir(path) or os.path.isfile(path + '.zip')):
+            missing.append(resource_id)
+    return missing
+
+
+def provision_nltk(data_dir=NLTK_DATA_DIR):
+    import nltk
+    os.makedirs(data_dir, exist_ok=True)
+    for resource_id in NLTK_RESOURCES:
+        logger.info(f"Downloading NLTK {resource_id} into {data_dir}")
+        if not nltk.download(resource_id, download_dir=data_dir, quiet=True):
+            logger.error(f"Failed to download NLTK {resource_id}")
+    return validate_nltk_data(data_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    nltk_parser = subparsers.add_parser('nltk', help='Download required NLTK data')
+    nltk_parser.add_argument('--dir', default=NLTK_DATA_DIR)
+    nltk_parser.add_argument('--check', action='store_true',
+                             help='Only validate the directory; exit 1 if anything is missing')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.command == 'nltk':
+        missing = validate_nltk_data(args.dir) if args.check else provision_nltk(args.dir)
+        if missing:
+            print(f"Missing NLTK resources in {args.dir}: {', '.join(missing)}")
+            sys.exit(1)
+        print(f"NLTK data ready in {args.dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Lazily-initialized upstream clients.
+
+Each client (Google TTS/Speech/Vision, Gemini, LanguageTool, ...) is
+registered with a factory and only built the first time a request needs it.
+An optional warmup thread builds them in the background right after startup,
+so the first request usually finds them ready without startup waiting on them.
+
+Clients holding gRPC channels or child processes are not safe to inherit
+across fork(): unless registered with `fork_safe=True`, a service is reset to
+uninitialized in a forked child and rebuilt there on first use.
+
+A failed build is not final: the next use at least `retry_after` seconds
+later builds it again, so a transient failure (credentials not mounted yet,
+a network blip) does not disable the service until the process restarts.
+"""
+
+import logging
+import threading
+import time
+
+from process_hooks import after_fork_in_child
+
+logger = logging.getLogger(__name__)
+
+UNINITIALIZED = 'uninitialized'
+INITIALIZING = 'initializing'
+READY = 'ready'
+FAILED = 'failed'
+
+# Seconds after a failed build before the next use tries again
+RETRY_SECONDS = 30
+
+
+class LazyService:
+    def __init__(self, name, factory, fork_safe=False, retry_after=RETRY_SECONDS):
+        self.name = name
+        self.factory = factory
+        self.fork_safe = fork_safe
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._instance = None
+        self._state = UNINITIALIZED
+        self._error = None
+        self._failed_at = None
+        self._init_seconds = None
+
+    def _settled(self):
+        # Ready, or failed recently enough that it is not worth building again yet
+        state, failed_at = self._state, self._failed_at
+        return state == READY or (state == FAILED and time.monotonic() - failed_at < self.retry_after)
+
+    def get(self):
+        """
+        The client, building it on first use. None if it failed to initialize;
+        it is built again on the first use `retry_after` seconds after a failure.
+        """
+        if self._settled():
+            return self._instance
+        with self._lock:
+            if self._settled():
+                return self._instance
+            retrying = self._state == FAILED
+            self._state = INITIALIZING
+            start = time.perf_counter()
+            try:
+                self._instance = self.factory()
+                self._state = READY
+                self._error = None
+                logger.info(f"{self.name} initialized successfully" + (" after retrying" if retrying else ""))
+            except Exception as e:
+                self._instance = None
+                self._error = str(e)
+                self._failed_at = time.monotonic()
+                self._state = FAILED
+                logger.error(f"Failed to initialize {self.name} (retrying in {self.retry_after:g}s): {str(e)}")
+            self._init_seconds = time.perf_counter() - start
+        return self._instance
+
+    def after_fork(self):
+        # The parent's lock may have been held by a thread that does not exist here
+        self._lock = threading.Lock()
+        if self.fork_safe and self._state in (READY, FAILED):
+            return
+        self._instance = None
+        self._state = UNINITIALIZED
+        self._error = None
+        self._failed_at = None
+        self._init_seconds = None
+
+    @property
+    def state(self):
+        return self._state
+
+    def status(self):
+        retry_in = None
+        if self._state == FAILED:
+            retry_in = round(max(0.0, self._failed_at + self.retry_after - time.monotonic()), 1)
+        return {
+            'state': self._state,
+            'init_seconds': round(self._init_seconds, 3) if self._init_seconds is not None else None,
+            'error': self._error,
+            'retry_in': retry_in
+        }
+
+
+class ServiceRegistry:
+    def __init__(self, retry_after=RETRY_SECONDS):
+        self.retry_after = retry_after
+        self._services = {}
+        self._warmup_thread = None
+        after_fork_in_child(self._after_fork)
+
+    def register(self, name, factory, fork_safe=False):
+        self._services[name] = LazyService(name, factory, fork_safe=fork_safe, retry_after=self.retry_after)
+
+    def fork_safe(self, name):
+        return self._services[name].fork_safe
+
+    def get(self, name):
+        return self._services[name].get()
+
+    def state(self, name):
+        return self._services[name].state
+
+    def status(self):
+        # Never builds anything: safe to call from health checks
+        return {name: service.status() for name, service in self._services.items()}
+
+    def _after_fork(self):
+        self._warmup_thread = None
+        for service in self._services.values():
+            service.after_fork()
+
+    def warming_up(self):
+        return self._warmup_thread is not None and self._warmup_thread.is_alive()
+
+    def warmup(self, names=None, background=True):
+        """Build the given services (default: all) now, optionally on a daemon thread."""
+        names = list(names or self._services)
+
+        def run():
+            start = time.perf_counter()
+            for name in names:
+                self._services[name].get()
+            logger.info(f"Service warmup finished in {time.perf_counter() - start:.2f}s")
+
+        if not background:
+            run()
+            return
+        self._warmup_thread = threading.Thread(target=run, name='service-warmup', daemon=True)
+        self._warmup_thread.start()
@@ -0,0 +1,71 @@
+"""
+Coalescing of identical in-flight upstream calls ("single flight").
+
+The first caller for a key makes the call; callers that arrive with the same
+key while it is still running wait on the same future and get its result (or
+its exception) instead of making a call of their own. Nothing is kept once
+the call finishes, so this is not a cache, only deduplication of work that is
+already happening.
+
+Coalescing is per process: with several gunicorn workers, each one coalesces
+its own requests, and the TTS disk cache serves the others once the first
+call has completed.
+"""
+
+import logging
+import threading
+from concurrent.futures import Future
+
+from process_hooks import after_fork_in_child
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._reset()
+        # Flights in progress in the parent have no thread to finish them in a child
+        after_fork_in_child(self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._flights_led = 0
+        self._shared = 0
+
+    def do(self, key, fn):
+        """fn(), unless a call for `key` is already in flight, in which case its outcome."""
+        with self._lock:
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = self._flights[key] = Future()
+                self._flights_led += 1
+            else:
+                self._shared += 1
+        if not leader:
+            logger.info(f"Joining in-flight {self.name} call {key[:12]}")
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self._land(key)
+            future.set_exception(e)
+            raise
+        self._land(key)
+        future.set_result(result)
+        return result
+
+    def _land(self, key):
+        with self._lock:
+            del self._flights[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'flights': self._flights_led,
+                'calls_saved': self._shared,
+                'in_flight': len(self._flights)
+            }
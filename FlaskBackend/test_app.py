@@ -0,0 +1,263 @@
+"""
+Tests for the Flask app's endpoints, through Flask's test client with fake
+upstream clients.
+
+Run with: python -m pytest test_app.py
+"""
+
+import base64
+import email.parser
+import io
+import json
+import os
+import tempfile
+import threading
+import zipfile
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def tmp():
+    with tempfile.TemporaryDirectory() as tmp:
+        yield tmp
+
+
+class FakeTTS:
+    """
+    Answers each synthesis with its own text as the audio; text containing
+    'FAIL' raises, and text containing 'WAIT' blocks until `release` is set.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.texts = []
+        self.release = threading.Event()
+
+    def synthesize_speech(self, input, voice, audio_config):
+        text = input.ssml or input.text
+        with self.lock:
+            self.texts.append(text)
+        if 'WAIT' in text:
+            self.release.wait(10)
+        if 'FAIL' in text:
+            raise RuntimeError(f"upstream rejected {text!r}")
+
+        class Response:
+            audio_content = f"<{text}>".encode('utf-8')
+        return Response()
+
+
+@pytest.fixture
+def fake_tts():
+    fake = FakeTTS()
+    app.services.register('tts', lambda: fake)
+    yield fake
+    app.services.register('tts', app.build_tts_client)
+
+
+def make_app(tmp, **config):
+    # Every store in `tmp`; nothing upstream is built unless a test registers a fake
+    return app.create_app({
+        'TESTING': True,
+        'RATELIMIT_ENABLED': False,
+        'SERVICES_WARMUP': False,
+        'USERS_FILE': os.path.join(tmp, 'users.json'),
+        'USERS_DB': os.path.join(tmp, 'users.db'),
+        'JOBS_DB': os.path.join(tmp, 'jobs.db'),
+        'TTS_CACHE_DIR': os.path.join(tmp, 'tts_cache'),
+        'TTS_WARM_SET': '',
+        'VOICE_CATALOG_SNAPSHOT': '',
+        **config
+    })
+
+
+def logged_in(application, username='ana'):
+    client = application.test_client()
+    credentials = {'username': username, 'password': 'pw123456'}
+    client.post('/api/register', json=credentials)
+    assert client.post('/api/login', json=credentials).status_code == 200
+    return client
+
+
+def test_apps_keep_their_own_stores(tmp):
+    for name in ('first', 'second'):
+        os.mkdir(os.path.join(tmp, name))
+    first = make_app(os.path.join(tmp, 'first'))
+    client = logged_in(first)
+    second = make_app(os.path.join(tmp, 'second'))
+
+    assert app.app_state(first) is not app.app_state(second)
+    assert app.app_state(first).user_store.get_user('ana') is not None
+    assert app.app_state(second).user_store.get_user('ana') is None
+    # Building the second app left the first one's stores alone
+    assert client.get('/api/me').get_json()['username'] == 'ana'
+    assert second.test_client().post('/api/login', json={'username': 'ana', 'password': 'pw123456'}).status_code == 401
+
+
+def test_apps_keep_their_own_nltk_data(tmp):
+    provisioned = os.path.join(tmp, 'nltk_ok')
+    os.makedirs(os.path.join(provisioned, 'tokenizers', 'punkt_tab'))
+    missing = make_app(tmp, NLTK_DATA_DIR=os.path.join(tmp, 'nltk_empty'))
+    ready = make_app(tmp, NLTK_DATA_DIR=provisioned)
+
+    assert app.app_state(missing).nltk_missing == ['punkt_tab']
+    assert app.app_state(ready).nltk_missing == []
+    assert missing.test_client().get('/api/health').get_json()['services']['nltk_data'] == 'missing'
+    assert ready.test_client().get('/api/health').get_json()['services']['nltk_data'] == 'available'
+    with missing.app_context():
+        assert app.app_nltk() is None  # Sentences are split on punctuation instead
+
+
+def test_history_pages_and_revalidates(tmp):
+    application = make_app(tmp)
+    client = logged_in(application)
+    writer = app.app_state(application).history_writer
+    for index in range(5):
+        writer.enqueue('ana', 'grammar_check', {'index': index})
+
+    pages, cursor = [], None
+    while True:
+        response = client.get('/api/history', query_string={'limit': 2, **({'cursor': cursor} if cursor else {})})
+        assert response.status_code == 200
+        body = response.get_json()
+        pages.append([entry['details']['index'] for entry in body['history']])
+        cursor = body['next_cursor']
+        if cursor is None:
+            break
+    # Newest first, each entry on exactly one page
+    assert pages == [[4, 3], [2, 1], [0]]
+    assert client.get('/api/history', query_string={'cursor': 'not-a-cursor'}).status_code == 400
+
+    first = client.get('/api/history')
+    etag = first.headers['ETag']
+    assert etag.startswith('W/')
+    again = client.get('/api/history', headers={'If-None-Match': etag})
+    assert (again.status_code, again.data, again.headers['ETag']) == (304, b'', etag)
+
+    # A new entry changes the history revision, so the same ETag no longer matches
+    writer.enqueue('ana', 'grammar_check', {'index': 5})
+    changed = client.get('/api/history', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert changed.get_json()['history'][0]['details']['index'] == 5
+
+
+def test_texttospeech_streams_audio(tmp, fake_tts):
+    client = logged_in(make_app(tmp, TTS_CACHE_ENABLED=False))
+    text = "First sentence here. The second one will FAIL now. Third sentence here."
+
+    response = client.post('/api/texttospeech', json={'text': text}, headers={'Accept': 'audio/mpeg'},
+                           buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'audio/mpeg'
+    assert response.headers['X-TTS-Sentences'] == '3'
+    assert 'Content-Length' not in response.headers  # Chunked: the length is not known up front
+    chunks = list(response.response)
+    response.close()
+    # One chunk per segment as it is produced; the segment that failed after the
+    # first was sent is skipped rather than ending the stream
+    assert chunks == [b'<First sentence here.>', b'<Third sentence here.>']
+    assert len(fake_tts.texts) == 3
+
+    # Without an audio type in Accept, the same audio comes back as base64 JSON
+    body = client.post('/api/texttospeech', json={'text': text}).get_json()
+    assert body['mimetype'] == 'audio/mpeg' and body['sentences'] == 3
+    assert base64.b64decode(body['audio_base64']) == b''.join(chunks)
+
+    # Nothing streams if no segment succeeds
+    failed = client.post('/api/texttospeech', json={'text': 'Only FAIL here.'}, headers={'Accept': 'audio/mpeg'})
+    assert failed.status_code == 500 and 'error' in failed.get_json()
+
+
+def test_tts_batch_packages_clips(tmp, fake_tts):
+    client = logged_in(make_app(tmp, TTS_CACHE_ENABLED=False))
+    voice = 'en-US-Standard-C'
+    items = [
+        {'text': 'Hello there', 'voiceId': voice},
+        {'text': ''},
+        {'text': 'Hello there', 'voiceId': voice},  # Same clip as the first
+        {'text': 'Please FAIL', 'voiceId': voice},
+        {'text': 'Bad voice', 'voiceId': 'nope'}
+    ]
+
+    response = client.post('/api/tts/batch', json={'items': items})
+    assert (response.status_code, response.mimetype, response.headers['X-TTS-Clips']) == (200, 'application/zip', '2')
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert archive.namelist() == ['001.mp3', 'manifest.json']
+    assert archive.read('001.mp3') == b'<Hello there>'
+    manifest = json.loads(archive.read('manifest.json'))['items']
+    assert [entry['file'] for entry in manifest] == ['001.mp3', None, '001.mp3', None, None]
+    assert manifest[1]['error'] == 'Text is required'
+    assert 'upstream rejected' in manifest[3]['error']
+    assert manifest[4]['error'] == 'Invalid voice ID format'
+    # Duplicates are synthesized once
+    assert sorted(fake_tts.texts) == ['Hello there', 'Please FAIL']
+
+    response = client.post('/api/tts/batch', json={'items': items}, headers={'Accept': 'multipart/mixed'})
+    assert response.mimetype == 'multipart/mixed'
+    message = email.parser.BytesParser().parsebytes(
+        f"Content-Type: {response.headers['Content-Type']}\r\n\r\n".encode('ascii') + response.data)
+    parts = message.get_payload()
+    assert [(part.get_content_type(), part.get_filename()) for part in parts] == [
+        ('audio/mpeg', '001.mp3'), ('application/json', 'manifest.json')]
+    assert parts[0].get_payload(decode=True) == b'<Hello there>'
+    assert json.loads(parts[1].get_payload(decode=True))['items'] == manifest
+
+    # At most TTS_BATCH_MAX_ITEMS (100) items
+    assert client.post('/api/tts/batch', json={'items': [items[0]] * 100}).status_code == 200
+    too_many = client.post('/api/tts/batch', json={'items': [items[0]] * 101})
+    assert too_many.status_code == 400 and '100' in too_many.get_json()['error']
+
+    # One history entry per accepted batch, not per item
+    history = client.get('/api/history', query_string={'feature': 'tts_batch'}).get_json()['history']
+    assert [entry['details']['items'] for entry in history] == [100, 5, 5]
+    assert history[-1]['details']['clips'] == 2
+
+
+def parse_events(body):
+    """Server-sent events as dicts of their fields; comments and retry: lines are left out."""
+    events = []
+    for block in body.decode('utf-8').split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if line and not line.startswith(':'))
+        if 'event' in fields:
+            events.append({**fields, 'data': json.loads(fields['data'])})
+    return events
+
+
+def test_jobs_run_and_stream_events(tmp, fake_tts, monkeypatch):
+    application = make_app(tmp, TTS_CACHE_ENABLED=False, JOBS_WORKERS=1)
+    client = logged_in(application)
+    monkeypatch.setattr(app, 'JOB_EVENTS_TIMEOUT', 0.5)
+    monkeypatch.setattr(app, 'JOB_EVENTS_POLL_INTERVAL', 0.02)
+
+    assert client.post('/api/jobs', json={'kind': 'nope'}).status_code == 400
+    response = client.post('/api/jobs', json={'kind': 'texttospeech', 'params': {'text': 'Please WAIT here.'}})
+    assert response.status_code == 202
+    job = response.get_json()
+    assert response.headers['Location'] == f"/api/jobs/{job['id']}"
+    assert [listed['id'] for listed in client.get('/api/jobs').get_json()['jobs']] == [job['id']]
+    assert logged_in(application, 'ben').get(f"/api/jobs/{job['id']}/events").status_code == 404
+
+    # While the job runs, a stream sends its progress and then closes at the time limit
+    first = client.get(f"/api/jobs/{job['id']}/events")
+    assert first.mimetype == 'text/event-stream'
+    assert first.data.startswith(b'retry: ')
+    progress = parse_events(first.data)
+    assert progress and all(event['event'] == 'progress' for event in progress)
+    assert progress[-1]['data']['state'] == 'running'
+    # Reconnecting with the last id seen does not repeat that state
+    again = client.get(f"/api/jobs/{job['id']}/events", headers={'Last-Event-ID': progress[-1]['id']})
+    assert parse_events(again.data) == []
+
+    fake_tts.release.set()
+    final = parse_events(client.get(f"/api/jobs/{job['id']}/events",
+                                    headers={'Last-Event-ID': progress[-1]['id']}).data)
+    while final and final[-1]['event'] == 'progress':  # Finishing may take one more stream
+        final = parse_events(client.get(f"/api/jobs/{job['id']}/events",
+                                        headers={'Last-Event-ID': final[-1]['id']}).data)
+    assert final[-1]['event'] == 'succeeded'
+    result = final[-1]['data']['result']
+    assert base64.b64decode(result['audio_base64']) == b'<Please WAIT here.>'
+    assert client.get(f"/api/jobs/{job['id']}").get_json()['state'] == 'succeeded'
@@ -0,0 +1,86 @@
+"""
+Tests for TTS output format negotiation and stitching.
+
+Run with: python -m pytest test_audio_formats.py
+"""
+
+import io
+import wave
+
+import pytest
+from werkzeug.datastructures import MIMEAccept
+
+import audio_formats
+from audio_formats import BOS, EOS, LINEAR16, MP3, OGG_OPUS
+
+
+def test_negotiate():
+    assert audio_formats.negotiate() == (MP3, None)
+    assert audio_formats.negotiate('Opus', '16000') == (OGG_OPUS, 16000)
+    # "format" wins over Accept; Accept is used without it
+    accept = MIMEAccept([('audio/wav', 1), ('audio/mpeg', 0.5)])
+    assert audio_formats.negotiate('mp3', None, accept) == (MP3, None)
+    assert audio_formats.negotiate(None, None, accept) == (LINEAR16, None)
+    assert audio_formats.negotiate(None, None, MIMEAccept([('*/*', 1)])) == (MP3, None)
+    for format_name, sample_rate in [('flac', None), ('wav', 'fast'), ('wav', 96000), ('ogg', 22050)]:
+        with pytest.raises(ValueError):
+            audio_formats.negotiate(format_name, sample_rate)
+
+
+def wav_file(frames, rate=16000):
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(frames)
+    return buf.getvalue()
+
+
+def test_wav_pieces_become_one_file():
+    pieces = [wav_file(b'\x01\x00' * 100), wav_file(b'\x02\x00' * 50)]
+    with wave.open(io.BytesIO(audio_formats.join(pieces, LINEAR16))) as w:
+        assert (w.getnframes(), w.getframerate()) == (150, 16000)
+        assert w.readframes(150) == b'\x01\x00' * 100 + b'\x02\x00' * 50
+    # Streamed: the size is not known when the header goes out
+    streamed = b''.join(audio_formats.stitch(iter(pieces), LINEAR16))
+    assert streamed[44:] == b'\x01\x00' * 100 + b'\x02\x00' * 50
+    assert audio_formats.join([b'\xff\xfb', b'\xff\xfb'], MP3) == b'\xff\xfb\xff\xfb'
+
+
+def ogg_file(serial, packets):
+    """An Ogg Opus file as upstream returns it: two header pages, then audio pages."""
+    pages = [audio_formats.ogg_page(BOS, 0, serial, 0, [19], b'OpusHead' + bytes(11)),
+             audio_formats.ogg_page(0, 0, serial, 1, [16], b'OpusTags' + bytes(8))]
+    for i in range(packets):
+        header_type = EOS if i == packets - 1 else 0
+        pages.append(audio_formats.ogg_page(header_type, 960 * (i + 1), serial, 2 + i, [3], bytes([serial, i, 0])))
+    return b''.join(pages)
+
+
+def test_ogg_pieces_become_one_stream():
+    assert audio_formats.ogg_crc(b'123456789') == 0x89A1897F
+    data = b''.join(audio_formats.stitch(iter([ogg_file(7, 3), ogg_file(8, 2), ogg_file(9, 1)]), OGG_OPUS))
+    pages = list(audio_formats.ogg_pages(data))
+    assert [body[:8] for _, _, _, _, _, body in pages[:2]] == [b'OpusHead', b'OpusTags']
+    assert len(pages) == 2 + 3 + 2 + 1
+    assert {serial for _, _, serial, _, _, _ in pages} == {7}
+    assert [sequence for _, _, _, sequence, _, _ in pages] == list(range(len(pages)))
+    assert [granule for _, granule, _, _, _, _ in pages[2:]] == [960 * i for i in range(1, 7)]
+    assert [i for i, page in enumerate(pages) if page[0] & BOS] == [0]
+    assert [i for i, page in enumerate(pages) if page[0] & EOS] == [len(pages) - 1]
+    # Every page's checksum was recomputed for its new header
+    offset = 0
+    for _, _, _, _, lacing, body in pages:
+        size = 27 + len(lacing) + len(body)
+        page = bytearray(data[offset:offset + size])
+        crc = int.from_bytes(page[22:26], 'little')
+        page[22:26] = bytes(4)
+        assert audio_formats.ogg_crc(page) == crc
+        offset += size
+
+
+if __name__ == "__main__":
+    test_negotiate()
+    test_wav_pieces_become_one_file()
+    test_ogg_pieces_become_one_stream()
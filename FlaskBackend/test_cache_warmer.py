@@ -0,0 +1,93 @@
+"""
+Tests for TTS cache warming.
+
+Run with: python -m pytest test_cache_warmer.py
+"""
+
+import fcntl
+import os
+import tempfile
+
+import cache_warmer
+from cache_warmer import CacheWarmer, load_warm_set
+
+HERE = os.path.dirname(__file__)
+
+
+class FakeSynthesis:
+    """Each entry costs two upstream calls the first time and none once cached."""
+    def __init__(self, fail=()):
+        self.cached = set()
+        self.fail = set(fail)
+        self.calls = 0
+
+    def warm(self, entry):
+        if entry['text'] in self.fail:
+            raise RuntimeError('upstream unavailable')
+        if entry['text'] in self.cached:
+            return 0
+        self.cached.add(entry['text'])
+        self.calls += 2
+        return 2
+
+
+def entries(count):
+    return [{'endpoint': cache_warmer.TTS_GOOGLE, 'text': f'phrase {i}', 'voice': 'v', 'speed': 1.0}
+            for i in range(count)]
+
+
+def test_warm_set_expands_phrases_voices_and_speeds():
+    shipped = load_warm_set(os.path.join(HERE, 'warm_set.json'))
+    assert len(shipped) == 6
+    assert shipped[0] == {'endpoint': 'texttospeech', 'text': 'The quick brown fox jumps over the lazy dog.'}
+    assert shipped[1]['voice'] == 'en-US-Standard-D' and shipped[1]['speed'] == 1.0
+    assert load_warm_set(os.path.join(HERE, 'no_such_warm_set.json')) == []
+
+
+def test_budget_spreads_warming_over_runs():
+    with tempfile.TemporaryDirectory() as tmp:
+        synthesis = FakeSynthesis()
+        warmer = CacheWarmer(tmp, entries(6), synthesis.warm, budget=5, retry_interval=0)
+        status = warmer.run_once()
+        # Stops at the first entry after the budget is spent
+        assert (status['warm'], status['calls'], status['coverage']) == (3, 6, 0.5)
+        status = warmer.run_once()
+        assert (status['warm'], status['calls'], status['coverage']) == (6, 6, 1.0)
+        # Complete: nothing is due until the interval has passed
+        assert warmer.run_once() is None
+        # A refresh only spends calls on what is missing
+        synthesis.cached.discard('phrase 4')
+        assert warmer.run_once(force=True)['calls'] == 2
+
+
+def test_failures_are_reported_and_retried():
+    with tempfile.TemporaryDirectory() as tmp:
+        synthesis = FakeSynthesis(fail={'phrase 1'})
+        warmer = CacheWarmer(tmp, entries(3), synthesis.warm, retry_interval=3600)
+        status = warmer.run_once()
+        assert (status['warm'], status['failed']) == (2, 1)
+        assert status['last_error'] == "tts_google 'phrase 1': upstream unavailable"
+        assert warmer.run_once() is None  # Retried after retry_interval, not straight away
+
+
+def test_workers_share_runs_and_status():
+    with tempfile.TemporaryDirectory() as tmp:
+        first, second = FakeSynthesis(), FakeSynthesis()
+        worker_a = CacheWarmer(tmp, entries(2), first.warm)
+        worker_b = CacheWarmer(tmp, entries(2), second.warm)
+        # While one worker holds the lock the other skips its run
+        with open(os.path.join(tmp, '.warm.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            assert worker_b.run_once() is None
+        assert worker_a.run_once()['coverage'] == 1.0
+        # ...and does not repeat a run another worker just finished, but reports it
+        assert worker_b.run_once() is None
+        assert second.calls == 0
+        assert worker_b.stats()['last_run']['coverage'] == 1.0
+
+
+if __name__ == "__main__":
+    test_warm_set_expands_phrases_voices_and_speeds()
+    test_budget_spreads_warming_over_runs()
+    test_failures_are_reported_and_retried()
+    test_workers_share_runs_and_status()
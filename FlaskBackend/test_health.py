@@ -0,0 +1,105 @@
+"""
+Tests for the background health prober.
+
+Run with: python -m pytest test_health.py
+"""
+
+import time
+
+import health
+import services
+
+
+class FakeClient:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = 0
+
+    def ping(self):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError('upstream timed out')
+
+
+def make_prober(**kwargs):
+    registry = services.ServiceRegistry()
+    clients = {'up': FakeClient(), 'down': FakeClient(fail=True), 'lazy': FakeClient()}
+    for name, client in clients.items():
+        registry.register(name, lambda client=client: client)
+    registry.register('broken', lambda: 1 / 0)
+    probes = {name: FakeClient.ping for name in clients}
+    probes['broken'] = None
+    return registry, clients, health.HealthProber(registry, probes, **kwargs)
+
+
+def test_probe_cycle_caches_results_without_building_clients():
+    registry, clients, prober = make_prober()
+    registry.warmup(['up', 'down', 'broken'], background=False)
+    assert prober.stale()
+
+    assert prober.probe_all()  # 'lazy' has not been built yet
+    results = prober.results()
+    assert results['up']['state'] == health.AVAILABLE
+    assert results['up']['latency_ms'] is not None and results['up']['checked_at']
+    assert results['down']['state'] == health.UNAVAILABLE
+    assert results['down']['error'] == 'upstream timed out'
+    assert results['broken']['state'] == health.UNAVAILABLE
+    assert results['lazy']['state'] == services.UNINITIALIZED
+    assert registry.state('lazy') == services.UNINITIALIZED
+    assert clients['lazy'].calls == 0
+    assert not prober.stale()
+
+    # Reading the cache never probes
+    calls = clients['up'].calls
+    for _ in range(100):
+        prober.results()
+    assert clients['up'].calls == calls
+
+
+def test_background_thread_refreshes_cache():
+    registry, clients, prober = make_prober(interval=60, pending_interval=0.01)
+    prober.start()
+    try:
+        deadline = time.time() + 5
+        while prober.stats()['cycles'] < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        assert prober.stats()['cycles'] >= 2  # Something is still uninitialized: short interval
+        registry.warmup(background=False)
+        prober.refresh()
+        while prober.results()['lazy']['state'] != health.AVAILABLE and time.time() < deadline:
+            time.sleep(0.01)
+        assert prober.results()['lazy']['state'] == health.AVAILABLE
+    finally:
+        prober.stop()
+    assert not prober.running()
+
+
+def test_failed_service_is_rebuilt_after_backoff():
+    registry = services.ServiceRegistry(retry_after=0.2)
+    attempts = []
+
+    def flaky():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RuntimeError('credentials not mounted yet')
+        return FakeClient()
+
+    registry.register('flaky', flaky)
+    assert registry.get('flaky') is None
+    status = registry.status()['flaky']
+    assert (status['state'], status['error']) == (services.FAILED, 'credentials not mounted yet')
+    assert 0 < status['retry_in'] <= 0.2
+    # Within the backoff the failure is returned without building again
+    assert registry.get('flaky') is None and len(attempts) == 1
+
+    time.sleep(0.25)
+    assert isinstance(registry.get('flaky'), FakeClient)
+    assert len(attempts) == 2
+    status = registry.status()['flaky']
+    assert (status['state'], status['error'], status['retry_in']) == (services.READY, None, None)
+
+
+if __name__ == "__main__":
+    test_probe_cycle_caches_results_without_building_clients()
+    test_background_thread_refreshes_cache()
+    test_failed_service_is_rebuilt_after_backoff()
@@ -0,0 +1,116 @@
+"""
+Tests for the background job queue.
+
+Run with: python -m pytest test_jobs.py
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+
+from jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, JobLimitError, JobQueue
+
+
+def wait_for_state(queue, job_id, username, states, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id, username)
+        if job['state'] in states:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} still {queue.get(job_id, username)['state']}")
+
+
+def echo(params, progress):
+    progress(0.5, 'half way')
+    if params.get('fail'):
+        raise RuntimeError('it failed')
+    return {'echo': params['value']}
+
+
+def test_jobs_run_and_report():
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = JobQueue(os.path.join(tmp, 'jobs.db'), {'echo': echo}, poll_interval=0.01)
+        ok = queue.submit('ana', 'echo', {'value': 42})
+        failing = queue.submit('ana', 'echo', {'value': 1, 'fail': True})
+        job = wait_for_state(queue, ok, 'ana', (SUCCEEDED, FAILED))
+        assert (job['state'], job['result'], job['progress'], job['message']) == (SUCCEEDED, {'echo': 42}, 1, 'half way')
+        job = wait_for_state(queue, failing, 'ana', (SUCCEEDED, FAILED))
+        assert (job['state'], job['error']) == (FAILED, 'it failed')
+        # Other users cannot see it
+        assert queue.get(ok, 'ben') is None
+        assert [job['id'] for job in queue.recent('ana')] == [failing, ok]
+        with pytest.raises(ValueError):
+            queue.submit('ana', 'nope', {})
+        queue.stop()
+        stats = queue.stats()
+        assert (stats['completed_here'], stats['failed_here']) == (1, 1)
+
+
+def test_stats_count_every_job_across_workers():
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = JobQueue(os.path.join(tmp, 'jobs.db'), {'echo': echo}, workers=8, poll_interval=0.01)
+        jobs = [(f'user{user}', queue.submit(f'user{user}', 'echo', {'value': i, 'fail': i % 3 == 0}))
+                for user in range(16) for i in range(6)]
+        for username, job_id in jobs:
+            wait_for_state(queue, job_id, username, (SUCCEEDED, FAILED), timeout=30)
+        queue.stop()
+        stats = queue.stats()
+        assert (stats['completed_here'], stats['failed_here']) == (64, 32)
+
+
+def test_per_user_limits():
+    release = threading.Event()
+    running = []
+
+    def block(params, progress):
+        running.append(params['user'])
+        release.wait(5)
+        return None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = JobQueue(os.path.join(tmp, 'jobs.db'), {'block': block}, workers=3, per_user=1, max_pending=2,
+                         poll_interval=0.01)
+        first = queue.submit('ana', 'block', {'user': 'ana'})
+        second = queue.submit('ana', 'block', {'user': 'ana'})
+        with pytest.raises(JobLimitError):
+            queue.submit('ana', 'block', {'user': 'ana'})
+        other = queue.submit('ben', 'block', {'user': 'ben'})
+        wait_for_state(queue, other, 'ben', (RUNNING,))
+        time.sleep(0.1)
+        # A free worker does not start ana's second job while her first runs
+        assert queue.get(first, 'ana')['state'] == RUNNING
+        assert queue.get(second, 'ana')['state'] == QUEUED
+        release.set()
+        wait_for_state(queue, second, 'ana', (SUCCEEDED,))
+        assert sorted(running) == ['ana', 'ana', 'ben']
+        queue.stop()
+
+
+def test_jobs_survive_a_restart():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'jobs.db')
+        before = JobQueue(path, {'echo': echo}, lease_seconds=0.2)
+        before.start = lambda: None  # No workers: the process goes away first
+        # Claimed by a process that died, so its lease runs out
+        stranded = before.submit('ana', 'echo', {'value': 8})
+        assert before.claim()['id'] == stranded
+        # Queued and never started
+        job_id = before.submit('ana', 'echo', {'value': 7})
+        time.sleep(0.3)
+
+        after = JobQueue(path, {'echo': echo}, poll_interval=0.01)
+        after.start()
+        assert wait_for_state(after, job_id, 'ana', (SUCCEEDED,))['result'] == {'echo': 7}
+        job = wait_for_state(after, stranded, 'ana', (SUCCEEDED,))
+        assert (job['result'], job['attempts']) == ({'echo': 8}, 2)
+        after.stop()
+
+
+if __name__ == "__main__":
+    test_jobs_run_and_report()
+    test_per_user_limits()
+    test_jobs_survive_a_restart()
@@ -0,0 +1,120 @@
+"""
+Tests for language segmentation.
+
+Run with: python -m pytest test_language_segmentation.py
+"""
+
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import bench_language_segmentation
+import langid
+from language_segmentation import segment_languages, segment_texts
+
+
+def test_spans_index_into_original_text():
+    text = "Hello  bonjour hola, guten tag"
+    assert segment_languages(text) == [('en', 0, 5), ('fr', 7, 14), ('es', 15, 20), ('en', 21, 30)]
+    assert segment_texts(text)[1] == ('fr', 'bonjour')
+    assert segment_languages('') == []
+    assert segment_languages('   ') == []
+
+
+def test_matches_per_word_detection():
+    # Same segments as the detect_language_for_word loop it replaced
+    phrases = bench_language_segmentation.PHRASES + [
+        "¿Dónde está la biblioteca? Straße über alles",
+        "Ça va très bien, merci!",
+        bench_language_segmentation.build_text(500)
+    ]
+    for phrase in phrases:
+        assert segment_texts(phrase) == bench_language_segmentation.legacy_segment(phrase)
+
+
+def test_trigram_model_segments():
+    model = langid.LanguageModel.load()
+    text = "Hello everyone -- bonjour à tous, ¿cómo están?"
+    assert [lang for lang, _ in segment_texts(text, model)] == ['en', 'fr', 'es']
+    # The dash has no letters and stays inside the English run
+    assert segment_texts(text, model)[0] == ('en', 'Hello everyone --')
+    assert segment_languages('-- 42 !', model) == [('en', 0, 7)]
+    assert segment_languages('  ', model) == []
+
+
+def test_held_out_text_is_not_in_corpus():
+    # Evaluation sentences must not share a three-word run with the training text
+    def runs(words):
+        return {tuple(words[i:i + 3]) for i in range(len(words) - 2)}
+
+    corpus = langid.read_corpus()
+    trained = set().union(*(runs(words) for words in corpus.values()))
+    for sentence, _ in bench_language_segmentation.HELD_OUT:
+        words = [word for word in map(langid.clean_word, sentence.split()) if word]
+        assert not runs(words) & trained, sentence
+
+
+def test_smoothing_merges_islands():
+    model = langid.LanguageModel.load()
+    text = "Yesterday we went to the park and ate a sandwich"
+    stats = {}
+    assert segment_languages(text, model, switch_penalty=langid.SWITCH_PENALTY, stats=stats) == [('en', 0, len(text))]
+    assert stats['segments'] == 1 and stats['segments_unsmoothed'] > 1
+    # Genuine switches still split, and smoothing never adds segments
+    for text, languages in [("I speak English, je parle français, y hablo español", ['en', 'fr', 'es']),
+                            ("My friend Pedro es muy simpático and he likes to sing", ['en', 'es', 'en'])]:
+        assert [lang for lang, _ in segment_texts(text, model, langid.SWITCH_PENALTY)] == languages
+    before, after = bench_language_segmentation.segment_counts(
+        model, langid.SWITCH_PENALTY, bench_language_segmentation.PHRASES + bench_language_segmentation.MIXED_SENTENCES)
+    assert after < before
+    # No penalty: plain per-word argmax
+    stats = {}
+    segment_languages(text, model, stats=stats)
+    assert stats['segments'] == stats['segments_unsmoothed'] > 1
+
+
+def test_english_prose_stays_one_segment():
+    # Long words and words at either end of a sentence used to clear the penalty on their own
+    model = langid.LanguageModel.load()
+    for sentence in bench_language_segmentation.ENGLISH_PROSE:
+        assert segment_texts(sentence, model, langid.SWITCH_PENALTY) == [('en', sentence)], sentence
+
+
+def test_smooth_switches_only_when_worth_the_penalty():
+    scores = np.array([[0, -5], [0, -5], [-2, 0], [0, -5], [-6, 0], [-6, 0]], dtype=np.float32)
+    assert langid.smooth(scores, 0.0) == [0, 0, 1, 0, 1, 1]
+    assert langid.smooth(scores, 3.0) == [0, 0, 0, 0, 1, 1]
+    assert langid.smooth(scores, 50.0) == [0, 0, 0, 0, 0, 0]
+
+
+def test_fifty_word_sentence_under_a_millisecond():
+    model = langid.LanguageModel.load()
+    sentence = bench_language_segmentation.build_text(50)
+    best = float('inf')
+    for _ in range(50):
+        start = time.perf_counter()
+        segment_languages(sentence, model, switch_penalty=langid.SWITCH_PENALTY)
+        best = min(best, time.perf_counter() - start)
+    assert best < 0.001
+
+
+def test_shipped_model_matches_corpus():
+    # Rebuild with `python langid.py build` after editing langid_corpus/
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'model.npy')
+        langid.build(path=path)
+        assert np.allclose(np.load(path), np.load(langid.MODEL_PATH))
+
+
+if __name__ == "__main__":
+    test_spans_index_into_original_text()
+    test_matches_per_word_detection()
+    test_trigram_model_segments()
+    test_held_out_text_is_not_in_corpus()
+    test_smoothing_merges_islands()
+    test_english_prose_stays_one_segment()
+    test_smooth_switches_only_when_worth_the_penalty()
+    test_fifty_word_sentence_under_a_millisecond()
+    test_shipped_model_matches_corpus()
@@ -0,0 +1,92 @@
+"""
+Tests for single-flight coalescing of identical upstream calls.
+
+Run with: python -m pytest test_singleflight.py
+"""
+
+import tempfile
+import threading
+import time
+
+import tts_synthesis
+from singleflight import SingleFlight
+from tts_cache import TTSCache
+from test_tts_synthesis import FakeClient
+
+STUDENTS = 30
+
+
+class SlowClient(FakeClient):
+    def synthesize_speech(self, input, voice, audio_config):
+        time.sleep(0.1)
+        return super().synthesize_speech(input, voice, audio_config)
+
+
+def run_together(target):
+    barrier = threading.Barrier(STUDENTS)
+    results = [None] * STUDENTS
+
+    def student(index):
+        barrier.wait()
+        try:
+            results[index] = target()
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=student, args=(index,)) for index in range(STUDENTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+
+def test_concurrent_duplicates_share_one_call():
+    flights = SingleFlight('test')
+    calls = []
+
+    def upstream():
+        calls.append(1)
+        time.sleep(0.1)
+        return object()
+
+    results = run_together(lambda: flights.do('phrase', upstream))
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert flights.stats() == {'flights': 1, 'calls_saved': STUDENTS - 1, 'in_flight': 0}
+    # Nothing is kept once the call has landed
+    flights.do('phrase', upstream)
+    assert len(calls) == 2
+
+
+def test_errors_are_shared_and_not_kept():
+    flights = SingleFlight('test')
+
+    def failing():
+        time.sleep(0.1)
+        raise RuntimeError('quota exceeded')
+
+    results = run_together(lambda: flights.do('phrase', failing))
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert flights.stats()['flights'] == 1
+    assert flights.do('phrase', lambda: 'ok') == 'ok'
+
+
+def test_class_pressing_play_makes_one_tts_call():
+    flights = SingleFlight('tts')
+    client = SlowClient()
+    sentences = ['Repeat after me.', 'The rain in Spain stays mainly in the plain.']
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = TTSCache(tmp, max_bytes=1_000_000)
+        results = run_together(lambda: tts_synthesis.synthesize_sentences(
+            client, sentences, 'en-US-Standard-D', 1.0, cache=cache, flights=flights))
+    # Requests either join the call in flight or, once it landed, find its audio on disk
+    assert len(client.requests) == len(sentences)
+    assert all(result[0] == results[0][0] for result in results)
+    assert flights.stats()['calls_saved'] > 0
+
+
+if __name__ == "__main__":
+    test_concurrent_duplicates_share_one_call()
+    test_errors_are_shared_and_not_kept()
+    test_class_pressing_play_makes_one_tts_call()
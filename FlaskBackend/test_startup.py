@@ -0,0 +1,88 @@
+"""
+Startup-time budget for the Flask backend.
+
+Imports app.py in a fresh interpreter (with background warmup disabled) and
+fails if importing it and answering the first /api/health request takes
+longer than STARTUP_BUDGET_SECONDS. Upstream clients are built lazily, so
+none of that time should be spent on Google/Gemini/LanguageTool setup.
+
+Run with: python -m pytest test_startup.py
+"""
+
+import json
+import os
+import tempfile
+
+import bench_startup
+import provision
+import services
+
+STARTUP_BUDGET_SECONDS = float(os.environ.get('STARTUP_BUDGET_SECONDS', '2.0'))
+
+MEASURE_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter() - start
+response = app.app.test_client().get('/api/health')
+print(json.dumps({
+    'import_seconds': imported,
+    'first_health_seconds': time.perf_counter() - start,
+    'health': response.get_json(),
+    'services': app.services.status(),
+    'modules': sorted(sys.modules)
+}))
+"""
+
+
+def measure_startup():
+    with tempfile.TemporaryDirectory() as tmp:
+        result = bench_startup.run_app_python(['-c', MEASURE_SCRIPT], tmp)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_startup_within_budget():
+    measurement = measure_startup()
+    print(f"import: {measurement['import_seconds']:.3f}s, "
+          f"first /api/health: {measurement['first_health_seconds']:.3f}s "
+          f"(budget {STARTUP_BUDGET_SECONDS:.1f}s)")
+    assert measurement['first_health_seconds'] < STARTUP_BUDGET_SECONDS
+    # Nothing upstream may be built just by importing the app or checking health
+    assert all(status['state'] == 'uninitialized' for status in measurement['services'].values())
+    assert measurement['health']['status'] == 'initializing'
+    eager = [module for module in bench_startup.LAZY_MODULES if module in measurement['modules']]
+    assert not eager, f"Heavy modules imported at startup: {eager}"
+
+
+def test_nltk_validation_is_offline():
+    with tempfile.TemporaryDirectory() as tmp:
+        assert provision.validate_nltk_data(tmp) == list(provision.NLTK_RESOURCES)
+        for category, package in provision.NLTK_RESOURCES.values():
+            os.makedirs(os.path.join(tmp, category, package))
+        assert provision.validate_nltk_data(tmp) == []
+
+
+def test_fork_resets_fork_unsafe_services():
+    registry = services.ServiceRegistry()
+    registry.register('grpc_client', object)
+    registry.register('word_lists', dict, fork_safe=True)
+    registry.warmup(background=False)
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # Child: report the states it inherited, then exit without running pytest teardown
+        os.write(write_fd, json.dumps({name: status['state'] for name, status in registry.status().items()}).encode())
+        os._exit(0)
+    os.close(write_fd)
+    child_states = json.loads(os.read(read_fd, 4096))
+    os.waitpid(pid, 0)
+
+    assert child_states == {'grpc_client': 'uninitialized', 'word_lists': 'ready'}
+    assert registry.state('grpc_client') == 'ready'
+
+
+if __name__ == "__main__":
+    test_startup_within_budget()
+    test_nltk_validation_is_offline()
+    test_fork_resets_fork_unsafe_services()
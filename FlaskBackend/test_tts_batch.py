@@ -0,0 +1,69 @@
+"""
+Tests for /api/tts/batch packaging: deduplication, ZIP and multipart bodies.
+
+Run with: python -m pytest test_tts_batch.py
+"""
+
+import email
+import io
+import json
+import zipfile
+
+import tts_batch
+
+ITEMS = [
+    {'text': 'apple', 'voiceId': 'en-US-Standard-D', 'speed': 1.0},
+    {'text': 'pomme', 'voiceId': 'fr-FR-Standard-A', 'speed': 1.0},
+    {'text': ' apple ', 'voiceId': 'en-US-Standard-D', 'speed': '1'},
+    {'text': 'apple', 'voiceId': 'en-US-Standard-D', 'speed': 0.5},
+    {'text': ''},
+    'banana',
+    {'text': 'banana', 'speed': 9},
+]
+
+
+def test_plan_dedupes_and_rejects_per_item():
+    clips, entries = tts_batch.plan(ITEMS, 'en-US-Standard-D', 2.0)
+    assert clips == [('apple', 'en-US-Standard-D', 1.0), ('pomme', 'fr-FR-Standard-A', 1.0),
+                     ('apple', 'en-US-Standard-D', 0.5)]
+    assert [entry['clip'] for entry in entries] == [0, 1, 0, 2, None, None, None]
+    assert [entry['error'] for entry in entries[4:]] == [
+        'Text is required', 'Item must be an object', 'Speed must be between 0.25 and 4.0']
+
+
+def results():
+    yield b'APPLE', None, True
+    yield None, 'Text-to-speech API error: 400 bad input', False
+    yield b'apple, slowly', None, False
+
+
+def test_zip_holds_every_clip_and_the_manifest():
+    clips, entries = tts_batch.plan(ITEMS, 'en-US-Standard-D', 2.0)
+    chunks = list(tts_batch.iter_zip(results(), entries, 'mp3'))
+    # A chunk per clip written, then the manifest and the central directory
+    assert len(chunks) == 3
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+    assert archive.testzip() is None
+    assert archive.namelist() == ['001.mp3', '003.mp3', 'manifest.json']
+    assert archive.read('003.mp3') == b'apple, slowly'
+    items = json.loads(archive.read('manifest.json'))['items']
+    assert [(item['file'], item['cached']) for item in items[:4]] == [
+        ('001.mp3', True), (None, False), ('001.mp3', True), ('003.mp3', False)]
+    assert items[1]['error'] == 'Text-to-speech API error: 400 bad input'
+
+
+def test_multipart_parts():
+    clips, entries = tts_batch.plan(ITEMS, 'en-US-Standard-D', 2.0)
+    body = b''.join(tts_batch.iter_multipart(results(), entries, 'mp3', 'audio/mpeg', 'b0undary'))
+    message = email.message_from_bytes(b'Content-Type: multipart/mixed; boundary=b0undary\r\n\r\n' + body)
+    parts = message.get_payload()
+    assert [(part.get_content_type(), part.get_filename()) for part in parts] == [
+        ('audio/mpeg', '001.mp3'), ('audio/mpeg', '003.mp3'), ('application/json', 'manifest.json')]
+    assert parts[0].get_payload(decode=True) == b'APPLE'
+    assert len(json.loads(parts[2].get_payload(decode=True))['items']) == len(ITEMS)
+
+
+if __name__ == "__main__":
+    test_plan_dedupes_and_rejects_per_item()
+    test_zip_holds_every_clip_and_the_manifest()
+    test_multipart_parts()
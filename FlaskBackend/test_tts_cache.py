@@ -0,0 +1,138 @@
+"""
+Tests for the on-disk TTS audio cache.
+
+Run with: python -m pytest test_tts_cache.py
+"""
+
+import multiprocessing
+import os
+import tempfile
+import time
+
+from tts_cache import TTSCache, cache_key
+
+WRITERS = 4
+ENTRIES_PER_WRITER = 50
+BUDGET_WRITERS = 8
+ENTRY_BYTES = 2000
+
+
+def test_keys_normalize_text_and_cover_settings():
+    key = cache_key('Hello  world ', 'en-US-Standard-D', 'en-US', 1.0, 'MP3')
+    assert key == cache_key('Hello world', 'en-US-Standard-D', 'en-US', 1, 'MP3')
+    assert key != cache_key('Hello world', 'en-US-Standard-D', 'en-US', 1.25, 'MP3')
+    assert key != cache_key('Hello world', 'en-US-Standard-C', 'en-US', 1.0, 'MP3')
+    assert key != cache_key('Hello world', 'en-US-Standard-D', 'en-US', 1.0, 'OGG_OPUS')
+
+
+def test_hit_miss_and_lru_eviction():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = TTSCache(tmp, max_bytes=1000)
+        keys = [cache_key(f'phrase {i}', 'v', 'en-US', 1.0, 'MP3') for i in range(5)]
+        assert cache.get(keys[0]) is None
+        for i, key in enumerate(keys[:4]):
+            cache.put(key, bytes([i]) * 300)
+            # mtime is the LRU clock; make the order unambiguous on coarse filesystems
+            os.utime(cache.path(key), (time.time() - 100 + i, time.time() - 100 + i))
+        # 1200 bytes written into a 1000 byte budget: the oldest entry is gone
+        assert cache.get(keys[0]) is None
+        # Reading keys[1] makes it the most recently used, so keys[2] goes next
+        assert cache.get(keys[1]) == bytes([1]) * 300
+        cache.put(keys[4], b'x' * 300)
+        assert cache.get(keys[2]) is None
+        assert cache.get(keys[1]) is not None and cache.get(keys[4]) is not None
+
+        stats = cache.stats()
+        assert stats['evictions'] == 2
+        assert stats['approx_bytes'] <= 1000
+        assert not [name for _, _, names in os.walk(tmp) for name in names if name.startswith('.tmp-')]
+
+
+def test_read_problems_never_fail_the_request(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = TTSCache(tmp, max_bytes=1000)
+        key = cache_key('phrase', 'v', 'en-US', 1.0, 'MP3')
+        cache.put(key, b'audio')
+
+        # Evicted by another worker between the read and the touch: still a hit
+        def evicted(path, *args):
+            raise FileNotFoundError(path)
+        monkeypatch.setattr(os, 'utime', evicted)
+        assert cache.get(key) == b'audio'
+        monkeypatch.undo()
+
+        # An entry that cannot be read at all is a miss, not an error
+        unreadable = cache_key('unreadable', 'v', 'en-US', 1.0, 'MP3')
+        os.makedirs(cache.path(unreadable))
+        assert cache.get(unreadable) is None
+        assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 1)
+
+
+def write_entries(root, writer):
+    cache = TTSCache(root, max_bytes=10_000)
+    for i in range(ENTRIES_PER_WRITER):
+        # Every writer writes the same keys: concurrent replaces of one entry
+        cache.put(cache_key(f'phrase {i}', 'v', 'en-US', 1.0, 'MP3'), f'audio {i}'.encode() * 20)
+
+
+def test_workers_share_one_directory():
+    with tempfile.TemporaryDirectory() as tmp:
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=write_entries, args=(tmp, writer)) for writer in range(WRITERS)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(60)
+            assert process.exitcode == 0
+
+        cache = TTSCache(tmp, max_bytes=10_000)
+        for i in range(ENTRIES_PER_WRITER):
+            data = cache.get(cache_key(f'phrase {i}', 'v', 'en-US', 1.0, 'MP3'))
+            # Either evicted or complete, never torn
+            assert data is None or data == f'audio {i}'.encode() * 20
+        cache.evict()
+        assert cache.stats()['approx_bytes'] <= 10_000
+
+
+def fill_cache(root, writer):
+    cache = TTSCache(root, max_bytes=100_000)
+    for i in range(60):
+        cache.put(cache_key(f'writer {writer} phrase {i}', 'v', 'en-US', 1.0, 'MP3'), bytes([writer]) * ENTRY_BYTES)
+
+
+def directory_bytes(root):
+    return sum(os.path.getsize(os.path.join(path, name))
+               for path, _, names in os.walk(root) for name in names if not name.startswith('.'))
+
+
+def test_budget_holds_across_workers():
+    # 8 workers each writing 120 KB: the directory, not each process, stays within 100 KB
+    with tempfile.TemporaryDirectory() as tmp:
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=fill_cache, args=(tmp, writer)) for writer in range(BUDGET_WRITERS)]
+        for process in processes:
+            process.start()
+        peak = 0
+        while any(process.is_alive() for process in processes):
+            try:
+                peak = max(peak, directory_bytes(tmp))
+            except FileNotFoundError:  # Evicted while being summed
+                pass
+            time.sleep(0.005)
+        for process in processes:
+            process.join(60)
+            assert process.exitcode == 0
+
+        # At most one entry per worker is on disk ahead of the shared total
+        assert peak <= 100_000 + BUDGET_WRITERS * ENTRY_BYTES
+        assert directory_bytes(tmp) <= 100_000
+        cache = TTSCache(tmp, max_bytes=100_000)
+        cache.evict()
+        assert cache.stats()['approx_bytes'] == directory_bytes(tmp)
+
+
+if __name__ == "__main__":
+    test_keys_normalize_text_and_cover_settings()
+    test_hit_miss_and_lru_eviction()
+    test_workers_share_one_directory()
+    test_budget_holds_across_workers()
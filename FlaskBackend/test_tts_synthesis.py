@@ -0,0 +1,300 @@
+"""
+Tests for TTS synthesis: concurrent segments and SSML mode.
+
+Run with: python -m pytest test_tts_synthesis.py
+"""
+
+import gc
+import os
+import tempfile
+import threading
+import time
+
+from google.api_core import exceptions
+
+import tts_synthesis
+from tts_cache import TTSCache
+
+SEGMENT_SECONDS = 0.1
+
+
+class FakeUpstream:
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def synthesize(self, segment):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            # Later segments finish first, so ordering has to come from the caller
+            time.sleep(SEGMENT_SECONDS * (1 - segment / 20))
+            if segment in self.fail:
+                raise RuntimeError(f"segment {segment} failed")
+            return f"audio-{segment}"
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+def test_segments_run_concurrently_in_order():
+    upstream = FakeUpstream()
+    start = time.perf_counter()
+    outcomes = tts_synthesis.synthesize_segments(upstream.synthesize, list(range(5)), max_concurrency=5)
+    elapsed = time.perf_counter() - start
+    assert outcomes == [(f"audio-{i}", None) for i in range(5)]
+    # About one segment's latency, not five
+    assert elapsed < 2.5 * SEGMENT_SECONDS
+    assert upstream.max_in_flight == 5
+
+
+def test_per_request_cap():
+    upstream = FakeUpstream()
+    outcomes = tts_synthesis.synthesize_segments(upstream.synthesize, list(range(6)), max_concurrency=2)
+    assert [audio for audio, _ in outcomes] == [f"audio-{i}" for i in range(6)]
+    assert upstream.max_in_flight == 2
+
+
+def test_results_stream_in_order():
+    upstream = FakeUpstream()
+    start = time.perf_counter()
+    outcomes = tts_synthesis.iter_segments(upstream.synthesize, list(range(8)), max_concurrency=2)
+    assert next(outcomes) == ('audio-0', None)
+    # The first segment is out long before the other seven are synthesized
+    assert time.perf_counter() - start < 1.5 * SEGMENT_SECONDS
+    assert list(outcomes) == [(f"audio-{i}", None) for i in range(1, 8)]
+    assert time.perf_counter() - start > 3 * SEGMENT_SECONDS
+    assert upstream.max_in_flight == 2
+
+
+def test_failures_are_reported_per_segment():
+    upstream = FakeUpstream(fail={1, 3})
+    outcomes = tts_synthesis.synthesize_segments(upstream.synthesize, list(range(4)), max_concurrency=4)
+    assert [audio for audio, _ in outcomes] == ['audio-0', None, 'audio-2', None]
+    assert [str(error) for _, error in outcomes if error] == ['segment 1 failed', 'segment 3 failed']
+
+
+class FakeClient:
+    def __init__(self, reject_ssml=False):
+        self.reject_ssml = reject_ssml
+        self.requests = []
+
+    def synthesize_speech(self, input, voice, audio_config):
+        self.requests.append((voice.language_code, voice.name, input.ssml or input.text))
+        if input.ssml and self.reject_ssml:
+            raise exceptions.InvalidArgument('voice does not support SSML voice switching')
+
+        class Response:
+            audio_content = (input.ssml or input.text).encode('utf-8')
+        return Response()
+
+
+GROUPS = [('en', 'Fish & chips <3'), ('fr', 'et "bonjour"')]
+
+
+def test_render_ssml_escapes_text():
+    ssml = tts_synthesis.render_ssml(GROUPS)
+    assert ssml == ('<speak><voice name="en-US-Standard-C"><lang xml:lang="en-US">Fish &amp; chips &lt;3</lang></voice> '
+                    '<voice name="fr-FR-Standard-A"><lang xml:lang="fr-FR">et "bonjour"</lang></voice></speak>')
+    assert tts_synthesis.render_ssml(GROUPS, voices={'en-US': 'en-US-Standard-C'}) is None
+
+
+def test_ssml_mode_makes_one_call():
+    client = FakeClient()
+    parts, info = tts_synthesis.synthesize_multilingual(client, [GROUPS], tts_synthesis.SSML)
+    assert info == {'mode': 'ssml', 'calls': 1, 'cache_hits': 0, 'sentences': 1, 'sentence_cache_hits': 0}
+    assert len(parts) == 1 and parts[0][3] is None
+    assert client.requests[0][:2] == ('en-US', 'en-US-Standard-C')
+
+
+def test_ssml_mode_falls_back_to_segments():
+    # Rejected by upstream
+    client = FakeClient(reject_ssml=True)
+    parts, info = tts_synthesis.synthesize_multilingual(client, [GROUPS], tts_synthesis.SSML)
+    assert info == {'mode': 'segments', 'calls': 3, 'cache_hits': 0, 'sentences': 1, 'sentence_cache_hits': 0}
+    assert [audio for _, _, audio, _ in parts] == [b'Fish & chips <3', b'et "bonjour"']
+    # No voice for a language
+    client = FakeClient()
+    parts, info = tts_synthesis.synthesize_multilingual(client, [GROUPS], tts_synthesis.SSML,
+                                                        voices={'en-US': 'en-US-Standard-C'})
+    assert info['mode'] == 'segments' and info['calls'] == 2
+    # Over the upstream input limit
+    long_groups = [('en', 'word ' * 600), ('fr', 'mot ' * 600)]
+    parts, info = tts_synthesis.synthesize_multilingual(FakeClient(), [long_groups], tts_synthesis.SSML)
+    assert info['mode'] == 'segments'
+
+
+class FakePunkt:
+    def __init__(self):
+        self.languages = []
+
+    def sent_tokenize(self, text, language='english'):
+        self.languages.append(language)
+        return ['Dr. Smith arrived.', 'He sat down.']
+
+
+def test_split_sentences():
+    nltk = FakePunkt()
+    assert tts_synthesis.split_sentences('Dr. Smith arrived. He sat down.', nltk, 'fr') == nltk.sent_tokenize('')
+    assert nltk.languages[0] == 'french'
+    # Without NLTK data: punctuation, closing quotes and brackets end a sentence
+    text = 'Hello there! "Are you sure?" she asked.  (Yes.) Bonjour...  Ok'
+    assert tts_synthesis.split_sentences(text) == [
+        'Hello there!', '"Are you sure?" she asked.', '(Yes.)', 'Bonjour...', 'Ok']
+    assert tts_synthesis.split_sentences('  ') == []
+
+
+def test_fit_input_respects_the_byte_limit():
+    assert tts_synthesis.fit_input('Short enough.') == ['Short enough.']
+    # Clause breaks first, then spaces, then between characters (never inside one)
+    assert tts_synthesis.fit_input('one two, three four five', 9) == ['one two,', 'three', 'four five']
+    assert tts_synthesis.fit_input('ééééé', 4) == ['éé', 'éé', 'é']
+    sentence = ', '.join(['très long clause ' * 20] * 40) + '.'
+    pieces = tts_synthesis.split_sentences(sentence + ' Next one.')
+    assert len(sentence.encode('utf-8')) > tts_synthesis.MAX_INPUT_BYTES
+    assert all(len(piece.encode('utf-8')) <= tts_synthesis.MAX_INPUT_BYTES for piece in pieces)
+    assert ' '.join(pieces).split() == (sentence + ' Next one.').split()
+    assert pieces[-1] == 'Next one.' and pieces[0].endswith(',')
+
+
+class TimedClient(FakeClient):
+    """Latency of a call: a round trip plus time proportional to what it speaks."""
+    def synthesize_speech(self, input, voice, audio_config):
+        time.sleep(0.001 + 0.00002 * len(input.text.encode('utf-8')))
+        return super().synthesize_speech(input, voice, audio_config)
+
+
+def reading_passage(size):
+    sentences = [
+        'The river wound slowly through the valley, past the old mill and the orchards.',
+        'Every spring, the villagers gathered on its banks to celebrate the first warm day.',
+        'Children raced paper boats while their grandparents told stories of floods long ago.',
+        'Nobody remembered exactly when the bridge had been built, only that it had always been there.'
+    ]
+    words = ' '.join(['endless'] * 1200)  # One sentence over the upstream limit on its own
+    parts, total, index = [f'It went on and on, {words}, until it stopped.'], 0, 0
+    while total < size:
+        parts.append(f'{sentences[index % len(sentences)]} ({index})')
+        total += len(parts[-1]) + 1
+        index += 1
+    return ' '.join(parts)
+
+
+def test_fifty_kb_passage_is_chunked_and_synthesized_in_parallel():
+    passage = reading_passage(50_000)
+    assert len(passage.encode('utf-8')) >= 50_000
+    sentences = tts_synthesis.split_sentences(passage)
+    timings = {}
+    for concurrency in [1, 8]:
+        client = TimedClient()
+        start = time.perf_counter()
+        results, info = tts_synthesis.synthesize_sentences(client, sentences, 'en-US-Standard-D', 1.0, concurrency)
+        timings[concurrency] = time.perf_counter() - start
+
+        assert all(error is None for _, error in results)
+        assert all(len(text.encode('utf-8')) <= tts_synthesis.MAX_INPUT_BYTES for _, _, text in client.requests)
+        # FakeClient's audio is the text it was given: the pieces come back complete and in order
+        audio = b''.join(audio for audio, _ in results).decode('utf-8')
+        assert audio == ''.join(sentences)
+        assert ' '.join(sentences).split() == passage.split()
+        assert info['calls'] == len(sentences)
+    assert timings[1] / timings[8] > 3
+
+
+PASSAGE = ['The cat sat on the mat.', 'It was a sunny day.', 'Then it rained.', 'Everyone went home.']
+
+
+def test_editing_one_sentence_resynthesizes_only_it():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = TTSCache(tmp, max_bytes=1_000_000)
+        client = FakeClient()
+        results, info = tts_synthesis.synthesize_sentences(client, PASSAGE, 'en-US-Standard-D', 1.25, cache=cache)
+        assert info == {'calls': 4, 'cache_hits': 0, 'sentences': 4, 'sentence_cache_hits': 0}
+        assert b''.join(audio for audio, _ in results) == ''.join(PASSAGE).encode('utf-8')
+
+        edited = PASSAGE[:2] + ['Then it snowed.'] + PASSAGE[3:]
+        results, info = tts_synthesis.synthesize_sentences(client, edited, 'en-US-Standard-D', 1.25, cache=cache)
+        assert info == {'calls': 1, 'cache_hits': 3, 'sentences': 4, 'sentence_cache_hits': 3}
+        assert client.requests[-1] == ('en-US', 'en-US-Standard-D', 'Then it snowed.')
+        assert b''.join(audio for audio, _ in results) == ''.join(edited).encode('utf-8')
+        # Another speaking rate is different audio
+        _, info = tts_synthesis.synthesize_sentences(client, edited, 'en-US-Standard-D', 1.0, cache=cache)
+        assert info['calls'] == 4
+
+
+def test_multilingual_sentences_are_reused():
+    sentences = [GROUPS, [('en', 'Good morning.')], [('es', 'Hola.')]]
+    for mode, calls in [(tts_synthesis.SEGMENTS, 4), (tts_synthesis.SSML, 3)]:
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = TTSCache(tmp, max_bytes=1_000_000)
+            client = FakeClient()
+            parts, info = tts_synthesis.synthesize_multilingual(client, sentences, mode, cache=cache)
+            assert info['calls'] == calls and info['sentences'] == 3
+            edited = sentences[:2] + [[('es', 'Hola, amigos.')]]
+            parts, info = tts_synthesis.synthesize_multilingual(client, edited, mode, cache=cache)
+            assert info['calls'] == 1 and info['sentence_cache_hits'] == 2
+            assert parts[-1][:2] == ('es', 'Hola, amigos.')
+
+
+class FailingClient(FakeClient):
+    def synthesize_speech(self, input, voice, audio_config):
+        if 'fail' in input.text:
+            raise exceptions.InvalidArgument('bad input')
+        return super().synthesize_speech(input, voice, audio_config)
+
+
+def test_clips_share_one_pool():
+    clips = [(['One.', 'Two.'], 'en-US-Standard-D', 1.0), (['Please fail.'], 'en-US-Standard-D', 1.0),
+             (['Un.'], 'fr-FR-Standard-A', 1.0)]
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = TTSCache(tmp, max_bytes=1_000_000)
+        outcomes = list(tts_synthesis.iter_clips(FailingClient(), clips, 4, cache=cache))
+        assert outcomes[0] == ([b'One.', b'Two.'], None, 2)
+        assert outcomes[1][0] is None and isinstance(outcomes[1][1], exceptions.InvalidArgument)
+        assert outcomes[2] == ([b'Un.'], None, 1)
+        # Same cache keys as synthesize_sentences()
+        _, info = tts_synthesis.synthesize_sentences(FakeClient(), ['One.', 'Two.'], 'en-US-Standard-D', 1.0,
+                                                     cache=cache)
+        assert info['calls'] == 0
+
+
+def test_segment_pool_is_dropped_in_forked_children():
+    pool = tts_synthesis.SegmentPool(size=2)
+    discarded = tts_synthesis.SegmentPool(size=2)
+    executor = pool.get()
+    assert pool.get() is executor
+    del discarded
+    gc.collect()  # Its at-fork hook must not keep it alive or fail once it is gone
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # Child: report whether it inherited the executor, then exit without pytest teardown
+        os.write(write_fd, b'dropped' if pool._executor is None else b'inherited')
+        os._exit(0)
+    os.close(write_fd)
+    child = os.read(read_fd, 64)
+    os.waitpid(pid, 0)
+
+    assert child == b'dropped'
+    assert pool.get() is executor
+    executor.shutdown()
+
+
+if __name__ == "__main__":
+    test_segments_run_concurrently_in_order()
+    test_per_request_cap()
+    test_results_stream_in_order()
+    test_failures_are_reported_per_segment()
+    test_render_ssml_escapes_text()
+    test_ssml_mode_makes_one_call()
+    test_ssml_mode_falls_back_to_segments()
+    test_split_sentences()
+    test_fit_input_respects_the_byte_limit()
+    test_fifty_kb_passage_is_chunked_and_synthesized_in_parallel()
+    test_editing_one_sentence_resynthesizes_only_it()
+    test_multilingual_sentences_are_reused()
+    test_clips_share_one_pool()
+    test_segment_pool_is_dropped_in_forked_children()
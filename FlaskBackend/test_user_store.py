@@ -0,0 +1,209 @@
+"""
+Tests for the SQLite user/history store.
+
+Run with: python -m pytest test_user_store.py
+"""
+
+import json
+import multiprocessing
+import os
+import tempfile
+
+from history_writer import HistoryWriter
+from user_store import UserStore
+
+
+def make_store(tmp):
+    return UserStore(os.path.join(tmp, 'users.db'))
+
+
+def test_create_user_and_history():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = make_store(tmp)
+        assert store.create_user('alice', 'hash')
+        assert not store.create_user('alice', 'other-hash')
+        assert store.get_user('alice')['password_hash'] == 'hash'
+
+        assert store.add_history('alice', 'tts_google', {'text_length': 5}, '2025-01-01T00:00:00Z')
+        assert store.add_history('alice', 'grammar_check', {'text_length': 9}, '2025-01-02T00:00:00Z')
+        assert not store.add_history('nobody', 'tts_google', {})
+
+        history = store.get_history('alice')
+        assert [entry['feature'] for entry in history] == ['grammar_check', 'tts_google']
+        assert history[1]['details'] == {'text_length': 5}
+        assert store.history_count('alice') == 2
+
+
+def test_migrate_from_json_is_one_shot():
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, 'users.json')
+        with open(json_path, 'w') as f:
+            json.dump({
+                'teja': {
+                    'password_hash': 'scrypt:abc',
+                    'history': [
+                        {'timestamp': '2025-05-15T12:28:39Z', 'feature': 'grammar_check', 'details': {'text_length': 129}},
+                        {'timestamp': '2025-05-15T12:41:52Z', 'feature': 'summarize_concept', 'details': {}},
+                    ]
+                },
+                'empty': {'password_hash': 'scrypt:def'}
+            }, f)
+
+        store = make_store(tmp)
+        assert store.migrate_from_json(json_path) == 2
+        assert store.migrate_from_json(json_path) == 0
+        assert store.history_count('teja') == 2
+        assert store.get_user('empty') is not None
+        assert store.load_all()['teja']['history'][0]['feature'] == 'grammar_check'
+
+
+def test_history_writer_batches_and_flushes_on_close():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = make_store(tmp)
+        store.create_user('alice', 'hash')
+        writer = HistoryWriter(store, flush_interval_ms=1000, max_batch=50)
+        writer.start()
+        for i in range(120):
+            writer.enqueue('alice', 'tts_google', {'i': i})
+        writer.enqueue('ghost', 'tts_google', {})
+
+        assert writer.flush()
+        assert store.history_count('alice') == 120
+
+        writer.enqueue('alice', 'grammar_check', {})
+        writer.close()
+        assert store.history_count('alice') == 121
+        stats = writer.stats()
+        assert stats['queue_depth'] == 0
+        assert stats['entries_written'] == 121
+        assert stats['batches'] >= 3
+
+
+def test_history_page_walks_cursor_and_filters():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = make_store(tmp)
+        store.create_user('alice', 'hash')
+        for day in range(1, 11):
+            feature = 'grammar_check' if day % 2 else 'tts_google'
+            store.add_history('alice', feature, {'day': day}, f'2025-01-{day:02d}T00:00:00.000000Z')
+        rev = store.history_rev('alice')
+
+        seen, before = [], None
+        while True:
+            entries, before = store.history_page('alice', 3, before=before)
+            seen.extend(entry['details']['day'] for entry in entries)
+            if before is None:
+                break
+        assert seen == list(range(10, 0, -1))
+
+        entries, _ = store.history_page('alice', 10, feature='tts_google',
+                                        since='2025-01-04T00:00:00.000000Z',
+                                        until='2025-01-08T00:00:00.000000Z')
+        assert [entry['details']['day'] for entry in entries] == [6, 4]
+
+        store.add_history('alice', 'tts_google', {})
+        assert store.history_rev('alice') == rev + 1
+        assert store.history_rev('nobody') is None
+
+
+def test_whole_second_timestamps_sort_with_the_rest():
+    with tempfile.TemporaryDirectory() as tmp:
+        # A legacy users.json entry on a whole second had no '.ffffff' part
+        json_path = os.path.join(tmp, 'users.json')
+        with open(json_path, 'w') as f:
+            json.dump({'alice': {'password_hash': 'hash', 'history': [
+                {'timestamp': '2025-01-01T00:00:05.999999Z', 'feature': 'late', 'details': {}},
+                {'timestamp': '2025-01-01T00:00:05Z', 'feature': 'whole', 'details': {}},
+                {'timestamp': '2025-01-01T00:00:04.500000Z', 'feature': 'early', 'details': {}},
+            ]}}, f)
+        store = make_store(tmp)
+        store.migrate_from_json(json_path)
+        assert [entry['timestamp'] for entry in store.get_history('alice')] == [
+            '2025-01-01T00:00:05.999999Z', '2025-01-01T00:00:05.000000Z', '2025-01-01T00:00:04.500000Z']
+
+        seen, before = [], None
+        while True:
+            entries, before = store.history_page('alice', 1, before=before)
+            seen.extend(entry['feature'] for entry in entries)
+            if before is None:
+                break
+        assert seen == ['late', 'whole', 'early']
+        entries, _ = store.history_page('alice', 10, since='2025-01-01T00:00:05.000000Z',
+                                        until='2025-01-01T00:00:05.500000Z')
+        assert [entry['feature'] for entry in entries] == ['whole']
+
+        # Rows an older version already stored that way are rewritten on open
+        store._connect().execute(
+            "UPDATE history SET timestamp = '2025-01-01T00:00:05Z' WHERE feature = 'whole'")
+        store._connect().execute("DELETE FROM meta WHERE key = 'timestamps_normalized'")
+        rev = store.history_rev('alice')
+        reopened = make_store(tmp)
+        assert [entry['feature'] for entry in reopened.get_history('alice')] == ['late', 'whole', 'early']
+        assert reopened.history_rev('alice') == rev + 1
+
+
+def test_usage_aggregates_survive_pruning():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = make_store(tmp)
+        store.create_user('alice', 'hash')
+        store.add_history_batch([
+            ('alice', '2025-01-01T10:00:00.000000Z', 'tts_google', {}),
+            ('alice', '2025-01-01T11:00:00.000000Z', 'tts_google', {}),
+            ('alice', '2025-01-02T10:00:00.000000Z', 'grammar_check', {}),
+            ('ghost', '2025-01-02T10:00:00.000000Z', 'grammar_check', {}),
+        ])
+        expected = {
+            'total': 3,
+            'features': {'tts_google': 2, 'grammar_check': 1},
+            'daily': {'2025-01-01': {'tts_google': 2}, '2025-01-02': {'grammar_check': 1}}
+        }
+        assert store.get_usage('alice') == expected
+        assert store.get_user('alice')['usage_total'] == 3
+
+        assert store.prune_history('2025-01-02T00:00:00.000000Z') == 2
+        assert store.history_count('alice') == 1
+        assert store.get_usage('alice') == expected
+        assert store.get_usage('alice', since_day='2025-01-02')['daily'] == {'2025-01-02': {'grammar_check': 1}}
+        assert store.get_usage('ghost') is None
+
+
+STRESS_PROCESSES = 16
+STRESS_APPENDS = 200
+
+
+def _stress_worker(db_path, worker_id, ready):
+    store = UserStore(db_path)
+    ready.wait()
+    store.create_user('racer', f'hash-{worker_id}')  # Only one process may win
+    writer = HistoryWriter(store, flush_interval_ms=5, max_batch=20)
+    for i in range(STRESS_APPENDS):
+        if i % 2:
+            store.add_history('shared', 'tts_google', {'worker': worker_id, 'i': i})
+        else:
+            writer.enqueue('shared', 'grammar_check', {'worker': worker_id, 'i': i})
+    writer.close()
+
+
+def test_concurrent_processes_lose_no_history():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'users.db')
+        UserStore(db_path).create_user('shared', 'hash')
+
+        ctx = multiprocessing.get_context('spawn')
+        ready = ctx.Event()
+        workers = [ctx.Process(target=_stress_worker, args=(db_path, i, ready)) for i in range(STRESS_PROCESSES)]
+        for worker in workers:
+            worker.start()
+        ready.set()
+        for worker in workers:
+            worker.join(120)
+            assert worker.exitcode == 0
+
+        store = UserStore(db_path)
+        expected = STRESS_PROCESSES * STRESS_APPENDS
+        assert store.history_count('shared') == expected
+        assert store.get_usage('shared')['total'] == expected
+        assert store.history_rev('shared') > 0
+        seen = {(entry['details']['worker'], entry['details']['i']) for entry in store.get_history('shared')}
+        assert len(seen) == expected
+        assert store.history_count('racer') == 0 and store.get_user('racer') is not None
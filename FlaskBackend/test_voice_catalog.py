@@ -0,0 +1,111 @@
+"""
+Tests for the cached, indexed voice catalog.
+
+Run with: python -m pytest test_voice_catalog.py
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+from voice_catalog import Catalog, VoiceCatalog, voice_entry
+
+VOICES = [
+    voice_entry('en-US-Standard-D', ['en-US'], 'MALE'),
+    voice_entry('en-US-Wavenet-F', ['en-US'], 'FEMALE'),
+    voice_entry('en-GB-Standard-A', ['en-GB'], 'FEMALE'),
+    voice_entry('fr-FR-Wavenet-C', ['fr-FR'], 'FEMALE'),
+    voice_entry('fr-FR-Standard-B', ['fr-FR'], 'MALE'),
+    voice_entry('fr-CA-Standard-A', ['fr-CA'], 'FEMALE'),
+]
+
+
+def ids(voices):
+    return [voice['id'] for voice in voices]
+
+
+def test_queries_use_the_index():
+    catalog = Catalog(VOICES, time.time())
+    assert VOICES[2] == {'id': 'en-GB-Standard-A', 'name': 'A', 'accent': 'British',
+                         'gender': 'Female', 'language': 'en-GB'}
+    assert ids(catalog.query(language='fr-FR', gender='female')) == ['fr-FR-Wavenet-C']
+    assert ids(catalog.query(language='fr')) == ['fr-CA-Standard-A', 'fr-FR-Standard-B', 'fr-FR-Wavenet-C']
+    assert ids(catalog.query(language='EN', accent='american')) == ['en-US-Standard-D', 'en-US-Wavenet-F']
+    assert catalog.query(language='de') == [] and len(catalog.query()) == len(VOICES)
+    # Same voices, any order: same version
+    assert Catalog(VOICES[::-1], 0).etag == catalog.etag != Catalog(VOICES[:-1], 0).etag
+
+
+def test_ssml_voices_come_from_the_catalog():
+    catalog = Catalog(VOICES, time.time())
+    preferred = {'en-US': 'en-US-Standard-C', 'fr-FR': 'fr-FR-Wavenet-C', 'de-DE': 'de-DE-Standard-A'}
+    # A preferred voice upstream lacks is replaced by a Standard one; a language with none is left out
+    assert catalog.ssml_voices(['en-US', 'fr-FR', 'de-DE'], preferred) == {
+        'en-US': 'en-US-Standard-D', 'fr-FR': 'fr-FR-Wavenet-C'}
+
+
+class FakeFetch:
+    def __init__(self):
+        self.calls = 0
+        self.fail = False
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self):
+        self.release.wait(5)
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError('list_voices failed')
+        return VOICES[:self.calls + 2]
+
+
+def wait_for(condition):
+    deadline = time.time() + 5
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+def test_stale_catalog_is_served_while_refreshing():
+    fetch = FakeFetch()
+    voice_catalog = VoiceCatalog(fetch, ttl=60, retry_interval=60)
+    first = voice_catalog.get()
+    assert fetch.calls == 1 and voice_catalog.get() is first
+
+    # Expired: the old catalog answers at once, the new one arrives in the background
+    first.fetched_at -= 120
+    fetch.release.clear()
+    assert voice_catalog.get() is first and voice_catalog.get() is first
+    fetch.release.set()
+    wait_for(lambda: voice_catalog.peek() is not first)
+    assert fetch.calls == 2 and len(voice_catalog.get().voices) == 4
+
+    # A failed refresh keeps the old catalog and waits retry_interval before trying again
+    fetch.fail = True
+    second = voice_catalog.peek()
+    second.fetched_at -= 120
+    voice_catalog.get()
+    wait_for(lambda: voice_catalog.stats()['failed_refreshes'] == 1)
+    assert voice_catalog.get() is second
+    time.sleep(0.05)
+    assert fetch.calls == 3
+
+
+def test_snapshot_serves_a_cold_start():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'voices.json')
+        warm = VoiceCatalog(FakeFetch(), snapshot_path=path)
+        etag = warm.get().etag
+
+        fetch = FakeFetch()
+        cold = VoiceCatalog(fetch, snapshot_path=path)
+        assert cold.get().etag == etag and fetch.calls == 0
+        assert not [name for name in os.listdir(tmp) if name.startswith('.tmp-')]
+
+
+if __name__ == "__main__":
+    test_queries_use_the_index()
+    test_ssml_voices_come_from_the_catalog()
+    test_stale_catalog_is_served_while_refreshing()
+    test_snapshot_serves_a_cold_start()
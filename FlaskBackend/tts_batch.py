@@ -0,0 +1,133 @@
+"""
+Many TTS clips in one response, for /api/tts/batch.
+
+A request lists items ({text, voiceId, speed}); identical items are one clip,
+so a worksheet that repeats a word synthesizes it once. Each clip is written
+into the response as soon as it and the ones before it are done, either as a
+ZIP archive or as multipart/mixed, followed by manifest.json mapping every
+item to its file or its error. A bad or failed item does not fail the batch.
+
+ZIP entries are stored, not deflated: MP3 and Opus do not compress further.
+The archive is written without seeking (sizes follow each entry in a data
+descriptor), so it can be streamed.
+"""
+
+import json
+import uuid
+import zipfile
+
+ZIP = 'application/zip'
+MULTIPART = 'multipart/mixed'
+PACKAGINGS = (ZIP, MULTIPART)
+
+
+def speech_settings(item, default_voice, default_speed):
+    """(text, voice, speed) for an item, or raises ValueError saying what is wrong with it."""
+    if not isinstance(item, dict):
+        raise ValueError('Item must be an object')
+    text = item.get('text')
+    if not isinstance(text, str) or not text.strip():
+        raise ValueError('Text is required')
+    voice = item.get('voiceId') or default_voice
+    if not isinstance(voice, str) or len(voice.split('-')) < 2:
+        raise ValueError('Invalid voice ID format')
+    try:
+        speed = float(item.get('speed', default_speed))
+    except (TypeError, ValueError):
+        raise ValueError('Speed must be a valid number')
+    if speed < 0.25 or speed > 4.0:
+        raise ValueError('Speed must be between 0.25 and 4.0')
+    return text.strip(), voice, speed
+
+
+def plan(items, default_voice, default_speed):
+    """
+    (clips, entries): the distinct (text, voice, speed) clips to synthesize,
+    and a manifest entry per item, with 'clip' indexing into clips or an
+    'error' saying why the item was rejected.
+    """
+    clips, positions, entries = [], {}, []
+    for index, item in enumerate(items):
+        entry = {'index': index, 'clip': None, 'file': None, 'error': None, 'cached': False}
+        try:
+            settings = speech_settings(item, default_voice, default_speed)
+        except ValueError as e:
+            entry['error'] = str(e)
+        else:
+            entry.update(text=settings[0], voiceId=settings[1], speed=settings[2])
+            if settings not in positions:
+                positions[settings] = len(clips)
+                clips.append(settings)
+            entry['clip'] = positions[settings]
+        entries.append(entry)
+    return clips, entries
+
+
+def clip_name(clip, extension):
+    return f"{clip + 1:03d}.{extension}"
+
+
+def _record(entries, clip, name, error, cached):
+    for entry in entries:
+        if entry['clip'] == clip:
+            entry.update(file=name if error is None else None, error=error, cached=cached)
+
+
+def manifest(entries):
+    return json.dumps({'items': entries}, ensure_ascii=False).encode('utf-8')
+
+
+class _Sink:
+    """Write-only file for zipfile that hands over what has been written so far."""
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_zip(results, entries, extension):
+    """
+    Yield a ZIP archive of the clips, given `results` as (audio, error message,
+    cached) per clip in order, then manifest.json.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+        for clip, (audio, error, cached) in enumerate(results):
+            name = clip_name(clip, extension)
+            _record(entries, clip, name, error, cached)
+            if error is None:
+                archive.writestr(name, audio)
+                yield sink.drain()
+        archive.writestr('manifest.json', manifest(entries))
+    yield sink.drain()
+
+
+def multipart_boundary():
+    return f"tts-batch-{uuid.uuid4().hex}"
+
+
+def _part(boundary, content_type, name, body):
+    headers = (f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+               f"Content-Disposition: attachment; filename=\"{name}\"\r\n\r\n")
+    return headers.encode('ascii') + body + b'\r\n'
+
+
+def iter_multipart(results, entries, extension, mimetype, boundary):
+    """As iter_zip(), as the parts of a multipart/mixed body with `boundary`."""
+    for clip, (audio, error, cached) in enumerate(results):
+        name = clip_name(clip, extension)
+        _record(entries, clip, name, error, cached)
+        if error is None:
+            yield _part(boundary, mimetype, name, audio)
+    yield _part(boundary, 'application/json', 'manifest.json', manifest(entries))
+    yield f"--{boundary}--\r\n".encode('ascii')
@@ -0,0 +1,242 @@
+"""
+Content-addressed on-disk cache for synthesized audio.
+
+Entries are keyed by a SHA-256 of everything that affects the audio (the
+whitespace-normalized text, voice, language, speaking rate and encoding) and
+stored as one file per entry under a directory sharded by the first two hex
+digits of the key:
+
+    <root>/3f/3fa9...c2.mp3
+
+Writes go to a temporary file in the same shard and are renamed into place,
+so any number of workers can share one directory and readers never see a
+partial file. A hit touches the file's mtime; when the cache grows past
+`max_bytes`, the least recently used files are deleted until it is back under
+`EVICT_TO` of the budget.
+
+The cache's total size is shared by every worker: it is kept in
+<root>/.evict.lock and updated under that file's flock after each write, so
+the budget holds for the directory rather than per process. Eviction runs
+under the same lock, and the total is re-counted from a scan when the file
+is missing or unreadable, and at least every `RESCAN_SECONDS` (correcting
+drift from a worker that died between a write and its update).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process eviction lock
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Eviction stops once the cache is back under this fraction of max_bytes
+EVICT_TO = 0.9
+# Leftovers from writers that died between write and rename
+STALE_TEMP_SECONDS = 3600
+# The shared size total is re-counted from the files at least this often
+RESCAN_SECONDS = 600
+LOCK_NAME = '.evict.lock'
+
+EXTENSIONS = {'MP3': 'mp3', 'OGG_OPUS': 'ogg', 'LINEAR16': 'wav', 'MULAW': 'wav', 'ALAW': 'wav'}
+
+
+def normalize_text(text):
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def cache_key(text, voice, language, speaking_rate, encoding, **extra):
+    """Hex digest identifying one synthesis; `extra` holds any other output-affecting settings."""
+    fields = {
+        'text': normalize_text(text),
+        'voice': voice,
+        'language': language,
+        'speaking_rate': round(float(speaking_rate), 3),
+        'encoding': encoding,
+    }
+    fields.update(extra)
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class TTSCache:
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._approx_bytes = None  # The shared total as this process last saw it
+        self._hits = 0
+        self._misses = 0
+        self._bypassed = 0
+        self._writes = 0
+        self._write_errors = 0
+        self._evictions = 0
+        self._bytes_evicted = 0
+
+    def path(self, key, encoding='MP3'):
+        return os.path.join(self.root, key[:2], f"{key}.{EXTENSIONS.get(encoding, 'bin')}")
+
+    def get(self, key, encoding='MP3', count=True):
+        """Cached audio bytes, or None on a miss; count=False leaves the hit/miss counters alone."""
+        path = self.path(key, encoding)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            # Like put(), a cache that cannot be read must never fail the request
+            if not isinstance(e, FileNotFoundError):
+                logger.error(f"Failed to read TTS cache entry {key}: {str(e)}")
+            if count:
+                with self._lock:
+                    self._misses += 1
+            return None
+        try:
+            os.utime(path)  # Recently used: last in line for eviction
+        except OSError:
+            pass  # Evicted by another worker since the read; the audio is still good
+        if count:
+            with self._lock:
+                self._hits += 1
+        return data
+
+    def record_bypass(self):
+        with self._lock:
+            self._bypassed += 1
+
+    def put(self, key, data, encoding='MP3'):
+        path = self.path(key, encoding)
+        shard = os.path.dirname(path)
+        try:
+            replaced = os.stat(path).st_size
+        except OSError:
+            replaced = 0
+        try:
+            os.makedirs(shard, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=shard, prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            # A cache that cannot be written must never fail the request
+            logger.error(f"Failed to write TTS cache entry {key}: {str(e)}")
+            with self._lock:
+                self._write_errors += 1
+            return
+        with self._lock:
+            self._writes += 1
+        try:
+            self._add_bytes(len(data) - replaced)
+        except OSError as e:
+            logger.error(f"Failed to update the TTS cache size: {str(e)}")
+
+    @contextmanager
+    def _shared_total(self):
+        # Every worker's writes and evictions serialize on this flock; closing the file releases it
+        with open(os.path.join(self.root, LOCK_NAME), 'a+') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            lock_file.seek(0)
+            try:
+                total, scanned_at = lock_file.read().split()
+                state = [int(total), float(scanned_at)]
+            except ValueError:
+                state = [None, None]
+            yield state
+            lock_file.seek(0)
+            lock_file.truncate()
+            lock_file.write(f"{state[0]} {state[1]}")
+
+    def _add_bytes(self, delta):
+        with self._shared_total() as state:
+            total, scanned_at = state
+            if total is None or time.time() - scanned_at > RESCAN_SECONDS:
+                # The scan already counts this write
+                self._evict_locked(state)
+                return
+            state[0] = total + delta
+            if state[0] > self.max_bytes:
+                self._evict_locked(state)
+            else:
+                with self._lock:
+                    self._approx_bytes = state[0]
+
+    def _scan(self):
+        entries, total = [], 0
+        now = time.time()
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # Evicted or renamed by another worker meanwhile
+                    continue
+                if entry.name.startswith('.tmp-'):
+                    if now - stat.st_mtime > STALE_TEMP_SECONDS:
+                        self._remove(entry.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        return entries, total
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def evict(self):
+        """Re-count the cache and delete least recently used entries until it fits its budget."""
+        with self._shared_total() as state:
+            self._evict_locked(state)
+
+    def _evict_locked(self, state):
+        # Called holding the shared total's lock; leaves the scanned total in `state`
+        entries, total = self._scan()
+        evicted = evicted_bytes = 0
+        if total > self.max_bytes:
+            target = self.max_bytes * EVICT_TO
+            entries.sort()
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                if self._remove(path):
+                    evicted += 1
+                    evicted_bytes += size
+                total -= size
+            logger.info(f"Evicted {evicted} TTS cache entries ({evicted_bytes} bytes)")
+        state[:] = [total, time.time()]
+        with self._lock:
+            self._approx_bytes = total
+            self._evictions += evicted
+            self._bytes_evicted += evicted_bytes
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': round(self._hits / lookups, 3) if lookups else None,
+                'bypassed': self._bypassed,
+                'writes': self._writes,
+                'write_errors': self._write_errors,
+                'evictions': self._evictions,
+                'bytes_evicted': self._bytes_evicted,
+                'approx_bytes': self._approx_bytes,
+                'max_bytes': self.max_bytes
+            }
@@ -0,0 +1,479 @@
+"""
+Concurrent synthesis of text-to-speech segments.
+
+A multi-language request is split into one segment per language run, and
+each segment is a separate upstream round trip. `synthesize_segments()` runs
+them on a process-wide bounded thread pool (the Google clients are
+thread-safe) with at most `max_concurrency` in flight per request, and
+returns the results in segment order, so a request takes about as long as
+its slowest segment rather than the sum of all of them. The iter_*()
+variants yield each result as soon as everything before it is done, so a
+response can start streaming after the first segment.
+
+The pool is created on first use and dropped in forked children, whose
+copy would have no worker threads.
+
+`synthesize_multilingual()` can instead render each mixed-language sentence
+into one SSML document, one `<voice>` per language run, and make a single
+call for it. It falls
+back to per-segment calls when a language has no SSML voice configured, the
+document is over the upstream size limit, or upstream rejects it.
+
+Text is synthesized sentence by sentence (`split_sentences()`, NLTK punkt
+when available, with sentences over the upstream byte limit cut at clause
+breaks), and with a tts_cache.TTSCache every sentence, segment or
+SSML document already synthesized is read from disk and only the rest go
+upstream, so editing one sentence of a long passage costs one sentence of
+synthesis. Every piece is a complete audio file in the requested encoding;
+audio_formats.stitch() joins them into one.
+"""
+
+import logging
+import os
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from xml.sax.saxutils import escape, quoteattr
+
+from audio_formats import MP3
+from process_hooks import after_fork_in_child
+from tts_cache import cache_key
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = int(os.environ.get('TTS_POOL_SIZE', '16'))
+
+SEGMENTS = 'segments'
+SSML = 'ssml'
+RENDER_MODES = (SEGMENTS, SSML)
+
+# Segmenter language -> Google Cloud TTS language code
+LANGUAGE_CODES = {
+    'en': 'en-US',
+    'fr': 'fr-FR',
+    'es': 'es-ES',
+    'de': 'de-DE',
+    'it': 'it-IT',
+    'pt': 'pt-BR'
+}
+DEFAULT_LANGUAGE_CODE = 'en-US'
+
+# Voice used for each language inside an SSML document. <voice> needs a concrete
+# voice name; a language without one here is synthesized per segment instead.
+SSML_VOICES = {
+    'en-US': 'en-US-Standard-C',
+    'fr-FR': 'fr-FR-Standard-A',
+    'es-ES': 'es-ES-Standard-A',
+    'de-DE': 'de-DE-Standard-A',
+    'it-IT': 'it-IT-Standard-A',
+    'pt-BR': 'pt-BR-Standard-A'
+}
+
+# Punkt model used to split sentences for each segmenter language
+PUNKT_LANGUAGES = {
+    'en': 'english',
+    'fr': 'french',
+    'es': 'spanish',
+    'de': 'german',
+    'it': 'italian',
+    'pt': 'portuguese'
+}
+# Without NLTK data: break on whitespace after ., !, ? or ..., optionally closed by a quote or bracket
+SENTENCE_BREAK = re.compile(r'(?<=[.!?\u2026])\s+|(?<=[.!?\u2026]["\'\u201d\u2019)\]])\s+')
+
+# Upstream rejects inputs (text, or SSML including markup) over this many bytes
+MAX_INPUT_BYTES = 5000
+# Where an over-long sentence is split, in order of preference: after a clause, then at any space
+INPUT_BREAKS = [re.compile(r'(?<=[,;:\u2014])\s+'), re.compile(r'\s+')]
+
+class SegmentPool:
+    """A ThreadPoolExecutor built on first use, and dropped in forked children."""
+    def __init__(self, size=POOL_SIZE):
+        self.size = size
+        self.reset()
+        after_fork_in_child(self.reset)
+
+    def reset(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='tts-segment')
+        return self._executor
+
+
+_pool = SegmentPool()
+
+
+def get_pool():
+    return _pool.get()
+
+
+def iter_segments(synthesize, segments, max_concurrency=4):
+    """
+    Call `synthesize(segment)` for every segment, at most `max_concurrency` at a
+    time, and yield (result, error) in segment order, each as soon as it and
+    all segments before it are done. Exactly one of the two is None for each
+    segment, so callers decide what a partial failure means.
+    """
+    outcomes = [None] * len(segments)
+
+    def run(index):
+        try:
+            outcomes[index] = (synthesize(segments[index]), None)
+        except Exception as e:
+            outcomes[index] = (None, e)
+
+    if len(segments) <= 1 or max_concurrency <= 1:
+        for index in range(len(segments)):
+            run(index)
+            yield outcomes[index]
+        return
+
+    pool = get_pool()
+    futures, pending = [], set()
+    ready = 0
+    for index in range(len(segments)):
+        if len(pending) >= max_concurrency:
+            _, pending = wait(pending, return_when=FIRST_COMPLETED)
+            while ready < len(futures) and futures[ready].done():
+                yield outcomes[ready]
+                ready += 1
+        futures.append(pool.submit(run, index))
+        pending.add(futures[-1])
+    for index in range(ready, len(segments)):
+        futures[index].result()
+        yield outcomes[index]
+
+
+def synthesize_segments(synthesize, segments, max_concurrency=4):
+    """iter_segments() collected into a list: [(result, error)] in segment order."""
+    return list(iter_segments(synthesize, segments, max_concurrency))
+
+
+def split_sentences(text, nltk=None, lang='en', max_bytes=MAX_INPUT_BYTES):
+    """
+    Sentences of `text`, split with NLTK punkt if given, else on end-of-sentence
+    punctuation. A sentence over `max_bytes` (UTF-8) is cut further by
+    fit_input(), so every piece can be sent upstream as is.
+    """
+    if nltk is not None:
+        try:
+            sentences = nltk.sent_tokenize(text, language=PUNKT_LANGUAGES.get(lang, 'english'))
+            return [piece for sentence in sentences for piece in fit_input(sentence, max_bytes)]
+        except LookupError as e:
+            logger.warning(f"Punkt model unavailable, splitting sentences on punctuation: {str(e)}")
+    sentences = []
+    for piece in SENTENCE_BREAK.split(text.strip()):
+        # '"Really?" she asked.' is one sentence: a lowercase start continues the last one
+        if sentences and piece[:1].islower():
+            sentences[-1] += ' ' + piece
+        elif piece:
+            sentences.append(piece)
+    return [piece for sentence in sentences for piece in fit_input(sentence, max_bytes)]
+
+
+def fit_input(text, max_bytes=MAX_INPUT_BYTES, level=0):
+    """
+    `text` in consecutive pieces of at most `max_bytes` UTF-8 bytes, packed as
+    full as possible and broken at INPUT_BREAKS (clauses first), or between
+    characters when a run has no break at all.
+    """
+    if len(text.encode('utf-8')) <= max_bytes:
+        return [text]
+    if level == len(INPUT_BREAKS):
+        pieces = []
+        while text:
+            piece = text.encode('utf-8')[:max_bytes].decode('utf-8', 'ignore')
+            pieces.append(piece)
+            text = text[len(piece):]
+        return pieces
+
+    pieces, current = [], ''
+    for part in INPUT_BREAKS[level].split(text):
+        candidate = f'{current} {part}' if current else part
+        if len(candidate.encode('utf-8')) <= max_bytes:
+            current = candidate
+            continue
+        if current:
+            pieces.append(current)
+        *full, current = fit_input(part, max_bytes, level + 1)
+        pieces.extend(full)
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def iter_cached(synthesize, jobs, max_concurrency=4, cache=None, bypass_cache=False, flights=None, encoding=MP3):
+    """
+    Call `synthesize(payload)` for each (key, payload) job whose audio is not in
+    the cache, concurrently as in iter_segments(), and store fresh audio under
+    its key (as `encoding` audio). Yields (audio, error, cached) in job order.
+
+    With a singleflight.SingleFlight, a job whose key is already being
+    synthesized (by this request or another) waits for that call instead.
+    """
+    def fetch(index):
+        key, payload = jobs[index]
+
+        def call():
+            # The job may have queued behind an identical one that has landed since the lookup
+            audio = cache.get(key, encoding, count=False) if cache is not None and not bypass_cache else None
+            if audio is not None:
+                return audio
+            audio = synthesize(payload)
+            # Stored before the flight lands, so later lookups hit instead of calling again
+            if cache is not None:
+                cache.put(key, audio, encoding)
+            return audio
+        return flights.do(key, call) if flights is not None else call()
+
+    hits = [_cache_get(cache, key, bypass_cache, encoding) for key, _ in jobs]
+    misses = [index for index, audio in enumerate(hits) if audio is None]
+    fresh = iter_segments(fetch, misses, max_concurrency)
+    for audio in hits:
+        if audio is not None:
+            yield audio, None, True
+        else:
+            yield next(fresh) + (False,)
+
+
+def synthesize_cached(synthesize, jobs, max_concurrency=4, cache=None, bypass_cache=False, flights=None, encoding=MP3):
+    """iter_cached() collected into a list: [(audio, error, cached)] in job order."""
+    return list(iter_cached(synthesize, jobs, max_concurrency, cache, bypass_cache, flights, encoding))
+
+
+def language_code(lang):
+    return LANGUAGE_CODES.get(lang, DEFAULT_LANGUAGE_CODE)
+
+
+def voice_language_code(voice_name):
+    return '-'.join(voice_name.split('-')[:2])
+
+
+def audio_config(speaking_rate=None, encoding=MP3, sample_rate=None):
+    from google.cloud import texttospeech
+    settings = {'audio_encoding': texttospeech.AudioEncoding[encoding]}
+    if speaking_rate is not None:
+        settings['speaking_rate'] = speaking_rate
+    if sample_rate is not None:
+        settings['sample_rate_hertz'] = sample_rate
+    return texttospeech.AudioConfig(**settings)
+
+
+def output_settings(sample_rate):
+    """Extra cache_key() fields for the output format; none at the default rate, keeping the original keys."""
+    return {'sample_rate': sample_rate} if sample_rate is not None else {}
+
+
+def synthesize_segment(client, lang, text, encoding=MP3, sample_rate=None):
+    """One upstream call for a single-language segment; returns the audio file's bytes."""
+    from google.cloud import texttospeech
+    code = language_code(lang)
+    logger.info(f"Calling Google TTS API for segment in language {code}: '{text[:50]}...'")
+    response = client.synthesize_speech(
+        input=texttospeech.SynthesisInput(text=text),
+        voice=texttospeech.VoiceSelectionParams(
+            language_code=code,
+            ssml_gender=texttospeech.SsmlVoiceGender.NEUTRAL
+        ),
+        audio_config=audio_config(encoding=encoding, sample_rate=sample_rate)
+    )
+    return response.audio_content
+
+
+def render_ssml(lang_groups, voices=SSML_VOICES):
+    """
+    One <speak> document voicing each (lang, text) group with its language's
+    voice, or None if some language has no voice in `voices`.
+    """
+    parts = []
+    for lang, text in lang_groups:
+        code = language_code(lang)
+        voice = voices.get(code)
+        if voice is None:
+            return None
+        parts.append(f'<voice name={quoteattr(voice)}><lang xml:lang={quoteattr(code)}>'
+                     f'{escape(text)}</lang></voice>')
+    return '<speak>' + ' '.join(parts) + '</speak>'
+
+
+def synthesize_ssml(client, ssml, voice_name, encoding=MP3, sample_rate=None):
+    from google.cloud import texttospeech
+    logger.info(f"Calling Google TTS API with one SSML document ({len(ssml)} chars)")
+    response = client.synthesize_speech(
+        input=texttospeech.SynthesisInput(ssml=ssml),
+        voice=texttospeech.VoiceSelectionParams(
+            language_code=voice_language_code(voice_name),
+            name=voice_name
+        ),
+        audio_config=audio_config(encoding=encoding, sample_rate=sample_rate)
+    )
+    return response.audio_content
+
+
+def synthesize_voice(client, text, voice_name, speaking_rate, encoding=MP3, sample_rate=None):
+    """One upstream call for plain text in a named voice; returns the audio file's bytes."""
+    from google.cloud import texttospeech
+    logger.info(f"Calling Google TTS API with voice {voice_name}: '{text[:50]}...'")
+    response = client.synthesize_speech(
+        input=texttospeech.SynthesisInput(text=text),
+        voice=texttospeech.VoiceSelectionParams(
+            language_code=voice_language_code(voice_name),
+            name=voice_name
+        ),
+        audio_config=audio_config(speaking_rate, encoding, sample_rate)
+    )
+    return response.audio_content
+
+
+def segment_cache_key(lang, text, encoding=MP3, sample_rate=None):
+    return cache_key(text, 'NEUTRAL', language_code(lang), 1.0, encoding, **output_settings(sample_rate))
+
+
+def synthesize_sentences(client, sentences, voice_name, speaking_rate=1.0, max_concurrency=4,
+                         cache=None, bypass_cache=False, flights=None, encoding=MP3, sample_rate=None):
+    """
+    Synthesize each sentence in one voice. Returns (results, info): results are
+    [(audio, error)] in sentence order; info has the upstream 'calls' and the
+    'sentences' / 'sentence_cache_hits' counts ('cache_hits' is the same here).
+    """
+    jobs = [sentence_job(sentence, voice_name, speaking_rate, encoding, sample_rate) for sentence in sentences]
+    results = synthesize_cached(
+        lambda payload: synthesize_voice(client, *payload, encoding, sample_rate),
+        jobs, max_concurrency, cache, bypass_cache, flights, encoding)
+    hits = sum(cached for _, _, cached in results)
+    info = {'calls': len(jobs) - hits, 'cache_hits': hits, 'sentences': len(jobs), 'sentence_cache_hits': hits}
+    return [(audio, error) for audio, error, _ in results], info
+
+
+def sentence_job(sentence, voice_name, speaking_rate, encoding=MP3, sample_rate=None):
+    """A cacheable (key, payload) job for one sentence in a named voice."""
+    key = cache_key(sentence, voice_name, voice_language_code(voice_name), speaking_rate, encoding,
+                    **output_settings(sample_rate))
+    return key, (sentence, voice_name, speaking_rate)
+
+
+def iter_clips(client, clips, max_concurrency=4, cache=None, bypass_cache=False, flights=None,
+               encoding=MP3, sample_rate=None):
+    """
+    Synthesize many clips, each given as (sentences, voice_name, speaking_rate),
+    as one stream of sentence jobs, so up to max_concurrency calls stay in
+    flight across clips rather than within one. Yields (audios, error, calls)
+    per clip in order as soon as its sentences are done: the sentences' audio,
+    or None and the first sentence error.
+    """
+    jobs = [sentence_job(sentence, voice_name, speaking_rate, encoding, sample_rate)
+            for sentences, voice_name, speaking_rate in clips for sentence in sentences]
+    outcomes = iter_cached(lambda payload: synthesize_voice(client, *payload, encoding, sample_rate),
+                           jobs, max_concurrency, cache, bypass_cache, flights, encoding)
+    for sentences, _, _ in clips:
+        audios, error, calls = [], None, 0
+        for _ in sentences:
+            audio, sentence_error, cached = next(outcomes)
+            audios.append(audio)
+            error = error or sentence_error
+            calls += not cached
+        yield (None if error else audios), error, calls
+
+
+def ssml_job(lang_groups, voices, encoding=MP3, sample_rate=None):
+    """A cacheable (key, payload) job voicing all groups in one SSML call, or None if SSML cannot be used."""
+    ssml = render_ssml(lang_groups, voices)
+    if ssml is None:
+        logger.info("No SSML voice for one of the languages; synthesizing per segment")
+        return None
+    if len(ssml.encode('utf-8')) > MAX_INPUT_BYTES:
+        logger.info(f"SSML document over {MAX_INPUT_BYTES} bytes; synthesizing per segment")
+        return None
+    code = language_code(lang_groups[0][0])
+    voice = voices[code]
+    key = cache_key(ssml, voice, code, 1.0, encoding, ssml=True, **output_settings(sample_rate))
+    return key, (SSML, ssml, voice)
+
+
+def iter_multilingual(client, sentences, mode=SEGMENTS, max_concurrency=4, voices=SSML_VOICES,
+                      cache=None, bypass_cache=False, info=None, flights=None, encoding=MP3, sample_rate=None):
+    """
+    Synthesize sentences, each given as its [(lang, text)] groups, and yield
+    (lang, text, audio, error) parts in order as they become available, with
+    exactly one of audio/error set; a sentence voiced by one SSML call yields a
+    single (SSML, text, ...) part. Each audio is a complete `encoding` file
+    (audio_formats.stitch() joins them).
+
+    If `info` is a dict, it is filled in as parts are produced (final once the
+    generator is exhausted) with the 'mode' actually used, the number of
+    upstream 'calls', of 'cache_hits' among the parts, of 'sentences' and of
+    'sentence_cache_hits' (sentences served entirely from the cache).
+
+    With a TTSCache, audio already on disk is reused and only misses go
+    upstream; bypass_cache skips the lookups but still stores fresh results.
+    Given a SingleFlight, segments already being synthesized are joined.
+    """
+    from google.api_core import exceptions
+
+    if info is None:
+        info = {}
+    info.update({'mode': SEGMENTS, 'calls': 0, 'cache_hits': 0,
+                 'sentences': len(sentences), 'sentence_cache_hits': 0})
+
+    # One job per SSML sentence or per segment; owners[i] = (sentence, lang, text, groups voiced by SSML)
+    jobs, owners = [], []
+    for index, lang_groups in enumerate(sentences):
+        job = ssml_job(lang_groups, voices, encoding, sample_rate) if mode == SSML and len(lang_groups) > 1 else None
+        if job is not None:
+            jobs.append(job)
+            owners.append((index, SSML, ' '.join(text for _, text in lang_groups), lang_groups))
+            continue
+        for lang, text in lang_groups:
+            jobs.append((segment_cache_key(lang, text, encoding, sample_rate), (lang, text, None)))
+            owners.append((index, lang, text, None))
+
+    def synthesize(payload):
+        lang, text, voice = payload
+        if lang == SSML:
+            return synthesize_ssml(client, text, voice, encoding, sample_rate)
+        return synthesize_segment(client, lang, text, encoding, sample_rate)
+
+    sentence_hits = [True] * len(sentences)
+    outcomes = iter_cached(synthesize, jobs, max_concurrency, cache, bypass_cache, flights, encoding)
+    for i, (audio, error, cached) in enumerate(outcomes):
+        index, lang, text, ssml_groups = owners[i]
+        info['calls'] += not cached
+        pieces = [(lang, text, audio, error, cached)]
+        if ssml_groups is not None and isinstance(error, exceptions.InvalidArgument):
+            # e.g. a configured voice that does not support <voice>/<lang> switching
+            logger.warning(f"SSML request rejected, synthesizing per segment: {str(error)}")
+            retry_jobs = [(segment_cache_key(lang, text, encoding, sample_rate), (lang, text, None))
+                          for lang, text in ssml_groups]
+            retried = iter_cached(synthesize, retry_jobs, max_concurrency, cache, bypass_cache, flights, encoding)
+            pieces = [group + outcome for group, outcome in zip(ssml_groups, retried)]
+            info['calls'] += sum(not cached for *_, cached in pieces)
+        for lang, text, audio, error, cached in pieces:
+            info['cache_hits'] += cached
+            if lang == SSML and error is None:
+                info['mode'] = SSML
+            sentence_hits[index] = sentence_hits[index] and cached
+            yield lang, text, audio, error
+    info['sentence_cache_hits'] = sum(sentence_hits)
+
+
+def synthesize_multilingual(client, sentences, mode=SEGMENTS, max_concurrency=4, voices=SSML_VOICES,
+                            cache=None, bypass_cache=False, flights=None, encoding=MP3, sample_rate=None):
+    """iter_multilingual() collected: (parts, info) with parts [(lang, text, audio, error)] in order."""
+    info = {}
+    parts = list(iter_multilingual(client, sentences, mode, max_concurrency, voices, cache, bypass_cache, info,
+                                   flights, encoding, sample_rate))
+    return parts, info
+
+
+def _cache_get(cache, key, bypass_cache, encoding=MP3):
+    if cache is None:
+        return None
+    if bypass_cache:
+        cache.record_bypass()
+        return None
+    return cache.get(key, encoding)
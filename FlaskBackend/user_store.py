@@ -0,0 +1,476 @@
+"""
+SQLite-backed store for user accounts and feature-usage history.
+
+Replaces the old whole-file users.json read-modify-write: users and history
+live in an indexed SQLite database in WAL mode, so recording a history entry
+is a single INSERT instead of re-serializing every user on every request.
+
+Every write runs in a `BEGIN IMMEDIATE` transaction and connections are
+per-thread and per-process, so any number of threads and gunicorn workers can
+share one database file. Lock contention that outlasts SQLite's busy timeout
+is retried with jittered backoff rather than surfacing as an error.
+
+Run `python user_store.py migrate` to import an existing users.json once.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password_hash TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    history_rev INTEGER NOT NULL DEFAULT 0,
+    usage_total INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL REFERENCES users(username) ON DELETE CASCADE,
+    timestamp TEXT NOT NULL,
+    feature TEXT NOT NULL,
+    details TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_history_user_time ON history(username, timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_history_time ON history(timestamp);
+CREATE TABLE IF NOT EXISTS usage_features (
+    username TEXT NOT NULL REFERENCES users(username) ON DELETE CASCADE,
+    feature TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (username, feature)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS usage_daily (
+    username TEXT NOT NULL REFERENCES users(username) ON DELETE CASCADE,
+    day TEXT NOT NULL,
+    feature TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (username, day, feature)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+BUSY_TIMEOUT_SECONDS = 5
+BUSY_RETRIES = 8
+
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+
+def utc_timestamp():
+    # Fixed width (microseconds always present) so timestamps sort and compare as strings
+    return datetime.datetime.utcnow().strftime(TIMESTAMP_FORMAT)
+
+
+def normalize_timestamp(value):
+    """Any ISO 8601 date/datetime, rendered in the stored UTC format. Raises ValueError."""
+    parsed = datetime.datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed.strftime(TIMESTAMP_FORMAT)
+
+
+class UserStore:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        # Several workers may start against a fresh file at once, so schema
+        # setup runs statement by statement inside one write transaction.
+        with self._transaction() as conn:
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    conn.execute(statement)
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(users)')}
+            for column in ('history_rev', 'usage_total'):  # Databases created before these existed
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE users ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0')
+        self._backfill_usage()
+        self._normalize_timestamps()
+
+    def _connect(self):
+        # One connection per thread (and per process: a connection inherited
+        # across fork() must never be reused by the child).
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            # Switching a fresh database to WAL needs an exclusive lock
+            _retry_busy(lambda: conn.execute('PRAGMA journal_mode=WAL'))
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        # Take the write lock up front so the transaction can never fail
+        # half-way with SQLITE_BUSY; waiting for it is retried with backoff.
+        _retry_busy(lambda: conn.execute('BEGIN IMMEDIATE'))
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+
+    # --- Users ---
+
+    def get_user(self, username):
+        row = self._connect().execute(
+            'SELECT username, password_hash, created_at, history_rev, usage_total '
+            'FROM users WHERE username = ?',
+            (username,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def create_user(self, username, password_hash):
+        """Create a user. Returns False if the username is already taken."""
+        try:
+            with self._transaction() as conn:
+                conn.execute(
+                    'INSERT INTO users (username, password_hash, created_at) VALUES (?, ?, ?)',
+                    (username, password_hash, utc_timestamp())
+                )
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    # --- History ---
+
+    def add_history(self, username, feature, details, timestamp=None):
+        """Append one history entry. Returns False if the user does not exist."""
+        return self.add_history_batch([(username, timestamp or utc_timestamp(), feature, details)]) == 1
+
+    def add_history_batch(self, entries):
+        """
+        Append many (username, timestamp, feature, details) entries in one
+        transaction, updating the usage aggregates alongside. Entries for
+        unknown users are skipped; returns the number of rows written.
+        """
+        with self._transaction() as conn:
+            known = _existing_users(conn, {entry[0] for entry in entries})
+            rows = [(username, timestamp, feature, json.dumps(details))
+                    for username, timestamp, feature, details in entries if username in known]
+            conn.executemany(
+                'INSERT INTO history (username, timestamp, feature, details) VALUES (?, ?, ?, ?)', rows
+            )
+            _record_usage(conn, rows)
+            _bump_history_rev(conn, known)
+            return len(rows)
+
+    def get_history(self, username):
+        """All history entries for a user, newest first (served from the index)."""
+        rows = self._connect().execute(
+            'SELECT timestamp, feature, details FROM history WHERE username = ? '
+            'ORDER BY timestamp DESC, id DESC',
+            (username,)
+        ).fetchall()
+        return [_history_entry(row) for row in rows]
+
+    def history_page(self, username, limit, before=None, feature=None, since=None, until=None):
+        """
+        One page of history, newest first. `before` is the (timestamp, id) of
+        the last entry of the previous page; `since` is inclusive and `until`
+        exclusive. Walks the (username, timestamp, id) index, so no sorting
+        happens per request. Returns (entries, next_before) where next_before
+        is None on the last page.
+        """
+        clauses = ['username = ?']
+        params = [username]
+        if before is not None:
+            clauses.append('(timestamp, id) < (?, ?)')
+            params.extend(before)
+        if feature:
+            clauses.append('feature = ?')
+            params.append(feature)
+        if since:
+            clauses.append('timestamp >= ?')
+            params.append(since)
+        if until:
+            clauses.append('timestamp < ?')
+            params.append(until)
+        rows = self._connect().execute(
+            'SELECT id, timestamp, feature, details FROM history WHERE ' + ' AND '.join(clauses) +
+            ' ORDER BY timestamp DESC, id DESC LIMIT ?',
+            params + [limit + 1]
+        ).fetchall()
+        next_before = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_before = (rows[-1]['timestamp'], rows[-1]['id'])
+        return [_history_entry(row) for row in rows], next_before
+
+    def history_rev(self, username):
+        """Revision counter bumped on every history change; None if the user does not exist."""
+        row = self._connect().execute(
+            'SELECT history_rev FROM users WHERE username = ?', (username,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def history_count(self, username):
+        # Raw rows still retained; usage totals in get_usage() also cover pruned ones
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM history WHERE username = ?', (username,)
+        ).fetchone()[0]
+
+    def prune_history(self, cutoff):
+        """
+        Delete raw history entries older than `cutoff` (a stored-format
+        timestamp). Their counts already live in the usage aggregates, so
+        totals stay exact. Returns the number of entries removed.
+        """
+        with self._transaction() as conn:
+            affected = [row[0] for row in conn.execute(
+                'SELECT DISTINCT username FROM history WHERE timestamp < ?', (cutoff,)
+            )]
+            if not affected:
+                return 0
+            removed = conn.execute('DELETE FROM history WHERE timestamp < ?', (cutoff,)).rowcount
+            _bump_history_rev(conn, affected)
+        logger.info(f"Pruned {removed} history entries older than {cutoff}")
+        return removed
+
+    # --- Usage aggregates ---
+
+    def get_usage(self, username, since_day=None):
+        """
+        Per-user, per-feature and per-day usage counters, maintained
+        incrementally on every history write. None if the user does not exist.
+        """
+        conn = self._connect()
+        row = conn.execute('SELECT usage_total FROM users WHERE username = ?', (username,)).fetchone()
+        if row is None:
+            return None
+        features = {
+            feature: count for feature, count in conn.execute(
+                'SELECT feature, count FROM usage_features WHERE username = ?', (username,)
+            )
+        }
+        daily = {}
+        for day, feature, count in conn.execute(
+                'SELECT day, feature, count FROM usage_daily WHERE username = ? AND day >= ? ORDER BY day',
+                (username, since_day or '')):
+            daily.setdefault(day, {})[feature] = count
+        return {'total': row[0], 'features': features, 'daily': daily}
+
+    def _backfill_usage(self):
+        # Databases written before the aggregates existed: derive them from raw history once
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'usage_backfilled'").fetchone():
+                return
+            conn.execute('DELETE FROM usage_features')
+            conn.execute('DELETE FROM usage_daily')
+            _record_usage(conn, conn.execute('SELECT username, timestamp, feature FROM history'), reset=True)
+            conn.execute("INSERT INTO meta (key, value) VALUES ('usage_backfilled', ?)", (utc_timestamp(),))
+
+    def _normalize_timestamps(self):
+        # Databases written before utc_timestamp() was fixed-width: entries that
+        # fell on a whole second were stored without '.ffffff' and sort after
+        # every other entry of that second
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'timestamps_normalized'").fetchone():
+                return
+            affected = [row[0] for row in conn.execute(
+                "SELECT DISTINCT username FROM history WHERE timestamp GLOB '????-??-??T??:??:??Z'"
+            )]
+            conn.execute(
+                "UPDATE history SET timestamp = substr(timestamp, 1, 19) || '.000000Z' "
+                "WHERE timestamp GLOB '????-??-??T??:??:??Z'"
+            )
+            _bump_history_rev(conn, affected)
+            conn.execute("INSERT INTO meta (key, value) VALUES ('timestamps_normalized', ?)", (utc_timestamp(),))
+
+    # --- Bulk import/export (legacy users.json shape) ---
+
+    def load_all(self):
+        users = {}
+        conn = self._connect()
+        for row in conn.execute('SELECT username, password_hash FROM users'):
+            users[row['username']] = {'password_hash': row['password_hash'], 'history': []}
+        for row in conn.execute(
+                'SELECT username, timestamp, feature, details FROM history ORDER BY id'):
+            users[row['username']]['history'].append(_history_entry(row))
+        return users
+
+    def save_all(self, users_data):
+        """Upsert users and replace their history with the given legacy-shaped dict."""
+        with self._transaction() as conn:
+            for username, data in users_data.items():
+                conn.execute(
+                    'INSERT INTO users (username, password_hash, created_at) VALUES (?, ?, ?) '
+                    'ON CONFLICT(username) DO UPDATE SET password_hash = excluded.password_hash',
+                    (username, data['password_hash'], utc_timestamp())
+                )
+                conn.execute('DELETE FROM history WHERE username = ?', (username,))
+                conn.execute('DELETE FROM usage_features WHERE username = ?', (username,))
+                conn.execute('DELETE FROM usage_daily WHERE username = ?', (username,))
+                conn.execute('UPDATE users SET usage_total = 0 WHERE username = ?', (username,))
+                _insert_legacy_history(conn, username, data.get('history'))
+            _bump_history_rev(conn, users_data.keys())
+
+    def migrate_from_json(self, json_path):
+        """
+        One-shot import of a legacy users.json file. Safe to call on every
+        startup: it is a no-op once the import has been recorded.
+        Returns the number of history entries imported.
+        """
+        if not os.path.exists(json_path):
+            return 0
+        with self._transaction() as conn:
+            done = conn.execute(
+                "SELECT value FROM meta WHERE key = 'users_json_migrated'"
+            ).fetchone()
+            if done:
+                return 0
+            try:
+                with open(json_path, 'r') as f:
+                    users = json.load(f)
+            except (json.JSONDecodeError, IOError) as e:
+                logger.error(f"Could not read {json_path} for migration: {e}")
+                return 0
+
+            imported = 0
+            for username, data in users.items():
+                if not data.get('password_hash'):
+                    logger.warning(f"Skipping user {username} without password hash during migration")
+                    continue
+                conn.execute(
+                    'INSERT OR IGNORE INTO users (username, password_hash, created_at) VALUES (?, ?, ?)',
+                    (username, data['password_hash'], utc_timestamp())
+                )
+                imported += _insert_legacy_history(conn, username, data.get('history'))
+                _bump_history_rev(conn, [username])
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('users_json_migrated', ?)",
+                (utc_timestamp(),)
+            )
+        logger.info(f"Migrated {len(users)} users and {imported} history entries from {json_path}")
+        return imported
+
+
+def _retry_busy(fn):
+    for attempt in range(BUSY_RETRIES):
+        try:
+            return fn()
+        except sqlite3.OperationalError as e:
+            message = str(e)
+            if ('locked' not in message and 'busy' not in message) or attempt == BUSY_RETRIES - 1:
+                raise
+            delay = min(2.0, 0.05 * 2 ** attempt) * random.uniform(0.5, 1.5)
+            logger.warning(f"User store busy ({message}); retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+
+def _history_entry(row):
+    return {
+        'timestamp': row['timestamp'],
+        'feature': row['feature'],
+        'details': json.loads(row['details']) if row['details'] else None
+    }
+
+
+def _existing_users(conn, usernames):
+    usernames = list(usernames)
+    known = set()
+    for i in range(0, len(usernames), 500):  # Stay under SQLite's bound-parameter limit
+        chunk = usernames[i:i + 500]
+        known.update(row[0] for row in conn.execute(
+            f"SELECT username FROM users WHERE username IN ({','.join('?' * len(chunk))})", chunk
+        ))
+    return known
+
+
+def _record_usage(conn, rows, reset=False):
+    # rows are (username, timestamp, feature, ...) tuples; counts are folded
+    # in Python first so each counter is upserted once per batch
+    features, daily, totals = Counter(), Counter(), Counter()
+    for row in rows:
+        username, timestamp, feature = row[0], row[1], row[2]
+        features[(username, feature)] += 1
+        daily[(username, timestamp[:10], feature)] += 1
+        totals[username] += 1
+    conn.executemany(
+        'INSERT INTO usage_features (username, feature, count) VALUES (?, ?, ?) '
+        'ON CONFLICT(username, feature) DO UPDATE SET count = count + excluded.count',
+        [(username, feature, count) for (username, feature), count in features.items()]
+    )
+    conn.executemany(
+        'INSERT INTO usage_daily (username, day, feature, count) VALUES (?, ?, ?, ?) '
+        'ON CONFLICT(username, day, feature) DO UPDATE SET count = count + excluded.count',
+        [(username, day, feature, count) for (username, day, feature), count in daily.items()]
+    )
+    if reset:
+        conn.execute('UPDATE users SET usage_total = 0')
+    conn.executemany(
+        'UPDATE users SET usage_total = usage_total + ? WHERE username = ?',
+        [(count, username) for username, count in totals.items()]
+    )
+
+
+def _bump_history_rev(conn, usernames):
+    conn.executemany(
+        'UPDATE users SET history_rev = history_rev + 1 WHERE username = ?',
+        [(username,) for username in usernames]
+    )
+
+
+def _legacy_timestamp(value):
+    # The JSON store wrote isoformat() + 'Z', which drops '.ffffff' on whole seconds
+    if not value:
+        return utc_timestamp()
+    try:
+        return normalize_timestamp(str(value))
+    except ValueError:
+        logger.warning(f"Replacing unparseable history timestamp {value!r} during import")
+        return utc_timestamp()
+
+
+def _insert_legacy_history(conn, username, history):
+    if not isinstance(history, list):
+        return 0
+    rows = [
+        (username, _legacy_timestamp(entry.get('timestamp')), entry.get('feature', 'unknown'),
+         json.dumps(entry.get('details')))
+        for entry in history if isinstance(entry, dict)
+    ]
+    conn.executemany(
+        'INSERT INTO history (username, timestamp, feature, details) VALUES (?, ?, ?, ?)', rows
+    )
+    _record_usage(conn, rows)
+    return len(rows)
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='User store maintenance')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate = subparsers.add_parser('migrate', help='Import a legacy users.json into the SQLite store')
+    migrate.add_argument('--json', default=os.path.join(here, 'users.json'))
+    migrate.add_argument('--db', default=os.environ.get('USERS_DB', os.path.join(here, 'users.db')))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.command == 'migrate':
+        imported = UserStore(args.db).migrate_from_json(args.json)
+        print(f"Imported {imported} history entries into {args.db}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""
+The Google TTS voice catalog, fetched once and indexed.
+
+list_voices() returns a few hundred voices and changes a few times a year, so
+the catalog is fetched on first use and kept for `ttl` seconds. After that,
+readers keep getting the old catalog while one background thread fetches the
+new one; a failed refresh is retried `retry_interval` seconds later. Every
+fetch is also written to `snapshot_path`, which a new worker serves until its
+own first refresh, so a cold start does not wait on the API.
+
+A Catalog is never modified once built, so readers need no lock. It is
+indexed by language (full code and base, "fr-FR" and "fr"), gender and
+accent, and query() intersects index entries rather than scanning voices.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from process_hooks import after_fork_in_child
+
+logger = logging.getLogger(__name__)
+
+ACCENTS = {
+    'en-US': 'American',
+    'en-GB': 'British',
+    'en-AU': 'Australian',
+    'en-IN': 'Indian'
+}
+GENDERS = {'MALE': 'Male', 'FEMALE': 'Female'}
+FILTERS = ('language', 'gender', 'accent')
+# Distinct queries whose result is kept per catalog
+QUERY_MEMO_SIZE = 256
+
+
+def voice_entry(name, language_codes, gender):
+    """A voice as /api/voices returns it; `gender` is an SsmlVoiceGender name."""
+    language = language_codes[0]
+    return {
+        'id': name,
+        'name': name.split('-')[-1],
+        'accent': ACCENTS.get(language, language),
+        'gender': GENDERS.get(gender, 'Neutral'),
+        'language': language
+    }
+
+
+def fetch_voices(client):
+    from google.cloud import texttospeech
+    response = client.list_voices()
+    return [voice_entry(voice.name, list(voice.language_codes), texttospeech.SsmlVoiceGender(voice.ssml_gender).name)
+            for voice in response.voices]
+
+
+class Catalog:
+    def __init__(self, voices, fetched_at):
+        self.voices = tuple(sorted(voices, key=lambda voice: voice['id']))
+        self.fetched_at = fetched_at
+        self.etag = hashlib.sha256(json.dumps(self.voices, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        index = {}
+        for position, voice in enumerate(self.voices):
+            language = voice['language'].lower()
+            keys = {('language', language), ('language', language.split('-')[0]),
+                    ('gender', voice['gender'].lower()), ('accent', voice['accent'].lower())}
+            for key in keys:
+                index.setdefault(key, []).append(position)
+        self.index = {key: frozenset(positions) for key, positions in index.items()}
+        self._memo = {}
+        self._ssml_voices = None
+
+    def query(self, language=None, gender=None, accent=None):
+        """Voices matching every filter given (case-insensitive), in id order."""
+        key = tuple(value.lower() if value else None for value in (language, gender, accent))
+        voices = self._memo.get(key)
+        if voices is None:
+            positions = None
+            for field, value in zip(FILTERS, key):
+                if value is not None:
+                    matches = self.index.get((field, value), frozenset())
+                    positions = matches if positions is None else positions & matches
+            voices = list(self.voices) if positions is None else [self.voices[i] for i in sorted(positions)]
+            if len(self._memo) >= QUERY_MEMO_SIZE:
+                self._memo.clear()
+            self._memo[key] = voices
+        return voices
+
+    def ssml_voices(self, language_codes, preferred):
+        """
+        A voice for each language code, for SSML <voice> tags: the one in
+        `preferred` if the catalog has it, else the catalog's first Standard
+        voice in that language. Languages with no voice are left out. Worked
+        out on the first call; the arguments are expected not to change.
+        """
+        if self._ssml_voices is None:
+            ids = {voice['id'] for voice in self.voices}
+            voices = {}
+            for code in language_codes:
+                if preferred.get(code) in ids:
+                    voices[code] = preferred[code]
+                    continue
+                candidates = [voice['id'] for voice in self.query(language=code)]
+                standard = [name for name in candidates if '-Standard-' in name]
+                if standard or candidates:
+                    voices[code] = (standard or candidates)[0]
+            self._ssml_voices = voices
+        return self._ssml_voices
+
+
+class VoiceCatalog:
+    def __init__(self, fetch, ttl=24 * 3600, retry_interval=300, snapshot_path=None):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self.snapshot_path = snapshot_path
+        self._catalog = None
+        self.fetches = 0
+        self.failed_refreshes = 0
+        self.last_error = None
+        self._reset()
+        # A refresh running in the parent has no thread to finish it in a child
+        after_fork_in_child(self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._next_attempt = 0.0
+
+    def peek(self):
+        """The catalog if one is loaded, without fetching."""
+        return self._catalog
+
+    def get(self):
+        """
+        The catalog, from the snapshot or the API on first use (raising if
+        neither has one), and refreshed in the background once stale.
+        """
+        if self._catalog is None:
+            with self._lock:
+                if self._catalog is None:
+                    self._catalog = self._load_snapshot() or self._fetch()
+        catalog = self._catalog
+        if time.time() - catalog.fetched_at >= self.ttl:
+            self._refresh_in_background()
+        return catalog
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing or time.time() < self._next_attempt:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name='voice-catalog-refresh', daemon=True).start()
+
+    def _refresh(self):
+        try:
+            self._catalog = self._fetch()
+        except Exception as e:
+            self.failed_refreshes += 1
+            self.last_error = str(e)
+            self._next_attempt = time.time() + self.retry_interval
+            logger.warning(f"Voice catalog refresh failed, serving the previous one: {str(e)}")
+        finally:
+            self._refreshing = False
+
+    def _fetch(self):
+        start = time.perf_counter()
+        catalog = Catalog(self.fetch(), time.time())
+        self.fetches += 1
+        logger.info(f"Fetched {len(catalog.voices)} voices in {(time.perf_counter() - start) * 1000:.0f} ms")
+        self._write_snapshot(catalog)
+        return catalog
+
+    def _load_snapshot(self):
+        if not self.snapshot_path:
+            return None
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+            catalog = Catalog(snapshot['voices'], snapshot['fetched_at'])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable voice catalog snapshot {self.snapshot_path}: {str(e)}")
+            return None
+        logger.info(f"Loaded {len(catalog.voices)} voices from {self.snapshot_path}")
+        return catalog
+
+    def _write_snapshot(self, catalog):
+        if not self.snapshot_path:
+            return
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.snapshot_path)),
+                                            prefix='.tmp-voices-')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'fetched_at': catalog.fetched_at, 'voices': list(catalog.voices)}, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            logger.error(f"Failed to write voice catalog snapshot: {str(e)}")
+
+    def stats(self):
+        catalog = self._catalog
+        return {
+            'loaded': catalog is not None,
+            'voices': len(catalog.voices) if catalog else 0,
+            'age_seconds': round(time.time() - catalog.fetched_at) if catalog else None,
+            'ttl_seconds': self.ttl,
+            'fetches': self.fetches,
+            'failed_refreshes': self.failed_refreshes,
+            'last_error': self.last_error
+        }
@@ -26,13 +26,17 @@ const accountLinks = [
 export function Header() {
 	const { user, logout } = useAuth(); // Assuming useAuth provides user and logout
 	const [history, setHistory] = useState<HistoryItem[]>([]);
+	const [nextCursor, setNextCursor] = useState<string | null>(null);
+	const [isLoadingMore, setIsLoadingMore] = useState(false);
 	const [isHistoryOpen, setIsHistoryOpen] = useState(false);
 
-	const fetchHistory = async () => {
+	// The backend returns history a page at a time; `cursor` continues with older entries
+	const fetchHistory = async (cursor?: string) => {
 		if (user) {
 			try {
-				const historyData = await getUserHistory();
-				setHistory(historyData.history);
+				const historyData = await getUserHistory({ cursor });
+				setHistory((previous) => (cursor ? [...previous, ...historyData.history] : historyData.history));
+				setNextCursor(historyData.next_cursor ?? null);
 			} catch (error: any) {
 				console.error('Failed to fetch history:', error);
 				toast({
@@ -44,6 +48,16 @@ export function Header() {
 		}
 	};
 
+	const loadMoreHistory = async () => {
+		if (!nextCursor) return;
+		setIsLoadingMore(true);
+		try {
+			await fetchHistory(nextCursor);
+		} finally {
+			setIsLoadingMore(false);
+		}
+	};
+
 	useEffect(() => {
 		if (isHistoryOpen && user) {
 			fetchHistory();
@@ -202,6 +216,16 @@ export function Header() {
 													)}
 												</Link>
 											))}
+											{nextCursor && (
+												<Button
+													variant="outline"
+													className="w-full"
+													onClick={loadMoreHistory}
+													disabled={isLoadingMore}
+												>
+													{isLoadingMore ? 'Loading...' : 'Load more'}
+												</Button>
+											)}
 										</div>
 									) : (
 										<p className="text-sm text-muted-foreground">No history yet.</p>
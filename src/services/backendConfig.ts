@@ -28,10 +28,10 @@ export const handleApiError = (error: unknown): Error => {
   return new Error('An unknown error occurred while communicating with the server');
 };
 
-// Check if the backend is accessible
+// Check if the backend is accessible (liveness only: answered from memory, never calls upstream)
 export const checkBackendConnectivity = async (): Promise<boolean> => {
   try {
-    console.log('Checking backend connectivity to:', getApiUrl('/api/health'));
+    console.log('Checking backend connectivity to:', getApiUrl('/api/health/live'));
     
     const controller = new AbortController();
     const timeoutId = setTimeout(() => {
@@ -39,7 +39,7 @@ export const checkBackendConnectivity = async (): Promise<boolean> => {
       controller.abort();
     }, 8000); // Increase timeout to 8 seconds
     
-    const response = await fetch(getApiUrl('/api/health'), {
+    const response = await fetch(getApiUrl('/api/health/live'), {
       method: 'GET',
       signal: controller.signal,
       // Ensure we're not affected by browser caching
@@ -54,28 +54,6 @@ export const checkBackendConnectivity = async (): Promise<boolean> => {
     
     console.log('Backend connectivity check response:', response.status, response.statusText);
     
-    // Try to get the response body for more information
-    try {
-      const responseBody = await response.json();
-      console.log('Backend health check details:', responseBody);
-      
-      // If we get a valid health check response with services
-      if (responseBody && responseBody.services) {
-        // Check specifically if TTS service is available
-        const ttsAvailable = responseBody.services.tts === 'available';
-        console.log('TTS service available:', ttsAvailable);
-        
-        if (!ttsAvailable) {
-          console.warn('TTS service is not available according to health check');
-        }
-        
-        // Still return true if overall health is OK, even if some services are limited
-        return response.ok;
-      }
-    } catch (e) {
-      console.log('Could not parse health check response body', e);
-    }
-    
     return response.ok;
   } catch (error) {
     console.error('Backend connectivity check failed with error:', error);
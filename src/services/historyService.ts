@@ -8,10 +8,26 @@ export interface HistoryItem {
 
 export interface UserHistoryResponse {
   history: HistoryItem[];
+  next_cursor?: string | null; // Pass back as `cursor` to fetch the next (older) page
 }
 
-export const getUserHistory = async (): Promise<UserHistoryResponse> => {
-  const response = await fetch(getApiUrl('/api/history'), {
+export interface HistoryQuery {
+  limit?: number;
+  cursor?: string;
+  feature?: string;
+  since?: string; // ISO 8601, inclusive
+  until?: string; // ISO 8601, exclusive
+}
+
+export const getUserHistory = async (query: HistoryQuery = {}): Promise<UserHistoryResponse> => {
+  const params = new URLSearchParams();
+  Object.entries(query).forEach(([key, value]) => {
+    if (value !== undefined && value !== null && value !== '') {
+      params.set(key, String(value));
+    }
+  });
+  const queryString = params.toString();
+  const response = await fetch(getApiUrl(`/api/history${queryString ? `?${queryString}` : ''}`), {
     method: 'GET',
     headers: {
       'Content-Type': 'application/json',